@@ -0,0 +1,189 @@
+### Benchmark runner for preprocess.py
+###
+### For every scale it generates (or reuses) a synthetic crawl with generate_lastfm.py, runs preprocess.main()
+### in a fresh process per repeat and records the time of each stage (instrumentation.STAGES) and the peak RSS.
+### Results are compared against a stored baseline; a stage that got slower, or a peak RSS that grew, by more
+### than the tolerance is reported as a regression and makes the run exit with status 1.
+###
+### Usage:
+###   python bench_preprocess.py --songs 1000 10000 --save-baseline   # record a baseline on this machine
+###   python bench_preprocess.py --songs 1000 10000                    # compare against it
+###   python bench_preprocess.py --songs 100000 -- --workers 4         # args after -- go to preprocess.py
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+BACKEND_DIR = BENCH_DIR.parent
+DATA_DIR = BENCH_DIR / "data"
+BASELINE_JSON = BENCH_DIR / "baseline.json"
+RESULTS_JSON = DATA_DIR / "results.json"
+
+DEFAULT_SONGS = [1_000, 10_000]
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2  # allowed relative slowdown / memory growth before a regression is reported
+MIN_STAGE_SECONDS = 0.05  # stages faster than this (in the baseline) are too noisy to compare
+
+# ----- Running one measurement -----
+
+def peak_rss_mb() -> float:
+    # peak of this process and of any worker processes it waited for (ru_maxrss is KB on Linux, bytes on macOS)
+    scale = 1 / 1024 if sys.platform != "darwin" else 1 / 1024**2
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale
+
+def run_child(out_dir: str, catalog: bool, preprocess_args: list[str]) -> dict:
+    """
+    Runs preprocess.main() in this process (called in a fresh interpreter, see measure()).
+    The inputs are read from the parent of out_dir, like preprocess.py's ../ defaults.
+    """
+    sys.path.insert(0, str(BACKEND_DIR))
+    os.chdir(out_dir)
+
+    import preprocess
+    import instrumentation
+
+    # --quiet: no progress bars or logging, keep only the numbers
+    start = time.perf_counter()
+    preprocess.main(["--quiet"] + (["--catalog"] if catalog else []) + preprocess_args)
+    total = time.perf_counter() - start
+
+    stages = {name: report.wall_seconds for name, report in instrumentation.STAGES.items()}
+    return {"stages": stages, "total": total, "peak_rss_mb": peak_rss_mb()}
+
+def measure(data_dir: Path, catalog: bool, preprocess_args: list[str]) -> dict:
+    out_dir = data_dir / "out"
+    out_dir.mkdir(exist_ok=True)
+
+    command = [sys.executable, __file__, "--child", str(out_dir)] + (["--catalog"] if catalog else []) + ["--"] + preprocess_args
+    result = subprocess.run(command, check=True, capture_output=True, text=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def summarize(runs: list[dict]) -> dict:
+    # median time per stage over the repeats, worst peak RSS
+    stages = {name: statistics.median(run["stages"].get(name, 0.0) for run in runs) for name in runs[0]["stages"]}
+    return {
+        "stages": stages,
+        "total": statistics.median(run["total"] for run in runs),
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "repeat": len(runs),
+    }
+
+def bench_scale(songs: int, seed: int, repeat: int, catalog: bool, preprocess_args: list[str]) -> dict:
+    from generate_lastfm import generate
+
+    data_dir = DATA_DIR / f"{songs}_songs_seed{seed}"
+    if not (data_dir / "artist_top_tracks.json").exists():
+        print(f"Generating {songs} songs into {data_dir}...")
+        generate(data_dir, songs, seed)
+
+    runs = []
+    for i in range(repeat):
+        runs.append(measure(data_dir, catalog, preprocess_args))
+        print(f"  {songs} songs, run {i + 1}/{repeat}: {runs[-1]['total']:.2f}s, {runs[-1]['peak_rss_mb']:.0f} MB")
+    return summarize(runs)
+
+# ----- Comparing against the baseline -----
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Lines describing every stage/total/peak RSS that is more than tolerance worse than the baseline.
+    Scales missing from the baseline are skipped.
+    """
+    regressions = []
+
+    for scale, result in results["scales"].items():
+        base = baseline["scales"].get(scale)
+        if base is None:
+            print(f"{scale} songs: no baseline, skipped")
+            continue
+
+        print(f"{scale} songs:")
+        checks = [(f"stage {name}", seconds, base["stages"].get(name), "s") for name, seconds in result["stages"].items()]
+        checks.append(("total", result["total"], base["total"], "s"))
+        checks.append(("peak RSS", result["peak_rss_mb"], base["peak_rss_mb"], " MB"))
+
+        for label, value, base_value, unit in checks:
+            if base_value is None:
+                print(f"  {label:24} {value:10.3f}{unit}  (new)")
+                continue
+
+            change = (value - base_value) / base_value if base_value else 0.0
+            noisy = unit == "s" and base_value < MIN_STAGE_SECONDS
+            regressed = change > tolerance and not noisy
+            print(f"  {label:24} {value:10.3f}{unit}  baseline {base_value:10.3f}{unit}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{scale} songs {label}: {base_value:.3f}{unit} -> {value:.3f}{unit} ({change:+.1%})")
+
+    return regressions
+
+# ----- Main -----
+
+def parse_args(argv: list[str] | None = None) -> tuple[argparse.Namespace, list[str]]:
+    argv = sys.argv[1:] if argv is None else argv
+    preprocess_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, preprocess_args = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Benchmark preprocess.py on synthetic data and compare against a baseline.")
+    parser.add_argument("--songs", type=int, nargs="+", default=DEFAULT_SONGS, help="scales to benchmark (songs per crawl)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per scale (median time is kept)")
+    parser.add_argument("--catalog", action="store_true", help="benchmark the catalog path (preprocess.py --catalog)")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_JSON)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--child", metavar="OUT_DIR", help=argparse.SUPPRESS)
+    return parser.parse_args(argv), preprocess_args
+
+def main(argv: list[str] | None = None):
+    args, preprocess_args = parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_child(args.child, args.catalog, preprocess_args)))
+        return
+
+    sys.path.insert(0, str(BENCH_DIR))
+    results = {
+        "config": {"seed": args.seed, "catalog": args.catalog, "preprocess_args": preprocess_args},
+        "scales": {str(songs): bench_scale(songs, args.seed, args.repeat, args.catalog, preprocess_args) for songs in args.songs},
+    }
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    with open(RESULTS_JSON, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"] != results["config"]:
+        print(f"Warning: baseline was recorded with {baseline['config']}, this run used {results['config']}")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+    print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
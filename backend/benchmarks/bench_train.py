@@ -0,0 +1,196 @@
+### Training throughput benchmark for ArtistSongRecModel on synthetic tensors
+###
+### For every catalog size it builds a random dataset (song/artist ids, playcounts, listeners, packed genre flags)
+### of that many songs, then times the same training step trainModel.py runs (trainModel.trainStep) with
+### profiling.profileSteps: samples/sec, ms per step and its data/forward/backward/optimizer split. No crawl,
+### preprocessing or GPU needed, so changes to the model or the step can be measured in CI.
+### Results are compared against a stored baseline like bench_preprocess.py; a slower step (or phase) by more
+### than the tolerance is reported as a regression and makes the run exit with status 1.
+###
+### Usage:
+###   python bench_train.py --songs 5000 1000000 --save-baseline     # record a baseline on this machine
+###   python bench_train.py --songs 5000 1000000                     # compare against it
+###   python bench_train.py --songs 1000000 -- --sparse-embeddings   # args after -- go to trainModel.py
+
+import argparse
+import json
+import statistics
+import sys
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+MODEL_DIR = BENCH_DIR.parent / "musicModel"
+DATA_DIR = BENCH_DIR / "data"
+BASELINE_JSON = BENCH_DIR / "train_baseline.json"
+RESULTS_JSON = DATA_DIR / "train_results.json"
+
+DEFAULT_SONGS = [5_000, 100_000]
+DEFAULT_ROWS = 50_000  # training rows per scale (rows are drawn from the catalog, so steps cost the same at every size)
+DEFAULT_STEPS = 100
+DEFAULT_WARMUP = 10
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+SONGS_PER_ARTIST = 5
+NUM_GENRES = 58
+GENRES_PER_SONG = 4
+MIN_PHASE_MS = 0.2  # phases faster than this (in the baseline) are too noisy to compare
+
+sys.path.insert(0, str(MODEL_DIR))
+
+import numpy as np
+import torch
+from columnar import pack_bits
+from datasets import TrainTestVal, BatchLoader
+from model import ArtistSongRecModel
+from profiling import profileSteps, formatReport
+import trainModel
+
+# ----- Synthetic data -----
+
+class SyntheticSongs(TrainTestVal):
+    """
+    Same tensors (and __getitem__) as a TrainTestVal read from preprocessing, filled with random rows.
+    """
+
+    def __init__(self, numSongs: int, numArtists: int, rows: int, seed: int):
+        rng = np.random.default_rng(seed)
+        songs = rng.integers(0, numSongs, rows)
+        listeners = rng.lognormal(8, 2, rows).astype(np.float32)
+
+        genreFlags = np.zeros((rows, NUM_GENRES), dtype=np.int8)
+        genreFlags[np.arange(rows)[:, None], rng.integers(0, NUM_GENRES, (rows, GENRES_PER_SONG))] = 1
+
+        self.numGenres = NUM_GENRES
+        self.songIndex = torch.from_numpy(songs.astype(np.int64))
+        self.artistIndex = torch.from_numpy((songs % numArtists).astype(np.int64))
+        self.listeners = torch.from_numpy(listeners)
+        self.playcounts = torch.from_numpy((listeners * rng.lognormal(1, 1, rows)).astype(np.float32))
+        self.genreBits = torch.from_numpy(pack_bits(genreFlags).view(np.int64))
+
+# ----- Running one measurement -----
+
+def bench_scale(songs: int, args: argparse.Namespace, train_args: argparse.Namespace) -> dict:
+    torch.manual_seed(args.seed)
+    artists = max(1, songs // SONGS_PER_ARTIST)
+    dataset = SyntheticSongs(songs, artists, args.rows, args.seed)
+    loader = BatchLoader(dataset, train_args.batch_size, shuffle=True, generator=torch.Generator().manual_seed(args.seed))
+
+    device = torch.device("cpu")
+    runs = []
+    for i in range(args.repeat):
+        # a fresh model and optimizer state per repeat, so every run starts from the same point
+        model = ArtistSongRecModel(numSongs=songs, numArtists=artists, numGenres=NUM_GENRES,
+                                   songArtistEmbedSize=train_args.song_artist_embed, genreEmbedSize=train_args.genre_embed,
+                                   HLSize=train_args.hidden, sparse=train_args.sparse_embeddings).to(device)
+        model.train()
+        optimizers = trainModel.buildOptimizers(model, train_args)
+        poisson = torch.nn.PoissonNLLLoss(log_input=True, full=False, reduction="sum")
+        step = lambda batch, mark: trainModel.trainStep(model, model, optimizers, poisson, batch, device, train_args, mark=mark)
+
+        trace = DATA_DIR / f"train_trace_{songs}.json" if args.trace and i == 0 else None
+        runs.append(profileSteps(step, loader, device, args.warmup, args.steps, trace))
+        print(f"  {songs} songs, run {i + 1}/{args.repeat}: " + formatReport(runs[-1]).replace("\n", "\n    "))
+
+    # median over the repeats
+    return {
+        "samples_per_second": statistics.median(run["samples_per_second"] for run in runs),
+        "ms_per_step": statistics.median(run["ms_per_step"] for run in runs),
+        "phases": {phase: statistics.median(run["phases"][phase]["ms_per_step"] for run in runs) for phase in runs[0]["phases"]},
+        "repeat": len(runs),
+    }
+
+# ----- Comparing against the baseline -----
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Lines describing every step/phase time that is more than tolerance worse than the baseline.
+    Scales missing from the baseline are skipped.
+    """
+    regressions = []
+
+    for scale, result in results["scales"].items():
+        base = baseline["scales"].get(scale)
+        if base is None:
+            print(f"{scale} songs: no baseline, skipped")
+            continue
+
+        print(f"{scale} songs:")
+        checks = [(f"phase {phase}", ms, base["phases"].get(phase)) for phase, ms in result["phases"].items()]
+        checks.append(("step", result["ms_per_step"], base["ms_per_step"]))
+
+        for label, value, base_value in checks:
+            if base_value is None:
+                print(f"  {label:24} {value:10.3f}ms  (new)")
+                continue
+
+            change = (value - base_value) / base_value if base_value else 0.0
+            noisy = base_value < MIN_PHASE_MS
+            regressed = change > tolerance and not noisy
+            print(f"  {label:24} {value:10.3f}ms  baseline {base_value:10.3f}ms  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append(f"{scale} songs {label}: {base_value:.3f}ms -> {value:.3f}ms ({change:+.1%})")
+
+    return regressions
+
+# ----- Main -----
+
+def parse_args(argv: list[str] | None = None) -> tuple[argparse.Namespace, list[str]]:
+    argv = sys.argv[1:] if argv is None else argv
+    train_args = []
+    if "--" in argv:
+        split = argv.index("--")
+        argv, train_args = argv[:split], argv[split + 1:]
+
+    parser = argparse.ArgumentParser(description="Benchmark training steps on synthetic data and compare against a baseline.")
+    parser.add_argument("--songs", type=int, nargs="+", default=DEFAULT_SONGS, help="catalog sizes to benchmark")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="training rows per catalog")
+    parser.add_argument("--steps", type=int, default=DEFAULT_STEPS, help="timed steps per run")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP, help="untimed steps before them")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="runs per catalog size (median is kept)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's own)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace", action="store_true", help=f"save a torch.profiler trace of each size's first run in {DATA_DIR}")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_JSON)
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    return parser.parse_args(argv), train_args
+
+def main(argv: list[str] | None = None):
+    args, train_argv = parse_args(argv)
+    train_args = trainModel.parseArgs(train_argv)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    config = {"rows": args.rows, "steps": args.steps, "warmup": args.warmup, "seed": args.seed,
+              "threads": torch.get_num_threads(), "train_args": train_argv}
+    results = {"config": config, "scales": {str(songs): bench_scale(songs, args, train_args) for songs in args.songs}}
+
+    with open(RESULTS_JSON, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}, run with --save-baseline first")
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["config"] != results["config"]:
+        print(f"Warning: baseline was recorded with {baseline['config']}, this run used {results['config']}")
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions:")
+        for line in regressions:
+            print("  " + line)
+        sys.exit(1)
+    print("\nNo regressions")
+
+if __name__ == "__main__":
+    main()
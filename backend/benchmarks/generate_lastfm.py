@@ -0,0 +1,173 @@
+### Synthetic Last.fm crawl generator for benchmarking preprocess.py
+###
+### Writes artist_top_tracks.json / track_tags.json shaped like the real crawl (artist.getTopTracks and
+### track.getTopTags responses keyed by artist name) at any scale, without needing the LFS blob.
+### Tag popularity follows the taggings counts of the top tags in ws.audioscrobbler.com.json, with a long
+### tail of rare tags after them (starting with any of preprocess.GENRES the top tags miss), and per-song
+### tag counts decay from 100 like Last.fm's normalized counts.
+###
+### Usage: python generate_lastfm.py --songs 100000 --out benchmarks/data/100k
+
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import uuid
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from preprocess import GENRES
+
+TOP_TAGS_JSON = Path(__file__).resolve().parents[2] / "ws.audioscrobbler.com.json"
+
+# shape of the crawl (rough figures from the real data)
+MEAN_TRACKS_PER_ARTIST = 30  # artist.getTopTracks pages, log-normally spread around this
+MAX_TRACKS_PER_ARTIST = 50
+MEAN_TAGS_PER_SONG = 8  # track.getTopTags lengths are geometric-ish, capped at 100
+MAX_TAGS_PER_SONG = 100
+TAIL_TAGS = 2000  # rare tags after the ones in TOP_TAGS_JSON (zipf weighted)
+NA_MBID_ARTIST_RATE = 0.05
+NA_MBID_SONG_RATE = 0.1
+NO_TAGS_SONG_RATE = 0.15  # songs with no entry in track_tags.json at all
+EMPTY_TAGS_SONG_RATE = 0.05  # songs whose entry is an empty list
+DUPLICATE_SONG_NAME_RATE = 0.02  # same song name twice in an artist's top tracks
+DUPLICATE_ARTIST_MBID_RATE = 0.005  # two artist names sharing one mbid
+
+def load_tag_weights(top_tags_json: Path = TOP_TAGS_JSON, tail_tags: int = TAIL_TAGS) -> tuple[list[str], np.ndarray]:
+    """
+    Tag names and their sampling probabilities: the top tags weighted by their taggings,
+    then the accepted genres missing from them and made up tags continuing the curve with a zipf falloff
+    (tail_tags in all).
+    """
+    with open(top_tags_json, "r", encoding="utf-8") as f:
+        top = json.load(f)["tags"]["tag"]
+
+    names = [tag["name"] for tag in top]
+    weights = [float(tag["taggings"]) for tag in top]
+
+    known = set(names)
+    tail = [genre for genre in GENRES if genre not in known]
+    tail += [f"tag {i}" for i in range(1, tail_tags - len(tail) + 1)]
+
+    last = weights[-1]
+    for i, name in enumerate(tail, start=1):
+        names.append(name)
+        weights.append(last / (1 + i / 10))
+
+    weights = np.array(weights)
+    return names, weights / weights.sum()
+
+def make_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def tag_counts(rng: random.Random, n: int) -> list[int]:
+    # normalized like Last.fm: the top tag is 100, the rest decay from it
+    decay = rng.uniform(0.6, 0.9)
+    return [100] + [max(1, int(100 * decay ** (i + rng.random()))) for i in range(n - 1)]
+
+def make_artist(rng: random.Random, np_rng: np.random.Generator, name: str, mbid: str,
+                tag_names: list[str], tag_probs: np.ndarray) -> tuple[list[dict], dict[str, list[dict]]]:
+    n_tracks = min(MAX_TRACKS_PER_ARTIST, max(1, int(rng.lognormvariate(math.log(MEAN_TRACKS_PER_ARTIST), 0.6))))
+    artist_ref = {"name": name, "url": f"https://www.last.fm/music/{name}"}
+    if mbid:
+        artist_ref["mbid"] = mbid
+
+    tracks, tags = [], {}
+    for rank in range(n_tracks):
+        song_name = f"{name} Song {rank}"
+        if rank and rng.random() < DUPLICATE_SONG_NAME_RATE:
+            song_name = f"{name} Song {rng.randrange(rank)}"
+
+        # playcounts fall off with rank like a top tracks page
+        listeners = int(rng.paretovariate(1.2) * 1000 / (rank + 1))
+        track = {
+            "name": song_name,
+            "playcount": str(listeners * rng.randint(2, 12)),
+            "listeners": str(listeners),
+            "url": f"https://www.last.fm/music/{name}/_/{song_name}",
+            "streamable": "0",
+            "artist": artist_ref,
+            "image": [{"#text": "", "size": size} for size in ("small", "medium", "large", "extralarge")],
+            "@attr": {"rank": str(rank + 1)},
+        }
+        if rng.random() >= NA_MBID_SONG_RATE:
+            track["mbid"] = make_uuid(rng)
+        tracks.append(track)
+
+        roll = rng.random()
+        if roll < NO_TAGS_SONG_RATE:
+            continue
+        if roll < NO_TAGS_SONG_RATE + EMPTY_TAGS_SONG_RATE:
+            tags[song_name] = []
+            continue
+
+        n_tags = min(MAX_TAGS_PER_SONG, len(tag_names), int(np_rng.geometric(1 / MEAN_TAGS_PER_SONG)))
+        chosen = np_rng.choice(len(tag_names), size=n_tags, replace=False, p=tag_probs)
+        tags[song_name] = [{"name": tag_names[i], "count": count, "url": f"https://www.last.fm/tag/{tag_names[i]}"}
+                           for i, count in zip(chosen, tag_counts(rng, n_tags))]
+
+    return tracks, tags
+
+def generate(out_dir, songs: int, seed: int = 0) -> tuple[int, int]:
+    """
+    Write artist_top_tracks.json and track_tags.json into out_dir with about songs tracks in total.
+    Artists are streamed to disk one at a time, so memory stays flat at any scale.
+    Returns (artists, songs) actually written.
+    """
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    tag_names, tag_probs = load_tag_weights()
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    n_artists, n_songs = 0, 0
+    previous_mbid = None
+    with open(out_dir / "artist_top_tracks.json", "w", encoding="utf-8") as tracks_file, \
+         open(out_dir / "track_tags.json", "w", encoding="utf-8") as tags_file:
+        tracks_file.write("{")
+        tags_file.write("{")
+
+        while n_songs < songs:
+            name = f"Artist {n_artists}"
+            if rng.random() < NA_MBID_ARTIST_RATE:
+                mbid = ""
+            elif previous_mbid and rng.random() < DUPLICATE_ARTIST_MBID_RATE:
+                mbid = previous_mbid
+            else:
+                mbid = make_uuid(rng)
+            previous_mbid = mbid or previous_mbid
+
+            tracks, tags = make_artist(rng, np_rng, name, mbid, tag_names, tag_probs)
+            tracks = tracks[:songs - n_songs]
+
+            separator = "," if n_artists else ""
+            tracks_file.write(f"{separator}\n{json.dumps(name)}: {json.dumps(tracks)}")
+            tags_file.write(f"{separator}\n{json.dumps(name)}: {json.dumps(tags)}")
+
+            n_artists += 1
+            n_songs += len(tracks)
+
+        tracks_file.write("\n}\n")
+        tags_file.write("\n}\n")
+
+    return n_artists, n_songs
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate a synthetic Last.fm crawl for benchmarking preprocess.py.")
+    parser.add_argument("--songs", type=int, default=10_000, help="number of tracks to generate (1k to 1M is sensible)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.join(os.path.dirname(__file__), "data", "synthetic"),
+                        help="directory to write artist_top_tracks.json and track_tags.json into")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    n_artists, n_songs = generate(args.out, args.songs, args.seed)
+    print(f"Wrote {n_songs} songs by {n_artists} artists to {args.out}")
+
+if __name__ == "__main__":
+    main()
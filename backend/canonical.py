@@ -0,0 +1,55 @@
+### Genre canonicalization: maps the spellings of one genre ("Hip-Hop", "hip hop", "hiphop") to a single name
+###
+### A tag name is case-folded and its separators (spaces, '-', '_') collapsed to single spaces, then looked up
+### in the alias table for spellings folding alone doesn't catch ("kpop" vs "k pop", "r&b" vs "rnb").
+### The table is compiled once into a dict of folded spelling -> canonical name, and results are memoized per
+### raw tag since the same free-text tags repeat across the whole crawl.
+
+import re
+import sys
+from functools import lru_cache
+
+# canonical name -> other spellings (compared after folding)
+GENRE_ALIASES = {
+    "hip hop": ["hiphop", "hip hop music"],
+    "kpop": ["k pop", "korean pop"],
+    "rnb": ["r&b", "r'n'b", "r n b", "rhythm and blues"],
+    "synthpop": ["synth pop"],
+    "electropop": ["electro pop"],
+    "hyperpop": ["hyper pop"],
+    "dream pop": ["dreampop"],
+    "nu metal": ["numetal"],
+    "post punk": ["postpunk"],
+    "post hardcore": ["posthardcore"],
+    "pop punk": ["poppunk"],
+    "shoegaze": ["shoegazing", "shoegazer"],
+    "neo soul": ["neosoul"],
+    "neo psychedelia": ["neopsychedelia", "neo psychedelic"],
+    "alt pop": ["altpop"],
+    "metalcore": ["metal core"],
+    "reggaeton": ["reggeaton", "regueton"],
+    "progressive rock": ["prog rock"],
+}
+
+SEPARATORS = re.compile(r"[\s\-_]+")
+
+def fold_genre(name: str) -> str:
+    return SEPARATORS.sub(" ", name.casefold()).strip()
+
+def compile_aliases(aliases: dict[str, list[str]]) -> dict[str, str]:
+    table = dict[str, str]()
+    for canonical, spellings in aliases.items():
+        for spelling in [canonical] + spellings:
+            table[fold_genre(spelling)] = fold_genre(canonical)
+    return table
+
+ALIAS_TABLE = compile_aliases(GENRE_ALIASES)
+
+@lru_cache(maxsize=1 << 16)
+def canonical_genre(name: str) -> str:
+    folded = fold_genre(name)
+    return sys.intern(ALIAS_TABLE.get(folded, folded))
+
+def canonicalize_genres(genres: list[str]) -> list[str]:
+    # a genre vocabulary with every spelling merged, sorted for encoding
+    return sorted({canonical_genre(genre) for genre in genres})
@@ -0,0 +1,485 @@
+### Compact, array-backed version of the artist/song/genre records built by preprocess.combine_data()
+###
+### Instead of one Artist/Song/Genre object (plus a dict entry) per record, records are rows in parallel
+### NumPy arrays:
+###   artists: name, mbid, total playcount, total listeners
+###   songs:   artist row, name, mbid, playcount, listeners
+###   tags:    (song row, genre, count) triples
+### Mbids are stored as 16 raw UUID bytes (MbidColumn) and names back to back in one UTF-8 buffer
+### (PackedStrings), so no per-record Python str is kept. Only tag names, of which there are few, are
+### interned into a StringTable.
+### Removal steps only flip the *_keep masks, so row numbers never change after build_catalog().
+
+from array import array
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+import numpy as np
+from instrumentation import progress, log
+
+# ----- Dataclasses -----
+
+class StringTable:
+    """
+    Interns strings (tag names) so each distinct value is stored once and referenced by int id.
+    """
+
+    def __init__(self):
+        self.ids = dict[str, int]()
+        self.values = list[str]()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def intern(self, value: str) -> int:
+        idx = self.ids.get(value)
+        if idx is None:
+            idx = len(self.values)
+            self.ids[value] = idx
+            self.values.append(value)
+        return idx
+
+    def id_of(self, value: str) -> int:
+        # -1 never matches a stored id, so it is safe to compare arrays against
+        return self.ids.get(value, -1)
+
+    def lookup(self, ids: np.ndarray) -> list[str]:
+        return [self.values[i] for i in ids.tolist()]
+
+class PackedStrings:
+    """
+    One string per row (artist or song names), stored back to back as UTF-8 with the end offset of each.
+    Rows are appended while building, then freeze() turns the buffers into bytes / NumPy arrays.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array("q")
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def append(self, value: str) -> None:
+        self.data += value.encode("utf-8")
+        self.ends.append(len(self.data))
+
+    def freeze(self) -> None:
+        self.data = bytes(self.data)
+        self.ends = np.frombuffer(self.ends, dtype=np.int64)
+
+    def lookup(self, rows: np.ndarray) -> list[str]:
+        ends = np.asarray(self.ends)
+        starts = np.r_[0, ends[:-1]][rows].tolist()
+        return [self.data[start:end].decode("utf-8") for start, end in zip(starts, ends[rows].tolist())]
+
+    def equals(self, value: str) -> np.ndarray:
+        # only rows of the right byte length are compared
+        encoded = value.encode("utf-8")
+        ends = np.asarray(self.ends)
+        starts = np.r_[0, ends[:-1]]
+        mask = np.zeros(len(ends), dtype=bool)
+        for row in np.flatnonzero(ends - starts == len(encoded)).tolist():
+            mask[row] = self.data[starts[row]:ends[row]] == encoded
+        return mask
+
+def id_dtype(count: int) -> type:
+    # narrowest signed dtype that holds ids 0..count-1 (tag name ids are usually a few dozen genres)
+    return np.int16 if count <= np.iinfo(np.int16).max else np.int32
+
+def uuid_bytes(value: str) -> bytes | None:
+    # the 16 bytes of a canonical (lowercase, hyphenated) UUID string, None for anything else
+    if len(value) != 36 or value[8] != "-" or value[13] != "-" or value[18] != "-" or value[23] != "-":
+        return None
+    digits = value[:8] + value[9:13] + value[14:18] + value[19:23] + value[24:]
+    try:
+        raw = bytes.fromhex(digits)
+    except ValueError:
+        return None
+    # fromhex also takes uppercase digits (and whitespace), which wouldn't format back to the same string
+    return raw if len(raw) == 16 and raw.hex() == digits else None
+
+def format_uuid(raw: bytes) -> str:
+    digits = raw.hex()
+    return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+class MbidColumn:
+    """
+    One mbid per row: canonical UUIDs as 16 raw bytes, anything else ("", the NA value, malformed ids)
+    as a str in a side table keyed by row (those rows keep zero bytes).
+    Rows are appended/overwritten while building, then freeze() turns the bytes into a (rows x 16) uint8 array.
+    """
+
+    def __init__(self):
+        self.uuids = bytearray()
+        self.other = dict[int, str]()
+        self.rows = 0
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def append(self, value: str) -> None:
+        self.uuids += bytes(16)
+        self.rows += 1
+        self.set(self.rows - 1, value)
+
+    def set(self, row: int, value: str) -> None:
+        raw = uuid_bytes(value)
+        if raw is None:
+            self.other[row] = value
+            raw = bytes(16)
+        else:
+            self.other.pop(row, None)
+        self.uuids[row * 16:(row + 1) * 16] = raw
+
+    def freeze(self) -> None:
+        self.uuids = np.frombuffer(self.uuids, dtype=np.uint8).reshape(-1, 16)
+
+    def lookup(self, rows: np.ndarray) -> list[str]:
+        rows = rows.tolist()
+        raw = np.asarray(self.uuids)[rows].tobytes()
+        return [self.other[row] if row in self.other else format_uuid(raw[i * 16:(i + 1) * 16])
+                for i, row in enumerate(rows)]
+
+    def equals(self, value: str) -> np.ndarray:
+        raw = uuid_bytes(value)
+        if raw is None:
+            mask = np.zeros(len(self), dtype=bool)
+            mask[[row for row, other in self.other.items() if other == value]] = True
+            return mask
+
+        mask = (np.asarray(self.uuids) == np.frombuffer(raw, dtype=np.uint8)).all(axis=1)
+        mask[list(self.other)] = False
+        return mask
+
+@dataclass
+class Catalog:
+    tag_names: StringTable
+
+    # one row per artist (in first-seen order, like the artists dict)
+    artist_name: PackedStrings
+    artist_mbid: MbidColumn
+    artist_playcount: np.ndarray
+    artist_listeners: np.ndarray
+    artist_keep: np.ndarray
+
+    # one row per song; rows of the same artist are in first-seen order
+    song_artist: np.ndarray
+    song_name: PackedStrings
+    song_mbid: MbidColumn
+    song_playcount: np.ndarray
+    song_listeners: np.ndarray
+    song_keep: np.ndarray
+
+    # one row per (song, genre) pair
+    tag_song: np.ndarray
+    tag_genre: np.ndarray
+    tag_count: np.ndarray
+    tag_keep: np.ndarray
+
+    # one row per (artist, genre) pair, filled by total_artist_genres()
+    artist_genre_artist: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    artist_genre_genre: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    artist_genre_count: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    # tag row whose count follows the artist's total (see total_artist_genres())
+    artist_genre_tag: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+
+# ----- Building -----
+
+def build_catalog(artist_tracks: Iterable[tuple[str, list]], track_tags: Iterable[tuple[str, dict]], na_val: str,
+                  keep_tag: Callable[[str], bool] | None = None) -> Catalog:
+    """
+    Same semantics as preprocess.combine_data(): artists are keyed by name and songs by name within
+    their artist (a repeated key replaces the earlier record but keeps its position), artist totals
+    count every track, and a repeated tag on the same song keeps the last count.
+    keep_tag: tags whose name it rejects are never stored (None keeps every tag).
+    """
+    tag_names = StringTable()
+
+    artist_slot = dict[str, int]()  # artist name -> artist row
+    artist_songs = list[dict[str, int]]()  # artist row -> {song name -> song row}
+    artist_name, artist_mbid = PackedStrings(), MbidColumn()
+    artist_playcount, artist_listeners = array("q"), array("q")
+
+    song_artist, song_name, song_mbid = array("i"), PackedStrings(), MbidColumn()
+    song_playcount, song_listeners = array("q"), array("q")
+    song_alive = array("b")
+
+    log("\n--> Making a compact catalog of all artists and songs...")
+    pbar = progress(unit="artist")
+
+    for name, tracks in artist_tracks:
+        mbid = tracks[0]["artist"].get("mbid", na_val)
+
+        row = artist_slot.get(name)
+        if row is None:
+            row = len(artist_name)
+            artist_slot[name] = row
+            artist_songs.append({})
+            artist_name.append(name)
+            artist_mbid.append(mbid)
+            artist_playcount.append(0)
+            artist_listeners.append(0)
+        else:
+            # a repeated artist replaces the earlier one entirely
+            for song_row in artist_songs[row].values():
+                song_alive[song_row] = 0
+            artist_songs[row] = {}
+            artist_mbid.set(row, mbid)
+            artist_playcount[row] = 0
+            artist_listeners[row] = 0
+
+        songs = artist_songs[row]
+        for track in tracks:
+            track_name = track.get("name", na_val)
+            playcount = int(track.get("playcount", "0"))
+            listeners = int(track.get("listeners", "0"))
+
+            song_row = songs.get(track_name)
+            if song_row is None:
+                song_row = len(song_name)
+                songs[track_name] = song_row
+                song_artist.append(row)
+                song_name.append(track_name)
+                song_mbid.append(track.get("mbid", na_val))
+                song_playcount.append(0)
+                song_listeners.append(0)
+                song_alive.append(1)
+            else:
+                song_mbid.set(song_row, track.get("mbid", na_val))
+
+            song_playcount[song_row] = playcount
+            song_listeners[song_row] = listeners
+
+            artist_playcount[row] += playcount
+            artist_listeners[row] += listeners
+
+        pbar.update(1)
+    pbar.close()
+
+    tag_song, tag_genre, tag_count = array("i"), array("i"), array("i")
+    rejected = set[str]()  # tag names keep_tag turned down
+
+    log("\n--> Collecting each song's tags into the catalog...")
+    for name, tracks in track_tags:
+        row = artist_slot.get(name)
+        if row is None:
+            continue
+
+        songs = artist_songs[row]
+        for song_name_str, tags in tracks.items():
+            song_row = songs.get(song_name_str)
+            if song_row is None:
+                continue
+
+            for tag in tags:
+                genre_id = tag_names.id_of(tag["name"])
+                if genre_id < 0:
+                    if tag["name"] in rejected or (keep_tag is not None and not keep_tag(tag["name"])):
+                        rejected.add(tag["name"])
+                        continue
+                    genre_id = tag_names.intern(tag["name"])
+
+                tag_song.append(song_row)
+                tag_genre.append(genre_id)
+                tag_count.append(tag["count"])
+
+    # the name -> row indexes are only needed while reading
+    del artist_slot, artist_songs, rejected
+    for column in (artist_name, artist_mbid, song_name, song_mbid):
+        column.freeze()
+
+    tag_song = np.frombuffer(tag_song, dtype=np.int32)
+    tag_genre = np.frombuffer(tag_genre, dtype=np.int32)
+    tag_count = np.frombuffer(tag_count, dtype=np.int32)
+
+    # a tag repeated on the same song keeps its last count
+    order = np.lexsort((np.arange(len(tag_song)), tag_genre, tag_song))
+    last_of_pair = np.ones(len(order), dtype=bool)
+    last_of_pair[:-1] = (tag_song[order][1:] != tag_song[order][:-1]) | (tag_genre[order][1:] != tag_genre[order][:-1])
+    order = order[last_of_pair]
+
+    song_keep = np.frombuffer(song_alive, dtype=np.int8).astype(bool)
+
+    return Catalog(
+        tag_names=tag_names,
+        artist_name=artist_name,
+        artist_mbid=artist_mbid,
+        artist_playcount=np.frombuffer(artist_playcount, dtype=np.int64),
+        artist_listeners=np.frombuffer(artist_listeners, dtype=np.int64),
+        artist_keep=np.ones(len(artist_name), dtype=bool),
+        song_artist=np.frombuffer(song_artist, dtype=np.int32),
+        song_name=song_name,
+        song_mbid=song_mbid,
+        song_playcount=np.frombuffer(song_playcount, dtype=np.int64),
+        song_listeners=np.frombuffer(song_listeners, dtype=np.int64),
+        song_keep=song_keep,
+        tag_song=tag_song[order],
+        tag_genre=tag_genre[order].astype(id_dtype(len(tag_names))),
+        tag_count=tag_count[order].copy(),
+        tag_keep=song_keep[tag_song[order]],
+    )
+
+# ----- Data Preprocessing -----
+
+def _drop_songs_of_removed_artists(catalog: Catalog) -> None:
+    catalog.song_keep &= catalog.artist_keep[catalog.song_artist]
+    catalog.tag_keep &= catalog.song_keep[catalog.tag_song]
+
+def remove_na_mbid_artists(catalog: Catalog, na_val: str) -> None:
+    na_artists = catalog.artist_keep & (catalog.artist_mbid.equals(na_val) | catalog.artist_name.equals(na_val))
+
+    log(f"\n--> Removing {int(na_artists.sum())} artists with NA mbid...")
+    catalog.artist_keep &= ~na_artists
+    _drop_songs_of_removed_artists(catalog)
+
+def remove_na_mbid_songs(catalog: Catalog, na_val: str) -> None:
+    na_songs = catalog.song_keep & (catalog.song_mbid.equals(na_val) | catalog.song_name.equals(na_val))
+
+    log(f"\n--> Removing {int(na_songs.sum())} songs with NA mbid...")
+    catalog.song_keep &= ~na_songs
+    catalog.tag_keep &= catalog.song_keep[catalog.tag_song]
+
+def canonicalize_tags(catalog: Catalog, canonical: Callable[[str], str]) -> None:
+    """
+    Point every tag at its canonical genre name (canonical.canonical_genre). A song tagged with two
+    spellings of one genre keeps a single tag row with the higher count, like the Artist/Song path.
+    """
+    # one canonical() call per distinct tag string, not per tag row
+    used = np.unique(catalog.tag_genre)
+    remap = np.arange(len(catalog.tag_names), dtype=np.int32)
+    for genre_id, name in zip(used.tolist(), catalog.tag_names.lookup(used)):
+        remap[genre_id] = catalog.tag_names.intern(canonical(name))
+    catalog.tag_genre = remap[catalog.tag_genre].astype(id_dtype(len(catalog.tag_names)))
+
+    tags = np.flatnonzero(catalog.tag_keep)
+    if len(tags) == 0:
+        return
+    order = np.lexsort((tags, catalog.tag_genre[tags], catalog.tag_song[tags]))
+    tags = tags[order]
+    song_rows, genre_ids = catalog.tag_song[tags], catalog.tag_genre[tags]
+    group_starts = np.flatnonzero(np.r_[True, (song_rows[1:] != song_rows[:-1]) | (genre_ids[1:] != genre_ids[:-1])])
+
+    log(f"\n--> Merging {len(tags) - len(group_starts)} tags spelled differently on the same song...")
+    catalog.tag_count[tags[group_starts]] = np.maximum.reduceat(catalog.tag_count[tags], group_starts)
+    duplicates = np.ones(len(tags), dtype=bool)
+    duplicates[group_starts] = False
+    catalog.tag_keep[tags[duplicates]] = False
+
+def remove_unaccepted_tags(catalog: Catalog, genres: list[str]) -> None:
+    log("\n--> Removing unaccepted tags from artists & their songs...")
+    accepted = np.array([catalog.tag_names.id_of(genre) for genre in genres], dtype=np.int32)
+    catalog.tag_keep &= np.isin(catalog.tag_genre, accepted)
+
+def remove_no_genre_songs(catalog: Catalog) -> None:
+    tags_per_song = np.bincount(catalog.tag_song[catalog.tag_keep], minlength=len(catalog.song_keep))
+    no_genre_songs = catalog.song_keep & (tags_per_song == 0)
+
+    log(f"\n--> Removing {int(no_genre_songs.sum())} songs with no genres listed...")
+    catalog.song_keep &= ~no_genre_songs
+
+def total_artist_genres(catalog: Catalog) -> None:
+    """
+    Sum each artist's song tag counts per genre.
+
+    preprocess.total_genres() stores the first song's Genre object on the artist and adds the
+    other songs onto it, so that song's count ends up tracking the artist total (and is normalized
+    along with it). artist_genre_tag remembers that tag row so outputs stay identical.
+    """
+    log("\n--> Collecting information about each artist's genres...")
+    tags = np.flatnonzero(catalog.tag_keep)
+    song_rows = catalog.tag_song[tags]
+    artist_rows = catalog.song_artist[song_rows]
+    genre_ids = catalog.tag_genre[tags]
+
+    # group by (artist, genre) with the artist's earliest song first in each group
+    order = np.lexsort((song_rows, genre_ids, artist_rows))
+    tags, artist_rows, genre_ids = tags[order], artist_rows[order], genre_ids[order]
+
+    group_starts = np.flatnonzero(np.r_[True, (artist_rows[1:] != artist_rows[:-1]) | (genre_ids[1:] != genre_ids[:-1])])
+    if len(tags) == 0:
+        group_starts = group_starts[:0]
+
+    catalog.artist_genre_artist = artist_rows[group_starts]
+    catalog.artist_genre_genre = genre_ids[group_starts]
+    catalog.artist_genre_count = np.add.reduceat(catalog.tag_count[tags], group_starts) if len(tags) else np.zeros(0, dtype=np.int32)
+    catalog.artist_genre_tag = tags[group_starts]
+    catalog.tag_count[catalog.artist_genre_tag] = catalog.artist_genre_count
+
+def remove_no_genre_artists(catalog: Catalog) -> None:
+    genres_per_artist = np.bincount(catalog.artist_genre_artist, minlength=len(catalog.artist_keep))
+    no_genre_artists = catalog.artist_keep & (genres_per_artist == 0)
+
+    log(f"\n--> Removing {int(no_genre_artists.sum())} artists with no genres listed...")
+    catalog.artist_keep &= ~no_genre_artists
+    _drop_songs_of_removed_artists(catalog)
+
+def normalize_artist_genre_counts(catalog: Catalog) -> None:
+    log("\n--> Normalizing artist genre counts...")
+    top_genre_count = np.zeros(len(catalog.artist_keep), dtype=np.int32)
+    np.maximum.at(top_genre_count, catalog.artist_genre_artist, catalog.artist_genre_count)
+
+    # normalize genre counts to 0 <= count <= 100 (same float math as int((count / top) * 100))
+    top = top_genre_count[catalog.artist_genre_artist].astype(np.float64)
+    catalog.artist_genre_count = ((catalog.artist_genre_count / top) * 100).astype(np.int32)
+    catalog.tag_count[catalog.artist_genre_tag] = catalog.artist_genre_count
+
+# ----- Output columns -----
+
+def kept_artists(catalog: Catalog) -> np.ndarray:
+    return np.flatnonzero(catalog.artist_keep)
+
+def kept_songs(catalog: Catalog) -> np.ndarray:
+    # songs grouped by artist (in artist order), then in the artist's own song order
+    songs = np.flatnonzero(catalog.song_keep)
+    return songs[np.argsort(catalog.song_artist[songs], kind="stable")]
+
+def _genre_flags(rows: np.ndarray, row_of: np.ndarray, genre_ids: np.ndarray, counts: np.ndarray,
+                 n_rows: int, genres: list[str], threshold: int, tag_names: StringTable) -> np.ndarray:
+    # map tag name id -> genre column (-1 if not one of the accepted genres)
+    genre_col = np.full(len(tag_names), -1, dtype=np.int64)
+    for col, genre in enumerate(genres):
+        genre_id = tag_names.id_of(genre)
+        if genre_id >= 0:
+            genre_col[genre_id] = col
+
+    # row_of maps catalog rows -> output rows (-1 for rows not in the output)
+    out_rows = row_of[rows]
+    cols = genre_col[genre_ids]
+    hit = (out_rows >= 0) & (cols >= 0) & (counts > threshold)
+
+    flags = np.zeros((n_rows, len(genres)), dtype=np.int64)
+    flags[out_rows[hit], cols[hit]] = 1
+    return flags
+
+def artist_genre_flags(catalog: Catalog, artists: np.ndarray, genres: list[str], threshold: int) -> np.ndarray:
+    row_of = np.full(len(catalog.artist_keep), -1, dtype=np.int64)
+    row_of[artists] = np.arange(len(artists))
+    return _genre_flags(catalog.artist_genre_artist, row_of, catalog.artist_genre_genre, catalog.artist_genre_count,
+                        len(artists), genres, threshold, catalog.tag_names)
+
+def song_genre_flags(catalog: Catalog, songs: np.ndarray, genres: list[str], threshold: int) -> np.ndarray:
+    row_of = np.full(len(catalog.song_keep), -1, dtype=np.int64)
+    row_of[songs] = np.arange(len(songs))
+    tags = np.flatnonzero(catalog.tag_keep)
+    return _genre_flags(catalog.tag_song[tags], row_of, catalog.tag_genre[tags], catalog.tag_count[tags],
+                        len(songs), genres, threshold, catalog.tag_names)
+
+def name_lookups(catalog: Catalog) -> tuple[dict[str, str], dict[tuple[str, str], str]]:
+    """
+    Same lookups as preprocess.name_lookups(): artist mbid -> artist name, (artist name, song mbid) -> song name.
+    """
+    artists = kept_artists(catalog)
+    artist_names = dict[str, str]()
+    first_rows = set[int]()
+    for row, mbid, name in zip(artists.tolist(), catalog.artist_mbid.lookup(artists), catalog.artist_name.lookup(artists)):
+        if mbid not in artist_names:
+            artist_names[mbid] = name
+            first_rows.add(row)
+
+    songs = kept_songs(catalog)
+    songs = songs[np.isin(catalog.song_artist[songs], list(first_rows))]
+    song_artists = catalog.artist_name.lookup(catalog.song_artist[songs])
+    song_names = dict[tuple[str, str], str]()
+    for key, name in zip(zip(song_artists, catalog.song_mbid.lookup(songs)), catalog.song_name.lookup(songs)):
+        song_names.setdefault(key, name)
+
+    return artist_names, song_names
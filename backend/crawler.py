@@ -0,0 +1,365 @@
+### Crawls Last.fm for the inputs of preprocess.py (artist_top_tracks.json and track_tags.json)
+###
+### For every artist: artist.getTopTracks, then track.getTopTags for each of its tracks. Requests go through
+### one pooled aiohttp session, a token bucket keeps them under Last.fm's rate limit, and every response is
+### cached on disk, so a rerun only fetches what is missing.
+### Finished artists are appended to a journal (one json line each) as they complete; an interrupted crawl
+### picks up where it stopped. Once every artist is done the journal is streamed into the two output jsons.
+###
+### Usage (from backend/):
+###   python crawler.py --artists artists.txt            # one artist name per line
+###   python crawler.py --chart-pages 20                 # or the top artists of the Last.fm charts
+###   python crawler.py --base-url http://localhost:8080/2.0/ --api-key test   # against a stub server
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from pathlib import Path
+from typing import Iterable
+import aiohttp
+from instrumentation import progress, log, set_quiet
+
+# ----- Constants -----
+
+API_ROOT = "https://ws.audioscrobbler.com/2.0/"
+FO_ARTISTS = "../artist_top_tracks.json"  # where preprocess.py reads them from
+FO_TAGS = "../track_tags.json"
+CACHE_DIR = "../crawl_cache"
+JOURNAL_FILE = "journal.jsonl"  # inside the cache directory
+
+RATE = 5.0  # requests per second; Last.fm asks for no more than 5/s averaged over 5 minutes
+BURST = 5  # requests allowed back to back after an idle period
+CONCURRENCY = 8  # connections in the pool, and artists crawled at once
+TOP_TRACKS_LIMIT = 50
+CHART_PAGE_SIZE = 500
+TIMEOUT = 30  # seconds per request
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # seconds, doubled on every retry
+
+# Last.fm api error codes
+RETRY_ERRORS = {8, 11, 16, 29}  # operation failed, service offline, temporarily unavailable, rate limit exceeded
+CACHEABLE_ERRORS = {6}  # invalid parameters (unknown artist/track), asking again won't change the answer
+
+class CrawlError(Exception):
+    pass
+
+class UnknownArtistError(CrawlError):
+    # Last.fm doesn't know the artist: nothing to crawl, but nothing to retry either
+    pass
+
+# ----- Rate limiting -----
+
+class TokenBucket:
+    """
+    Allows rate acquisitions per second on average, and up to capacity at once after an idle period.
+    Waiters are served in order.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+# ----- Response cache -----
+
+class ResponseCache:
+    """
+    One json file per request, named by a hash of its parameters (the api key is left out, so a new key
+    still hits the cache). Files are written to a temp name and renamed, so a crash never leaves a
+    half written response behind.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def path(self, params: dict) -> Path:
+        key = hashlib.sha1(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+        return self.directory / key[:2] / (key + ".json")
+
+    def get(self, params: dict) -> dict | None:
+        try:
+            with open(self.path(params), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def put(self, params: dict, data: dict) -> None:
+        path = self.path(params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+# ----- Api client -----
+
+class LastfmClient:
+
+    def __init__(self, session: aiohttp.ClientSession, api_key: str, base_url: str, bucket: TokenBucket,
+                 cache: ResponseCache, retries: int = MAX_RETRIES):
+        self.session = session
+        self.api_key = api_key
+        self.base_url = base_url
+        self.bucket = bucket
+        self.cache = cache
+        self.retries = retries
+        self.stats = {"fetched": 0, "cached": 0, "retried": 0}
+
+    async def call(self, method: str, **params) -> dict:
+        """
+        Json response of an api method, from the cache if we asked before. Rate limit, server and
+        connection errors are retried with exponential backoff; CrawlError once retries run out.
+        Api errors other than CACHEABLE_ERRORS (bad api key, suspended key, ...) raise CrawlError right away.
+        """
+        params = {"method": method, **{name: str(value) for name, value in params.items()}, "format": "json"}
+
+        cached = self.cache.get(params)
+        if cached is not None:
+            self.stats["cached"] += 1
+            return cached
+
+        problem = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats["retried"] += 1
+                await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1) * (1 + random.random()))
+            await self.bucket.acquire()
+
+            try:
+                async with self.session.get(self.base_url, params={**params, "api_key": self.api_key}) as response:
+                    if response.status == 429 or response.status >= 500:
+                        problem = f"HTTP {response.status}"
+                        continue
+                    # errors come back as json too (usually with a 4xx status)
+                    data = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError, json.JSONDecodeError) as e:
+                problem = repr(e)
+                continue
+
+            error = data.get("error")
+            if error in RETRY_ERRORS:
+                problem = f"error {error}: {data.get('message')}"
+                continue
+
+            if error is not None and error not in CACHEABLE_ERRORS:
+                raise CrawlError(f"{method} {params} failed (error {error}: {data.get('message')})")
+
+            self.stats["fetched"] += 1
+            self.cache.put(params, data)
+            return data
+
+        raise CrawlError(f"{method} {params} failed after {self.retries + 1} attempts ({problem})")
+
+def as_list(value) -> list:
+    # Last.fm's json gives a lone result as an object instead of a one element list
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+# ----- Crawling -----
+
+async def chart_artists(client: LastfmClient, pages: int) -> list[str]:
+    responses = await asyncio.gather(*(client.call("chart.getTopArtists", page=page, limit=CHART_PAGE_SIZE)
+                                       for page in range(1, pages + 1)))
+    return [artist["name"] for data in responses for artist in as_list(data.get("artists", {}).get("artist"))]
+
+async def crawl_artist(client: LastfmClient, name: str, limit: int) -> tuple[list[dict], dict[str, list[dict]]]:
+    """
+    (top tracks, tags per track name) of one artist, shaped like the entries preprocess.py reads.
+    """
+    data = await client.call("artist.getTopTracks", artist=name, limit=limit, autocorrect=0)
+    if "error" in data:
+        # never journaled as an artist without tracks, a later run asks again (from the cache)
+        raise UnknownArtistError(f"error {data['error']}: {data.get('message')}")
+    tracks = as_list(data.get("toptracks", {}).get("track"))
+
+    responses = await asyncio.gather(*(client.call("track.getTopTags", artist=name, track=track["name"], autocorrect=0)
+                                       for track in tracks))
+
+    tags = dict[str, list[dict]]()
+    for track, response in zip(tracks, responses):
+        # tracks Last.fm doesn't know get no entry, like in the original crawl
+        if "error" not in response:
+            tags[track["name"]] = as_list(response.get("toptags", {}).get("tag"))
+
+    return tracks, tags
+
+def read_journal(filename: Path) -> dict[str, int]:
+    """
+    Byte offset of every artist's line in the journal. A line cut short by a crash is ignored
+    (and that artist crawled again).
+    """
+    offsets = dict[str, int]()
+    if not filename.exists():
+        return offsets
+
+    with open(filename, "rb") as f:
+        offset = 0
+        for line in f:
+            try:
+                offsets[json.loads(line)["artist"]] = offset
+            except (json.JSONDecodeError, KeyError):
+                pass
+            offset += len(line)
+
+    return offsets
+
+async def crawl(client: LastfmClient, artists: list[str], journal_filename: Path, limit: int, concurrency: int) -> list[str]:
+    """
+    Crawl every artist not in the journal yet, appending each one as it finishes.
+    Returns the artists that failed (they are retried on the next run).
+    """
+    done = read_journal(journal_filename)
+    todo = asyncio.Queue()
+    for name in artists:
+        if name not in done:
+            todo.put_nowait(name)
+
+    log(f"\n--> Crawling {todo.qsize()} artists ({len(artists) - todo.qsize()} already done)...")
+    pbar = progress(total=todo.qsize(), unit="artist")
+    failed = list[str]()
+
+    # cut a partial last line from an earlier crash off, so new lines start on a line of their own
+    if journal_filename.exists():
+        with open(journal_filename, "rb+") as f:
+            content_end = f.seek(0, os.SEEK_END)
+            while content_end > 0:
+                f.seek(content_end - 1)
+                if f.read(1) == b"\n":
+                    break
+                content_end -= 1
+            f.truncate(content_end)
+
+    with open(journal_filename, "a", encoding="utf-8") as journal:
+
+        async def worker():
+            while not todo.empty():
+                name = todo.get_nowait()
+                try:
+                    tracks, tags = await crawl_artist(client, name, limit)
+                except UnknownArtistError as e:
+                    log(f"  -> {name}: skipped, {e}")
+                except CrawlError as e:
+                    log(f"  -> {name}: {e}")
+                    failed.append(name)
+                else:
+                    # one write per line on a single event loop thread, so lines never interleave
+                    journal.write(json.dumps({"artist": name, "tracks": tracks, "tags": tags}) + "\n")
+                    journal.flush()
+                pbar.update(1)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    pbar.close()
+    return failed
+
+# ----- Output -----
+
+def write_outputs(journal_filename: Path, artists: Iterable[str], artists_filename: str, tags_filename: str) -> int:
+    """
+    Stream the journal into artist_top_tracks.json and track_tags.json (in the order of artists),
+    one artist in memory at a time. Artists without tracks are left out, preprocess.py needs at least one.
+    Returns how many artists were written.
+    """
+    offsets = read_journal(journal_filename)
+    written = 0
+
+    with open(journal_filename, "rb") as journal, \
+         open(artists_filename + ".tmp", "w", encoding="utf-8") as artists_file, \
+         open(tags_filename + ".tmp", "w", encoding="utf-8") as tags_file:
+        artists_file.write("{")
+        tags_file.write("{")
+
+        for name in artists:
+            if name not in offsets:
+                continue
+            journal.seek(offsets[name])
+            entry = json.loads(journal.readline())
+            if not entry["tracks"]:
+                continue
+
+            separator = "," if written else ""
+            artists_file.write(f"{separator}\n{json.dumps(name)}: {json.dumps(entry['tracks'])}")
+            tags_file.write(f"{separator}\n{json.dumps(name)}: {json.dumps(entry['tags'])}")
+            written += 1
+
+        artists_file.write("\n}\n")
+        tags_file.write("\n}\n")
+
+    os.replace(artists_filename + ".tmp", artists_filename)
+    os.replace(tags_filename + ".tmp", tags_filename)
+    return written
+
+# ----- Main -----
+
+def read_artist_list(filename: str) -> list[str]:
+    with open(filename, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+async def run(args: argparse.Namespace) -> int:
+    cache_dir = Path(args.cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        client = LastfmClient(session, args.api_key, args.base_url, TokenBucket(args.rate, args.burst), ResponseCache(cache_dir))
+
+        artists = read_artist_list(args.artists) if args.artists else await chart_artists(client, args.chart_pages)
+        artists = list(dict.fromkeys(artists))  # drop repeats, keep order
+
+        failed = await crawl(client, artists, cache_dir / JOURNAL_FILE, args.limit, args.concurrency)
+
+    log(f"\n--> {client.stats['fetched']} requests fetched, {client.stats['cached']} from cache, {client.stats['retried']} retries")
+    if failed:
+        log(f"--> {len(failed)} artists failed, run again to retry them (outputs not written)")
+        return 1
+
+    written = write_outputs(cache_dir / JOURNAL_FILE, artists, args.artists_out, args.tags_out)
+    log(f"--> Wrote {written} artists to {args.artists_out} and {args.tags_out}")
+    return 0
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Crawl Last.fm top tracks and track tags for preprocess.py.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--artists", help="file with one artist name per line")
+    source.add_argument("--chart-pages", type=int, help=f"crawl the top artists of this many chart pages ({CHART_PAGE_SIZE} each)")
+    parser.add_argument("--api-key", default=os.getenv("LASTFM_API_KEY", ""), help="defaults to $LASTFM_API_KEY")
+    parser.add_argument("--base-url", default=API_ROOT, help="api endpoint (point it at a stub server for testing)")
+    parser.add_argument("--rate", type=float, default=RATE, help="requests per second")
+    parser.add_argument("--burst", type=float, default=BURST)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--limit", type=int, default=TOP_TRACKS_LIMIT, help="top tracks per artist")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--artists-out", default=FO_ARTISTS)
+    parser.add_argument("--tags-out", default=FO_TAGS)
+    parser.add_argument("--quiet", action="store_true")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    set_quiet(args.quiet)
+    if not args.api_key:
+        raise SystemExit("No api key, pass --api-key or set LASTFM_API_KEY")
+    return asyncio.run(run(args))
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+### Helpers for incremental preprocessing (preprocess.py --incremental)
+###
+### A manifest remembers, per artist name, a content hash of its tracks and of its tags plus the mbid the
+### artist ended up with. On the next run only artists whose hashes changed (or that appeared/disappeared)
+### are recomputed, and their rows are patched into the previous outputs.
+
+import hashlib
+import json
+import os
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+MANIFEST_VERSION = 1
+
+# ----- Hashing -----
+
+def hash_value(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+def hash_entries(items: Iterable[tuple[str, object]]) -> dict[str, str]:
+    """
+    Content hash per key of a streamed top-level json object. A key that appears more than once
+    hashes all of its entries in order.
+    """
+    hashes = {}  # key -> running sha1
+
+    for key, value in items:
+        if key not in hashes:
+            hashes[key] = hashlib.sha1()
+        hashes[key].update(hash_value(value).encode("ascii"))
+
+    return {key: h.hexdigest() for key, h in hashes.items()}
+
+# ----- Manifest -----
+
+def read_manifest(filename: str) -> dict | None:
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+def write_manifest(filename: str, config_hash: str, artists: dict[str, dict]) -> None:
+    # write to a temp file first so an interrupted run never leaves a half written manifest
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "config": config_hash, "artists": artists}, f)
+    os.replace(tmp_filename, filename)
+
+def manifest_entry(tracks_hash: str | None, tags_hash: str | None, mbid: str | None) -> dict:
+    # mbid is None for artists the cleaning steps dropped (they have no rows in the outputs)
+    return {"tracks": tracks_hash, "tags": tags_hash, "mbid": mbid}
+
+def dirty_artists(manifest: dict, tracks_hashes: dict[str, str], tags_hashes: dict[str, str]) -> tuple[set[str], set[str]]:
+    """
+    Returns (artists that are new or changed, artists that are gone from the input).
+    """
+    previous = manifest["artists"]
+
+    changed = set[str]()
+    for name, tracks_hash in tracks_hashes.items():
+        entry = previous.get(name)
+        if entry is None or entry["tracks"] != tracks_hash or entry["tags"] != tags_hashes.get(name):
+            changed.add(name)
+
+    removed = set(previous) - set(tracks_hashes)
+    return changed, removed
+
+# ----- Patching outputs -----
+
+def extend_encoder(encoder: LabelEncoder, values: Iterable[str]) -> LabelEncoder:
+    """
+    Append-only id assignment: values the encoder has not seen get new ids after all existing ones
+    (sorted among themselves), so every previously written id stays valid.
+    Once extended, classes_ is no longer sorted and is stored as an object array, which
+    LabelEncoder.transform() handles with a hash lookup.
+    """
+    known = set(encoder.classes_.tolist())
+    new_values = sorted(set(values) - known)
+
+    if new_values:
+        encoder.classes_ = np.concatenate([encoder.classes_.astype(object), np.array(new_values, dtype=object)])
+
+    return encoder
+
+def read_output_csv(filename: str) -> pd.DataFrame:
+    # keep names such as "N/A" or "null" as the strings they were written as
+    return pd.read_csv(filename, keep_default_na=False)
+
+def patch_frame(previous: pd.DataFrame, replacement: pd.DataFrame, key: str, stale_values: set[str], sort_by: str) -> pd.DataFrame:
+    """
+    Drop every row of previous whose key is in stale_values, add the replacement rows and re-sort.
+    """
+    kept = previous[~previous[key].isin(stale_values)]
+    patched = pd.concat([kept, replacement[previous.columns]], ignore_index=True)
+    patched.sort_values(by=sort_by, inplace=True)
+    return patched
@@ -0,0 +1,111 @@
+### Lightweight per-stage instrumentation for preprocess.py
+###
+### Wrap each stage of a run in `with timed_stage("name", unit) as report:` to record its wall time, CPU time
+### (including worker processes it waited for), peak RSS growth and, where the caller fills them in,
+### how many items went in and came out. write_report() dumps everything as json at the end of the run.
+### progress() and log() stand in for tqdm() and print() so quiet mode turns all of them off at once.
+
+import json
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from tqdm import tqdm
+
+REPORT_VERSION = 1
+
+QUIET = False  # no progress bars and no log lines
+
+# ----- Output -----
+
+def set_quiet(quiet: bool) -> None:
+    global QUIET
+    QUIET = quiet
+
+def progress(*args, **kwargs) -> tqdm:
+    # a disabled tqdm skips all of its bookkeeping in update()
+    return tqdm(*args, disable=QUIET, **kwargs)
+
+def log(*args, **kwargs) -> None:
+    if not QUIET:
+        print(*args, **kwargs)
+
+# ----- Stages -----
+
+@dataclass
+class StageReport:
+    name: str
+    unit: str = ""
+    calls: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0  # high water mark of this process once the stage finished
+    peak_rss_delta_mb: float = 0.0  # how much the stage raised that high water mark
+    children_peak_rss_mb: float = 0.0  # largest worker process waited for so far
+    items_in: int | None = None
+    items_out: int | None = None
+    details: dict = field(default_factory=dict)
+
+STAGES = dict[str, StageReport]()  # in the order the stages first ran
+
+def _rss_mb(who: int) -> float:
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return resource.getrusage(who).ru_maxrss / (1024**2 if sys.platform == "darwin" else 1024)
+
+def _cpu_seconds() -> float:
+    # this process plus every child it has reaped (--workers pools are shut down inside their stage)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+@contextmanager
+def timed_stage(name: str, unit: str = ""):
+    """
+    Measure the enclosed block as stage name. Yields the StageReport so the block can set
+    items_in/items_out/details. Running the same stage again adds to its times.
+    """
+    report = STAGES.setdefault(name, StageReport(name, unit))
+    rss_before = _rss_mb(resource.RUSAGE_SELF)
+    cpu_before = _cpu_seconds()
+    wall_before = time.perf_counter()
+    try:
+        yield report
+    finally:
+        report.calls += 1
+        report.wall_seconds += time.perf_counter() - wall_before
+        report.cpu_seconds += _cpu_seconds() - cpu_before
+        report.peak_rss_mb = _rss_mb(resource.RUSAGE_SELF)
+        report.peak_rss_delta_mb += report.peak_rss_mb - rss_before
+        report.children_peak_rss_mb = _rss_mb(resource.RUSAGE_CHILDREN)
+
+def reset() -> None:
+    STAGES.clear()
+
+# ----- Report -----
+
+def report_dict(config: dict | None = None) -> dict:
+    stages = [asdict(report) for report in STAGES.values()]
+    return {
+        "version": REPORT_VERSION,
+        "config": config or {},
+        "stages": stages,
+        "total": {
+            "wall_seconds": sum(report.wall_seconds for report in STAGES.values()),
+            "cpu_seconds": sum(report.cpu_seconds for report in STAGES.values()),
+            "peak_rss_mb": _rss_mb(resource.RUSAGE_SELF),
+            "children_peak_rss_mb": _rss_mb(resource.RUSAGE_CHILDREN),
+        },
+    }
+
+def write_report(filename: str, config: dict | None = None) -> None:
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report_dict(config), f, indent=2)
+
+def summarize() -> None:
+    log("\n----- Stages -----")
+    for report in STAGES.values():
+        items = ""
+        if report.items_in is not None or report.items_out is not None:
+            items = f"  {report.items_in if report.items_in is not None else '?'} -> {report.items_out if report.items_out is not None else '?'} {report.unit}"
+        log(f"{report.name:16} {report.wall_seconds:8.2f}s wall {report.cpu_seconds:8.2f}s cpu "
+            f"{report.peak_rss_delta_mb:+8.1f} MB peak{items}")
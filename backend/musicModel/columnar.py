@@ -0,0 +1,127 @@
+### Columnar binary format for the preprocessed tables (alternative to the csv's)
+###
+### A table is a directory holding one .npy file per column plus a schema.json. The genre flag columns are
+### stored together as a single (rows x genres) int8 matrix, so loaders get the multi-hot block in one read.
+### Every file can be memory-mapped, so loading only touches the columns (and pages) that are used.
+### With pack_genres the genre flags are stored as bitsets instead: GENRE_BITS, a (rows x words) uint64 matrix
+### where genre i is bit (i % 64) of word (i // 64).
+
+import json
+import os
+import re
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+SCHEMA_FILE = "schema.json"
+GENRE_MATRIX = "genres"
+GENRE_BITS = "genre_bits"
+FORMAT_VERSION = 1
+
+def is_table(path) -> bool:
+    return os.path.isfile(os.path.join(path, SCHEMA_FILE))
+
+def pack_bits(flags: np.ndarray) -> np.ndarray:
+    # (rows x genres) 0/1 matrix -> (rows x ceil(genres / 64)) uint64 bitsets
+    words = max(1, -(-flags.shape[1] // 64))
+    packed = np.packbits(np.asarray(flags, dtype=bool), axis=1, bitorder="little")
+    padded = np.zeros((flags.shape[0], words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view("<u8")
+
+def unpack_bits(bits: np.ndarray, num_genres: int) -> np.ndarray:
+    # inverse of pack_bits, as a uint8 0/1 matrix
+    as_bytes = np.ascontiguousarray(bits, dtype="<u8").view(np.uint8)
+    return np.unpackbits(as_bytes, axis=1, count=num_genres, bitorder="little")
+
+def _column_file(name: str) -> str:
+    return re.sub(r"[^\w.-]", "_", name) + ".npy"
+
+def _column_array(series: pd.Series) -> np.ndarray:
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy()
+    # strings become fixed width unicode so they can be memory-mapped too
+    return series.astype(str).to_numpy(dtype=str)
+
+def write_table(df: pd.DataFrame, directory, genre_columns: list[str] | None = None, pack_genres: bool = False) -> None:
+    """
+    Write df as a columnar table. genre_columns (in order) are packed into the genre matrix
+    (or into bitsets with pack_genres), every other column gets its own .npy file.
+    """
+    genre_columns = [genre for genre in (genre_columns or []) if genre in df.columns]
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    schema = {"version": FORMAT_VERSION, "rows": len(df), "order": list(df.columns), "columns": [], "genres": genre_columns,
+              "genre_storage": GENRE_BITS if pack_genres else GENRE_MATRIX}
+
+    for name in df.columns:
+        if name in genre_columns:
+            continue
+        values = _column_array(df[name])
+        np.save(directory / _column_file(name), values, allow_pickle=False)
+        schema["columns"].append({"name": name, "file": _column_file(name), "dtype": values.dtype.str})
+
+    if genre_columns:
+        flags = df[genre_columns].to_numpy(dtype=np.int8)
+        if pack_genres:
+            np.save(directory / (GENRE_BITS + ".npy"), pack_bits(flags), allow_pickle=False)
+        else:
+            np.save(directory / (GENRE_MATRIX + ".npy"), flags, allow_pickle=False)
+
+    # schema last, so a table with a schema is always complete
+    with open(directory / SCHEMA_FILE, "w", encoding="utf-8") as f:
+        json.dump(schema, f, indent=2)
+
+def read_schema(directory) -> dict:
+    with open(Path(directory) / SCHEMA_FILE, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def read_table(directory, columns: list[str] | None = None, mmap_mode: str | None = "r") -> dict[str, np.ndarray]:
+    """
+    Load columns (all by default) as arrays, memory-mapped with np.load's mmap_mode
+    ("r" read-only, "c" copy-on-write, None to read into memory).
+    Genres can be asked for as GENRE_MATRIX or GENRE_BITS whichever way they are stored
+    (converting costs a copy); columns=None returns them as stored.
+    """
+    directory = Path(directory)
+    schema = read_schema(directory)
+    storage = schema.get("genre_storage", GENRE_MATRIX)
+
+    files = {column["name"]: column["file"] for column in schema["columns"]}
+    if schema["genres"]:
+        files[storage] = storage + ".npy"
+
+    wanted = list(files) if columns is None else columns
+    missing = [name for name in wanted if name not in files and not (schema["genres"] and name in (GENRE_MATRIX, GENRE_BITS))]
+    if missing:
+        raise KeyError(f"{directory} has no column(s) {missing}")
+
+    arrays = {}
+    for name in wanted:
+        if name in files:
+            arrays[name] = np.load(directory / files[name], mmap_mode=mmap_mode, allow_pickle=False)
+        elif name == GENRE_MATRIX:
+            arrays[name] = unpack_bits(np.load(directory / files[storage], mmap_mode=mmap_mode), len(schema["genres"])).astype(np.int8)
+        else:
+            arrays[name] = pack_bits(np.load(directory / files[storage], mmap_mode=mmap_mode))
+    return arrays
+
+def read_frame(directory, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Load a table back into the same DataFrame layout as its csv (genre columns expanded again).
+    """
+    schema = read_schema(directory)
+    columns = schema["order"] if columns is None else columns
+    genre_index = {genre: i for i, genre in enumerate(schema["genres"])}
+
+    names = [name for name in columns if name not in genre_index]
+    arrays = read_table(directory, names + ([GENRE_MATRIX] if len(names) < len(columns) else []), mmap_mode=None)
+
+    data = {}
+    for name in columns:
+        if name in genre_index:
+            data[name] = arrays[GENRE_MATRIX][:, genre_index[name]].astype(np.int64)
+        else:
+            data[name] = arrays[name]
+    return pd.DataFrame(data)
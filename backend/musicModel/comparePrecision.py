@@ -0,0 +1,101 @@
+import argparse
+import json
+import time
+import numpy as np
+import torch
+from pathlib import Path
+from datasets import TrainTestVal, BatchLoader
+from evaluation import evaluate
+from model import ArtistSongRecModel
+from similarity import normalizedEmbeddings, genreFlagMatrix, similarSongs
+
+
+# How a trained model does in bfloat16 next to float32: RMSLE of the playcount predictions on a split, and how
+# many of the top k recommendations (same scoring as the server) stay the same. Writes a json report.
+# Usage (from musicModel/): python comparePrecision.py --model models/musicrec.pth
+def parseArgs(argv=None):
+    backendDir = Path(__file__).resolve().parent.parent
+
+    parser = argparse.ArgumentParser(description="Compare bfloat16 against float32 for a trained model.")
+    parser.add_argument("--songs-dir", type=Path, default=backendDir / "proccsedData" / "songs")
+    parser.add_argument("--pickles-dir", type=Path, default=backendDir / "proccsedData" / "pickles")
+    parser.add_argument("--model", type=Path, default=Path("models") / "musicrec.pth")
+    parser.add_argument("--split", choices=["train", "val", "test"], default="test")
+    parser.add_argument("--eval-batch-size", type=int, default=4096)
+    parser.add_argument("--k", type=int, default=10, help="recommendations per query")
+    parser.add_argument("--queries", type=int, default=1000, help="songs to query (spread evenly over the catalog)")
+    parser.add_argument("--out", type=Path, default=Path("precision_report.json"))
+    return parser.parse_args(argv)
+
+# Rebuild the model with the sizes its saved weights have
+def loadModel(modelFile, device):
+    state = torch.load(modelFile, map_location=device)
+    numSongs, songArtistEmbedSize = state["songEmbedding.weight"].shape
+    genreEmbedSize, numGenres = state["genreLinear.weight"].shape
+    model = ArtistSongRecModel(numSongs=numSongs, numArtists=state["artistEmbedding.weight"].shape[0], numGenres=numGenres,
+                               songArtistEmbedSize=songArtistEmbedSize, genreEmbedSize=genreEmbedSize,
+                               HLSize=state["fullyConnectedLayer1.weight"].shape[0]).to(device)
+    model.load_state_dict(state)
+    model.eval()
+    return model
+
+# Mean seconds per similarSongs() call over the queries
+def timeQueries(embeddings, genreFlags, queries, k):
+    start = time.perf_counter()
+    for index in queries:
+        similarSongs(embeddings, genreFlags, index, k)
+    return (time.perf_counter() - start) / max(len(queries), 1)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = loadModel(args.model, device)
+
+    songsTable = args.songs_dir / "genre_by_song.csv"
+    if not songsTable.exists():
+        songsTable = args.songs_dir / "genre_by_song"
+    pickles = [args.pickles_dir / name for name in ("song_labels.pkl", "artist_labels.pkl", "genre_labels.pkl")]
+
+    # Playcount predictions
+    dataset = TrainTestVal(songsTable, *pickles, split=args.split)
+    loader = BatchLoader(dataset, args.eval_batch_size)
+    fp32 = evaluate(model, loader, device)
+    bf16 = evaluate(model, loader, device, bf16=True)
+
+    # Recommendations, over every song of the table with the genre filter the server applies
+    everySong = TrainTestVal(songsTable, *pickles)
+    numSongs = model.songEmbedding.num_embeddings
+    genreFlags = genreFlagMatrix(everySong.songIndex.numpy(), everySong[:][4].numpy(), numSongs).to(device)
+    embeddings = {dtype: normalizedEmbeddings(model, dtype) for dtype in (torch.float32, torch.bfloat16)}
+
+    queries = np.linspace(0, numSongs - 1, min(args.queries, numSongs)).astype(int).tolist()
+    overlaps, exact = [], 0
+    for index in queries:
+        _, fp32Top = similarSongs(embeddings[torch.float32], genreFlags, index, args.k)
+        _, bf16Top = similarSongs(embeddings[torch.bfloat16], genreFlags, index, args.k)
+        overlaps.append(len(set(fp32Top.tolist()) & set(bf16Top.tolist())) / args.k)
+        exact += int(torch.equal(fp32Top, bf16Top))
+
+    report = {
+        "model": str(args.model),
+        "split": args.split,
+        "rmsle": {"fp32": fp32["rmsle"], "bf16": bf16["rmsle"], "difference": bf16["rmsle"] - fp32["rmsle"]},
+        "poisson": {"fp32": fp32["poisson"], "bf16": bf16["poisson"]},
+        "top_k": {
+            "k": args.k,
+            "queries": len(queries),
+            "mean_overlap": float(np.mean(overlaps)) if overlaps else None,
+            "min_overlap": float(np.min(overlaps)) if overlaps else None,
+            "identical_rankings": exact,
+        },
+        "embedding_bytes": {str(dtype).removeprefix("torch."): values.nelement() * values.element_size()
+                            for dtype, values in embeddings.items()},
+        "seconds_per_query": {str(dtype).removeprefix("torch."): timeQueries(values, genreFlags, queries, args.k)
+                              for dtype, values in embeddings.items()},
+    }
+
+    args.out.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,70 @@
 import pandas as pd, pickle
+import hashlib, json, os, shutil
+import numpy as np
 import torch
+from pathlib import Path
 from torch.utils.data import Dataset
+from columnar import is_table, read_table, read_schema, pack_bits, GENRE_MATRIX, GENRE_BITS
+from splits import read_split, read_splits, splits_filename, SPLIT_NAMES
+from hashing import FileHasher
+
+# Bit positions inside one 64 bit word of a packed genre bitset
+BIT_SHIFTS = torch.arange(64, dtype=torch.long)
+
+# Tensors a TrainTestVal keeps in its cache (see TrainTestVal.loadCached), bump the version whenever how
+# they are derived or laid out changes
+TENSOR_CACHE_VERSION = 2
+CACHED_TENSORS = ("songIndex", "artistIndex", "playcounts", "listeners", "genreBits")
+
+# Unpickled label encoders by (path, size, mtime), so the train/val/test datasets share one copy of each
+loadedEncoders = {}
+
+def loadEncoder(pickleFile):
+    stat = os.stat(pickleFile)
+    key = (str(Path(pickleFile).resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in loadedEncoders:
+        with open(pickleFile, "rb") as file:
+            loadedEncoders[key] = pickle.load(file)
+    return loadedEncoders[key]
+
+# Turn packed genre bitsets ([..., words] int64) into the multi-hot float tensor ([..., numGenres]) the model takes
+def unpackGenres(genreBits, numGenres):
+    bits = (genreBits.unsqueeze(-1) >> BIT_SHIFTS) & 1
+    return bits.flatten(-2)[..., :numGenres].float()
 
 # Turn indexes into tensors
+# Genres are held as packed bitsets (see columnar.pack_bits) and only unpacked for the rows being fetched,
+# so index with a whole batch of indices at once (e.g. through a BatchSampler) to unpack in bulk
 class TrainTestVal(Dataset):
 
-    # read csv
-    def __init__(self, trainValTestCSV, songPickle, artistPickle, genrePickle):
+    # read csv (or a columnar table directory written by preprocess.py --format npy)
+    # split: "train"/"val"/"test" to only take that split's rows of a master table (see splits.py)
+    # columns: genre columns to load (default every genre the encoder knows, [] for no genres)
+    # cacheDir: keep the tensors built from the csv (or a table's splits) there, keyed by the file, split and
+    # encoder contents (None to not cache)
+    def __init__(self, trainValTestCSV, songPickle, artistPickle, genrePickle, split=None, columns=None, cacheDir=None):
+
+        # Grab the serialized information for the genres, user ratings, and artists (loaded once per process)
+        self.genreLE = loadEncoder(genrePickle)
+        self.songLE = loadEncoder(songPickle)
+        self.artistLE = loadEncoder(artistPickle)
 
-        # Get info from the csvs for later
-        self.trainTestValDataFrame = pd.read_csv(trainValTestCSV)
+        genreColumns = list(self.genreLE.classes_) if columns is None else list(columns)
+        self.numGenres = len(genreColumns)
 
-        # Grab the serialized information for the genres, user ratings, and artists
-        with open(genrePickle, "rb") as file:
-            self.genreLE = pickle.load(file)
+        if is_table(trainValTestCSV) and (split is None or cacheDir is None):
+            self.loadTable(trainValTestCSV, split, genreColumns)
+            return
 
-        with open(songPickle, "rb") as file:
-            self.songLE = pickle.load(file)
+        if cacheDir is not None:
+            self.loadCached(trainValTestCSV, songPickle, artistPickle, split, genreColumns, cacheDir)
+            return
 
-        with open(artistPickle, "rb") as file:
-            self.artistLE = pickle.load(file)
+        # Get info from the csvs for later (only the columns we use)
+        self.trainTestValDataFrame = pd.read_csv(trainValTestCSV, usecols=["song_mbid", "artist_mbid", "playcount", "listeners"] + genreColumns)
+        if split is not None:
+            rows = read_split(trainValTestCSV, split, self.trainTestValDataFrame.song_mbid)
+            self.trainTestValDataFrame = self.trainTestValDataFrame.iloc[rows].reset_index(drop=True)
 
         # Map the human understandable information to what the network understands
         self.trainTestValDataFrame["songIndex"] = self.songLE.transform(self.trainTestValDataFrame.song_mbid)
@@ -30,20 +75,175 @@ class TrainTestVal(Dataset):
         self.artistIndex = torch.tensor(self.trainTestValDataFrame.artistIndex.values, dtype=torch.long)
         self.playcounts = torch.tensor(self.trainTestValDataFrame.playcount.values, dtype=torch.float)
         self.listeners = torch.tensor(self.trainTestValDataFrame.listeners.values, dtype=torch.float)
-        genreColumns = list(self.genreLE.classes_)
-        self.genreValues = torch.tensor(self.trainTestValDataFrame[genreColumns].values, dtype=torch.float)
+        self.genreBits = self.packGenres(self.trainTestValDataFrame[genreColumns].to_numpy(dtype=np.int8))
+
+    # Build the tensors of the whole csv or table once, ordered by split so every split is one contiguous slice
+    # of the cached arrays (or map the ones a previous run cached), then take the split's rows without copying
+    def loadCached(self, source, songPickle, artistPickle, split, genreColumns, cacheDir):
+        self.trainTestValDataFrame = None
+        hasher = FileHasher(Path(cacheDir) / "file_hashes.json")
+        splitsFile = splits_filename(source)
+        cacheKey = hashlib.sha256(json.dumps({
+            "version": TENSOR_CACHE_VERSION,
+            "source": hasher.hash(source),
+            "songs": hasher.hash(songPickle),
+            "artists": hasher.hash(artistPickle),
+            "splits": hasher.hash(splitsFile) if os.path.exists(splitsFile) else None,
+            "genres": genreColumns,
+        }).encode("utf-8")).hexdigest()[:16]
+        hasher.save()
+        cachePath = Path(cacheDir) / cacheKey
+
+        if not cachePath.exists():
+            if is_table(source):
+                arrays = self.tableArrays(source, slice(None), genreColumns)
+                mbids = lambda: read_table(source, ["song_mbid"])["song_mbid"]
+            else:
+                arrays = self.csvArrays(source, genreColumns)
+                mbids = lambda: pd.read_csv(source, usecols=["song_mbid"]).song_mbid
+
+            # rows of train, then val, then test
+            splitRows = read_splits(source, mbids)
+            rowOrder = np.concatenate([splitRows[name] for name in SPLIT_NAMES])
+            arrays = {name: values[rowOrder] for name, values in arrays.items()}
+            arrays["rowOrder"] = rowOrder
+            arrays["splitBounds"] = np.cumsum([0] + [len(splitRows[name]) for name in SPLIT_NAMES])
+
+            # write next to it and move it into place, so a crashed or concurrent build never leaves half a cache
+            scratch = cachePath.with_name(f"{cacheKey}.{os.getpid()}.partial")
+            shutil.rmtree(scratch, ignore_errors=True)
+            scratch.mkdir(parents=True)
+            for name, values in arrays.items():
+                np.save(scratch / f"{name}.npy", values)
+            try:
+                os.replace(scratch, cachePath)
+            except OSError:
+                # another process finished the same cache first
+                shutil.rmtree(scratch, ignore_errors=True)
+
+        # copy-on-write maps, like loadTable()
+        tensors = {name: np.load(cachePath / f"{name}.npy", mmap_mode="c") for name in CACHED_TENSORS}
+
+        if split is None:
+            # every row, back in the source's own order (this one copies)
+            rows = np.argsort(np.load(cachePath / "rowOrder.npy"))
+        elif split in SPLIT_NAMES:
+            bounds = np.load(cachePath / "splitBounds.npy")
+            index = SPLIT_NAMES.index(split)
+            rows = slice(int(bounds[index]), int(bounds[index + 1]))
+        else:
+            raise ValueError(f"Unknown split {split!r}, expected one of {SPLIT_NAMES}")
+        for name, values in tensors.items():
+            setattr(self, name, torch.from_numpy(values[rows]))
+
+    # Tensor columns (as numpy arrays) of every row of a csv
+    def csvArrays(self, csvFile, genreColumns):
+        frame = pd.read_csv(csvFile, usecols=["song_mbid", "artist_mbid", "playcount", "listeners"] + genreColumns)
+        return {
+            "songIndex": self.songLE.transform(frame.song_mbid).astype(np.int64),
+            "artistIndex": self.artistLE.transform(frame.artist_mbid).astype(np.int64),
+            "playcounts": frame.playcount.to_numpy(dtype=np.float32),
+            "listeners": frame.listeners.to_numpy(dtype=np.float32),
+            "genreBits": pack_bits(frame[genreColumns].to_numpy(dtype=np.int8)).view(np.int64),
+        }
+
+    def packGenres(self, genreFlags):
+        return torch.from_numpy(pack_bits(genreFlags).view(np.int64))
         
+    # Columnar tables already hold the encoded ids and the genre matrix, so nothing is re-derived
+    def loadTable(self, tableDirectory, split, genreColumns):
+        self.trainTestValDataFrame = None
+
+        # rows of the requested split (fancy indexing copies just those rows out of the maps, a cacheDir avoids that)
+        rows = slice(None)
+        if split is not None:
+            rows = read_split(tableDirectory, split, lambda: read_table(tableDirectory, ["song_mbid"])["song_mbid"])
+
+        for name, values in self.tableArrays(tableDirectory, rows, genreColumns).items():
+            setattr(self, name, torch.from_numpy(values))
+
+    # Tensor columns (as numpy arrays) of the given rows of a columnar table, maps of the files for slice(None)
+    def tableArrays(self, tableDirectory, rows, genreColumns):
+        # copy-on-write maps: tensors can share the pages without torch complaining about read-only memory
+        columns = read_table(tableDirectory, ["song_enc_id", "artist_enc_id", "playcount", "listeners"], mmap_mode="c")
+        columns = {name: values[rows] for name, values in columns.items()}
+
+        # Genres in the order the genre encoder expects
+        schema = read_schema(tableDirectory)
+        if schema.get("genre_storage") == GENRE_BITS and schema["genres"] == genreColumns:
+            # already packed in the right order, use the bitsets as they are
+            genreBits = read_table(tableDirectory, [GENRE_BITS], mmap_mode="c")[GENRE_BITS][rows].view(np.int64)
+        else:
+            genreOrder = [schema["genres"].index(genre) for genre in genreColumns]
+            genreFlags = read_table(tableDirectory, [GENRE_MATRIX])[GENRE_MATRIX][rows]
+            genreBits = pack_bits(genreFlags[:, genreOrder]).view(np.int64)
+
+        return {
+            "songIndex": np.asarray(columns["song_enc_id"], dtype=np.int64),
+            "artistIndex": np.asarray(columns["artist_enc_id"], dtype=np.int64),
+            "playcounts": np.asarray(columns["playcount"], dtype=np.float32),
+            "listeners": np.asarray(columns["listeners"], dtype=np.float32),
+            "genreBits": genreBits,
+        }
 
     # Get length of dataset
     def __len__(self):
         return len(self.songIndex)
     
-    # Get a specific song/artist
+    # Get a specific song/artist, or a whole batch when idx is a list/tensor of indices
     def __getitem__(self, idx):
         return (
             self.songIndex[idx],
             self.artistIndex[idx],
             self.playcounts[idx],
             self.listeners[idx],
-            self.genreValues[idx]
-        )
\ No newline at end of file
+            unpackGenres(self.genreBits[idx], self.numGenres)
+        )
+
+# Yields whole batches sliced straight out of a dataset's tensors, in this process: one permutation per epoch
+# when shuffling (contiguous slices otherwise), no per-item indexing, worker processes or re-collating.
+# With worldSize > 1 every rank iterates its own rank::worldSize share of the rows. The ranks must then shuffle
+# with identically seeded generators, and when padToWorld is set the shares are padded (by repeating rows
+# from the start, like DistributedSampler) so every rank runs the same number of batches
+class BatchLoader:
+
+    def __init__(self, dataset, batchSize, shuffle=False, dropLast=False, generator=None, rank=0, worldSize=1, padToWorld=True):
+        self.dataset = dataset
+        self.batchSize = batchSize
+        self.shuffle = shuffle
+        self.dropLast = dropLast
+        self.generator = generator
+        self.rank = rank
+        self.worldSize = worldSize
+        self.padToWorld = padToWorld
+
+    # Rows this rank iterates per epoch
+    def shardSize(self):
+        size = len(self.dataset)
+        if self.padToWorld:
+            return (size + self.worldSize - 1) // self.worldSize
+        return len(range(self.rank, size, self.worldSize))
+
+    # Number of batches per epoch
+    def __len__(self):
+        if self.dropLast:
+            return self.shardSize() // self.batchSize
+        return (self.shardSize() + self.batchSize - 1) // self.batchSize
+
+    def __iter__(self):
+        size = len(self.dataset)
+        order = torch.randperm(size, generator=self.generator) if self.shuffle else None
+
+        if self.worldSize > 1:
+            order = torch.arange(size) if order is None else order
+            if self.padToWorld:
+                padded = self.shardSize() * self.worldSize
+                order = torch.cat((order, order[:padded - size]))
+            order = order[self.rank::self.worldSize]
+
+        shardSize = len(order) if order is not None else size
+        end = shardSize - shardSize % self.batchSize if self.dropLast else shardSize
+
+        for start in range(0, end, self.batchSize):
+            rows = slice(start, min(start + self.batchSize, shardSize))
+            yield self.dataset[order[rows]] if order is not None else self.dataset[rows]
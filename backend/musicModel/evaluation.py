@@ -0,0 +1,64 @@
+import torch
+import torch.distributed as dist
+from torch import nn
+
+# Poisson loss, squared error and squared log error of the playcount model, summed in tensors on the
+# model's device. Nothing is read back until compute(), so the device is only synced once per pass.
+# In a distributed run compute() adds up every rank's sums first, so all ranks get the metrics of all rows
+class PlaycountMetrics:
+
+    def __init__(self, device):
+        # MPS has no float64, every other device sums in double precision
+        dtype = torch.float32 if torch.device(device).type == "mps" else torch.float64
+        self.sums = torch.zeros(4, dtype=dtype, device=device)  # poisson loss, squared error, squared log error, rows
+        self.poisson = nn.PoissonNLLLoss(log_input=True, full=False, reduction="sum")
+
+    # logMean: the model's log of expected playcounts (log rate + log listeners) for a batch
+    def update(self, logMean, playcounts):
+        logMean = logMean.detach()
+        predictions = torch.exp(logMean)
+        batchSums = torch.stack((
+            self.poisson(logMean, playcounts),
+            torch.sum((predictions - playcounts) ** 2),
+            torch.sum((torch.log1p(predictions) - torch.log1p(playcounts)) ** 2),
+            playcounts.new_tensor(float(playcounts.numel())),
+        ))
+        self.sums += batchSums.to(self.sums.dtype)
+
+    # Averages over every row seen (one device sync, plus one all_reduce across ranks)
+    def compute(self):
+        sums = self.sums.clone()
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(sums)
+        poisson, squared, squaredLog, rows = sums.tolist()
+        rows = max(rows, 1)
+        return {"poisson": poisson / rows, "rmse": (squared / rows) ** 0.5, "rmsle": (squaredLog / rows) ** 0.5, "rows": int(rows)}
+
+# The model's log of expected playcounts: its log rate per listener plus log listeners. Songs without
+# listeners count as having one, so their log mean stays finite (training and evaluation must agree on this)
+def logMeans(logRate, listeners):
+    return logRate.float() + torch.log(listeners.clamp_min(1.0))
+
+# Move a (songs, artists, playcounts, listeners, genres) batch onto the device with the dtypes the model takes
+def toDevice(batch, device):
+    songs, artists, playcounts, listeners, genres = batch
+    return (
+        songs.to(device, non_blocking=True),
+        artists.to(device, non_blocking=True),
+        playcounts.to(device, non_blocking=True).float(),
+        listeners.to(device, non_blocking=True).float(),
+        genres.to(device, non_blocking=True).float(),
+    )
+
+# Metrics of the model over every batch of loader (val, test, or any offline evaluation of a saved model)
+# bf16: run the model under bfloat16 autocast (the metrics are still computed in float32)
+def evaluate(model, loader, device, bf16=False):
+    model.eval()
+    metrics = PlaycountMetrics(device)
+    with torch.inference_mode():
+        for batch in loader:
+            songs, artists, playcounts, listeners, genres = toDevice(batch, device)
+            with torch.autocast(torch.device(device).type, dtype=torch.bfloat16, enabled=bf16):
+                logRate = model(songs, artists, genres)
+            metrics.update(logMeans(logRate, listeners), playcounts)
+    return metrics.compute()
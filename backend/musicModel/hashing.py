@@ -0,0 +1,50 @@
+### Content hashes of input files, shared by the dataset tensor cache (datasets.py) and pipeline.py's stage keys
+###
+### Hashes are remembered in a json file by path, size and mtime, so unchanged multi-hundred MB inputs are
+### not re-read on every run.
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+class FileHasher:
+    """
+    sha256 of file (or directory) contents, remembered in filename.
+    """
+
+    def __init__(self, filename: Path):
+        self.filename = Path(filename)
+        self.known = json.loads(self.filename.read_text()) if self.filename.exists() else {}
+        self.changed = False
+
+    def hash(self, path: Path) -> str:
+        path = Path(path).resolve()
+        if path.is_dir():
+            digest = hashlib.sha256()
+            for child in sorted(path.rglob("*")):
+                if child.is_file():
+                    digest.update(str(child.relative_to(path)).encode("utf-8"))
+                    digest.update(self.hash(child).encode("ascii"))
+            return digest.hexdigest()
+
+        stat = path.stat()
+        key = f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+        if key not in self.known:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            self.known[key] = digest.hexdigest()
+            self.changed = True
+        return self.known[key]
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        # write next to it and move it into place, so processes saving at the same time never leave half a file
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        scratch = self.filename.with_name(f"{self.filename.name}.{os.getpid()}")
+        scratch.write_text(json.dumps(self.known))
+        os.replace(scratch, self.filename)
+        self.changed = False
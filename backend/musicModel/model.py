@@ -6,16 +6,18 @@ import torch.nn.functional as F
 
 # inherits attributes from nn.Module
 class ArtistSongRecModel(nn.Module):
-    def __init__(self, numSongs, numArtists, numGenres, songArtistEmbedSize, genreEmbedSize, HLSize): #, dropout=0.5):
+    # sparse: the embedding tables get sparse gradients (only the rows a batch looked up), for torch.optim.SparseAdam.
+    # It doesn't change the parameters, so a model trained either way loads into the other
+    def __init__(self, numSongs, numArtists, numGenres, songArtistEmbedSize, genreEmbedSize, HLSize, sparse=False): #, dropout=0.5):
         super().__init__() # initialize parent class attributes first
         
         # Embedding users + movies
-        self.artistEmbedding = nn.Embedding(numArtists, songArtistEmbedSize)
-        self.songEmbedding = nn.Embedding(numSongs, songArtistEmbedSize)
+        self.artistEmbedding = nn.Embedding(numArtists, songArtistEmbedSize, sparse=sparse)
+        self.songEmbedding = nn.Embedding(numSongs, songArtistEmbedSize, sparse=sparse)
 
         # Embedding biases for the users and movies
-        self.artistBias = nn.Embedding(numArtists, 1)
-        self.songBias = nn.Embedding(numSongs, 1)
+        self.artistBias = nn.Embedding(numArtists, 1, sparse=sparse)
+        self.songBias = nn.Embedding(numSongs, 1, sparse=sparse)
         self.bias = nn.Parameter(torch.zeros(1)) # Global bias
 
         # Constructing the network. Adjust if needed later
@@ -24,6 +26,14 @@ class ArtistSongRecModel(nn.Module):
         self.fullyConnectedLayer2 = nn.Linear(HLSize, 1)
       #  self.drop = nn.Dropout(dropout)
 
+    # The per song/artist tables (sized by the catalog), and every other parameter (sized by the network)
+    def embeddingParameters(self):
+        return [table.weight for table in (self.artistEmbedding, self.songEmbedding, self.artistBias, self.songBias)]
+
+    def denseParameters(self):
+        embeddings = {id(parameter) for parameter in self.embeddingParameters()}
+        return [parameter for parameter in self.parameters() if id(parameter) not in embeddings]
+
     # forward pass
     # MH = multi hot
     def forward(self, songIDs, artistIDs, genreMH):
@@ -0,0 +1,86 @@
+import itertools
+import time
+from collections import defaultdict
+import torch
+
+# Order the phases of a training step are reported in (see trainModel.trainStep)
+PHASES = ("data", "forward", "backward", "optimizer")
+
+# Wall time per phase of a training step. mark(phase) closes the phase that has been running since the previous
+# mark; on a GPU it synchronizes first so the time lands in the phase that queued the work
+class PhaseTimer:
+
+    def __init__(self, device):
+        self.totals = defaultdict(float)
+        self.synchronize = torch.cuda.synchronize if torch.device(device).type == "cuda" else (lambda: None)
+        self.last = time.perf_counter()
+
+    def restart(self):
+        self.synchronize()
+        self.last = time.perf_counter()
+
+    def mark(self, phase):
+        self.synchronize()
+        now = time.perf_counter()
+        self.totals[phase] += now - self.last
+        self.last = now
+
+# Batches of loader forever, starting a new epoch whenever one runs out
+def cycle(loader):
+    return itertools.chain.from_iterable(itertools.repeat(loader))
+
+# Run warmup untimed steps, then steps timed ones of step(batch, mark) over batches of loader, and report
+# throughput and how each step splits into data/forward/backward/optimizer. With trace, the timed steps are
+# also recorded by torch.profiler and saved as a Chrome trace (open in chrome://tracing or Perfetto)
+def profileSteps(step, loader, device, warmup, steps, trace=None):
+    batches = cycle(loader)
+    for _ in range(warmup):
+        step(next(batches), lambda phase: None)
+
+    timer = PhaseTimer(device)
+    rows = 0
+    profiler = None
+    if trace is not None:
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.device(device).type == "cuda":
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        profiler = torch.profiler.profile(activities=activities)
+        profiler.start()
+
+    timer.restart()
+    start = time.perf_counter()
+    for _ in range(steps):
+        batch = next(batches)
+        rows += len(batch[0])
+        step(batch, timer.mark)
+    seconds = time.perf_counter() - start
+
+    report = {
+        "warmup_steps": warmup,
+        "steps": steps,
+        "rows": rows,
+        "seconds": seconds,
+        "samples_per_second": rows / seconds if seconds else None,
+        "ms_per_step": seconds / max(steps, 1) * 1000,
+        "phases": {phase: {"ms_per_step": timer.totals[phase] / max(steps, 1) * 1000,
+                           "share": timer.totals[phase] / seconds if seconds else None}
+                   for phase in PHASES},
+    }
+
+    if profiler is not None:
+        profiler.stop()
+        profiler.export_chrome_trace(str(trace))
+        report["trace"] = str(trace)
+        report["top_ops"] = [{"name": event.key, "calls": event.count, "cpu_ms": event.cpu_time_total / 1000}
+                             for event in sorted(profiler.key_averages(), key=lambda event: -event.cpu_time_total)[:15]]
+    return report
+
+# Short text version of a profileSteps() report
+def formatReport(report):
+    lines = [f"{report['samples_per_second']:,.0f} samples/s, {report['ms_per_step']:.2f} ms/step "
+             f"over {report['steps']} steps ({report['warmup_steps']} warmup)"]
+    for phase, numbers in report["phases"].items():
+        lines.append(f"  {phase:10} {numbers['ms_per_step']:8.3f} ms/step  {numbers['share']:6.1%}")
+    if "trace" in report:
+        lines.append(f"  trace written to {report['trace']}")
+    return "\n".join(lines)
@@ -4,8 +4,9 @@ import pandas as pd
 import numpy as np
 import os
 from pathlib import Path
-import torch.nn.functional as F
 from model import ArtistSongRecModel
+from columnar import is_table, read_table, GENRE_MATRIX
+from similarity import normalizedEmbeddings, genreFlagMatrix, similarSongs
 
 # File paths
 currentDirectory = os.path.dirname(os.path.abspath(__file__))
@@ -14,8 +15,14 @@ backendDir = Path(__file__).resolve().parent.parent
 songsDirectory = backendDir / "proccsedData" / "songs"
 songCSV = songsDirectory / "genre_by_song.csv"
 songsArtistsNames = songsDirectory / "song_artist_mbid_genre.csv"
-songs = pd.read_csv(songCSV)
-mbidToSongArtistName = pd.read_csv(songsArtistsNames)
+
+# Prefer the memory-mapped columnar tables when preprocessing wrote them
+songTable = songsDirectory / "genre_by_song"
+songsArtistsNamesTable = songsDirectory / "song_artist_mbid_genre"
+if is_table(songsArtistsNamesTable):
+    mbidToSongArtistName = pd.DataFrame(read_table(songsArtistsNamesTable, ["song_mbid", "song_name", "artist_name"], mmap_mode=None))
+else:
+    mbidToSongArtistName = pd.read_csv(songsArtistsNames)
 songPickle   = os.path.join(projectRoot, "proccsedData", "pickles", "song_labels.pkl")
 artistPickle = os.path.join(projectRoot, "proccsedData", "pickles", "artist_labels.pkl")
 genrePickle  = os.path.join(projectRoot, "proccsedData", "pickles", "genre_labels.pkl")
@@ -27,27 +34,39 @@ songIdToArtist = dict(zip(mbidToSongArtistName.song_mbid, mbidToSongArtistName.a
 # Path to model
 trainedModel = os.path.join(projectRoot, "musicModel", "models", "movierec.pth")
 
+# MUSICREC_BF16=True keeps the song embeddings in bfloat16 for scoring (half the memory read per request)
+useBF16 = os.getenv("MUSICREC_BF16", "False").lower() in ("true", "1")
+
 
 # Load info for information retrieval
 with open(songPickle, "rb") as f:
     songEncoder = pickle.load(f)
 
+with open(artistPickle, "rb") as f:
+    artistEncoder = pickle.load(f)
+
 with open(genrePickle, "rb") as f:
     genreLE = pickle.load(f)
 
 # Form the genre matrix 
-non_genre_cols = {
-    "song_mbid","artist_mbid","playcount","listeners",
-    "song_enc_id","artist_enc_id"
-}
-genre_cols = [c for c in songs.columns if c not in non_genre_cols]
+if is_table(songTable):
+    # genre flags are already stored as one (songs x genres) matrix
+    songColumns = read_table(songTable, ["song_enc_id", GENRE_MATRIX])
+    enc_ids     = np.asarray(songColumns["song_enc_id"], dtype=int)
+    genre_block = np.asarray(songColumns[GENRE_MATRIX], dtype=np.float32)
+else:
+    songs = pd.read_csv(songCSV)
+    non_genre_cols = {
+        "song_mbid","artist_mbid","playcount","listeners",
+        "song_enc_id","artist_enc_id"
+    }
+    genre_cols = [c for c in songs.columns if c not in non_genre_cols]
+    enc_ids     = songs["song_enc_id"].to_numpy(dtype=int)
+    genre_block = songs[genre_cols].to_numpy(dtype=np.float32)
 numSongs = len(songEncoder.classes_)
-genres = len(genre_cols)
-genresMatrix = np.zeros((numSongs, genres))
-enc_ids     = songs["song_enc_id"].to_numpy(dtype=int)
-genre_block = songs[genre_cols].to_numpy(dtype=np.float32)
-genresMatrix[enc_ids] = genre_block
-genreTensor = torch.from_numpy(genresMatrix) 
+genres = genre_block.shape[1]
+# one bool per flag, genre overlaps are counted with & instead of float64 multiplies
+genreTensor = genreFlagMatrix(enc_ids, genre_block, numSongs)
 
 # Get all the song id's from the song encoder
 classes = songEncoder.classes_  
@@ -57,7 +76,7 @@ indexToSongMBID = {i: classes[i] for i in range(len(classes))}
 # Load the model
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model = ArtistSongRecModel(
-    numSongs=4934, numArtists=1055, numGenres=58,
+    numSongs=numSongs, numArtists=len(artistEncoder.classes_), numGenres=genres,
     songArtistEmbedSize=32, genreEmbedSize=8, HLSize=64
 ).to(device)
 
@@ -66,8 +85,8 @@ model.load_state_dict(state)
 model.eval()
 
 
-songEmbedds = model.songEmbedding.weight.detach().cpu()
-songEmbedds = F.normalize(songEmbedds, dim=1)
+songEmbedds = normalizedEmbeddings(model, torch.bfloat16 if useBF16 else torch.float32)
+genreTensor = genreTensor.to(device)
 
 
 def recommendationSystemTest(songName: str, k: int = 5):
@@ -82,15 +101,8 @@ def recommendationSystemTest(songName: str, k: int = 5):
     except Exception:
         raise KeyError(f"Song MBID {song_mbid} not found in encoder")   
 
-    # Finds the similar songs to the inputted one 
-    queryVector = songEmbedds[index].unsqueeze(0).to(device)
-    calcSimilarity = F.cosine_similarity(queryVector, songEmbedds.to(device))
-    calcSimilarity[index] = -1.0               
-    genreQuery = genreTensor[index]              
-    overlappingGenres = (genreTensor * genreQuery).sum(dim=1)  
-    sharedMask = overlappingGenres >= 2
-    calcSimilarity[~sharedMask] = -1.0  
-    topVals, topIdx = torch.topk(calcSimilarity, k) 
+    # Finds the similar songs to the inputted one that share enough of its genres
+    topVals, topIdx = similarSongs(songEmbedds, genreTensor, index, k)
     
     # Make display all of the movies!
     return [
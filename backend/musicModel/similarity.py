@@ -0,0 +1,27 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Songs need at least this many genres in common with the query to be recommended
+MIN_SHARED_GENRES = 2
+
+# Song embeddings scaled to unit length, so a dot product is their cosine similarity.
+# bfloat16 halves the bytes every request reads (the scores keep 2-3 significant digits)
+def normalizedEmbeddings(model, dtype=torch.float32):
+    return F.normalize(model.songEmbedding.weight.detach().float(), dim=1).to(dtype)
+
+# (songs x genres) bool matrix of the genre flags, rows indexed by song_enc_id (songs not in the table have none)
+def genreFlagMatrix(encIds, genreBlock, numSongs):
+    flags = np.zeros((numSongs, genreBlock.shape[1]), dtype=bool)
+    flags[encIds] = genreBlock > 0
+    return torch.from_numpy(flags)
+
+# Top k songs most similar to the song at index that share enough genres with it, as (scores, indexes)
+def similarSongs(embeddings, genreFlags, index, k, minSharedGenres=MIN_SHARED_GENRES):
+    with torch.inference_mode():
+        # one pass over the table in its own dtype, scores compared in float32
+        similarity = (embeddings @ embeddings[index]).float()
+        similarity[index] = -1.0
+        sharedGenres = (genreFlags & genreFlags[index]).sum(dim=1)
+        similarity[sharedGenres < minSharedGenres] = -1.0
+        return torch.topk(similarity, k)
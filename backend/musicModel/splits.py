@@ -0,0 +1,63 @@
+### Train/val/test splits as row indexes over one master table (instead of separate split files)
+###
+### Every row goes to a split by a hash of its mbid, so the assignment never depends on row order or on
+### which other rows exist: re-running preprocessing or adding songs never moves an existing song.
+
+import hashlib
+import os
+import numpy as np
+
+SPLIT_NAMES = ("train", "val", "test")
+SPLITS_SUFFIX = "_splits.npz"
+
+# same proportions as preprocess.split_train_val_test(): 20% test, then 10% of the rest for validation
+TEST_SIZE = 0.2
+VAL_SIZE = 0.1
+
+def hash_fraction(key: str) -> float:
+    # stable value in [0, 1) per key
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") / 2**64
+
+def assign_splits(keys, test_size: float = TEST_SIZE, val_size: float = VAL_SIZE) -> np.ndarray:
+    """
+    Split id (index into SPLIT_NAMES) for every key.
+    """
+    fractions = np.fromiter((hash_fraction(key) for key in keys), dtype=np.float64)
+
+    splits = np.zeros(len(fractions), dtype=np.int8)  # train
+    splits[fractions < test_size + (1 - test_size) * val_size] = SPLIT_NAMES.index("val")
+    splits[fractions < test_size] = SPLIT_NAMES.index("test")
+    return splits
+
+def split_indices(keys, test_size: float = TEST_SIZE, val_size: float = VAL_SIZE) -> dict[str, np.ndarray]:
+    splits = assign_splits(keys, test_size, val_size)
+    return {name: np.flatnonzero(splits == i) for i, name in enumerate(SPLIT_NAMES)}
+
+def splits_filename(table_path) -> str:
+    # genre_by_song.csv or genre_by_song/ -> genre_by_song_splits.npz
+    base = os.path.splitext(os.path.normpath(str(table_path)))[0]
+    return base + SPLITS_SUFFIX
+
+def write_splits(table_path, keys) -> None:
+    np.savez(splits_filename(table_path), **split_indices(keys))
+
+def read_split(table_path, split: str, keys=None) -> np.ndarray:
+    """
+    Row indexes of split in the master table. Uses the index file preprocessing wrote next to the table,
+    or hashes keys (the table's mbids, or a function returning them) when there is none.
+    """
+    if split not in SPLIT_NAMES:
+        raise ValueError(f"Unknown split {split!r}, expected one of {SPLIT_NAMES}")
+    return read_splits(table_path, keys)[split]
+
+def read_splits(table_path, keys=None) -> dict[str, np.ndarray]:
+    # row indexes of every split, like read_split()
+    filename = splits_filename(table_path)
+    if os.path.exists(filename):
+        with np.load(filename) as indices:
+            return {name: indices[name] for name in SPLIT_NAMES}
+
+    if keys is None:
+        raise FileNotFoundError(f"{filename} does not exist and no keys were given to hash")
+    return split_indices(keys() if callable(keys) else keys)
@@ -0,0 +1,191 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+from pathlib import Path
+from datasets import TrainTestVal
+import trainModel
+
+
+# Hyperparameter sweep over trainModel.py: every trial is a train() call in a process pool, each worker pinned
+# to its own slice of the CPUs. The dataset tensors are built once (the cache of TrainTestVal) and every trial
+# memory maps the same files. Trials report their validation RMSLE after each epoch and
+# one that is clearly worse than the median of the others at the same epoch is stopped early.
+#
+# The search space is a json object of trainModel.py options (underscored) to either
+#   a list of values: every combination is run (--mode grid) or values are drawn from it (--mode random)
+#   {"loguniform": [low, high]} or {"uniform": [low, high]} (random mode), {"randint": [low, high]} (inclusive)
+# Usage (from musicModel/):
+#   python sweep.py --space space.json --mode random --trials 20 --parallel 4 -- --epochs 15 --bf16
+# (options after -- are passed to every trial)
+
+DEFAULT_SPACE = {
+    "lr": [1e-3, 5e-4, 2e-3],
+    "weight_decay": [1e-5, 1e-6],
+    "song_artist_embed": [16, 32, 64],
+    "genre_embed": [8],
+    "hidden": [32, 64, 128],
+}
+
+def parseArgs(argv=None):
+    parser = argparse.ArgumentParser(description="Run a (grid or random) hyperparameter sweep of trainModel.py.")
+    parser.add_argument("--space", type=Path, default=None, help="json search space (default: a small built-in grid)")
+    parser.add_argument("--mode", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=20, help="trials to draw in random mode")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the random draws")
+    parser.add_argument("--parallel", type=int, default=None, help="trials run at once (default: one per CPU)")
+    parser.add_argument("--threads-per-trial", type=int, default=None,
+                        help="CPUs each trial is pinned to (default: the CPUs split evenly between --parallel)")
+    parser.add_argument("--prune-after", type=int, default=2, help="never stop a trial before this epoch")
+    parser.add_argument("--prune-margin", type=float, default=0.05,
+                        help="stop a trial whose validation RMSLE is this fraction above the median of the others at the same epoch")
+    parser.add_argument("--prune-min-peers", type=int, default=3, help="other trials needed at an epoch before any is stopped")
+    parser.add_argument("--out-dir", type=Path, default=Path("sweeps"), help="trial models and results.json go here")
+    args, trainArgs = parser.parse_known_args(argv)
+    args.train_args = [arg for arg in trainArgs if arg != "--"]
+    return args
+
+# ----- Search space -----
+
+def drawValue(spec, rng):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    (kind, (low, high)), = spec.items()
+    if kind == "loguniform":
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    if kind == "uniform":
+        return rng.uniform(low, high)
+    if kind == "randint":
+        return rng.randint(low, high)
+    raise ValueError(f"Unknown distribution {kind!r}")
+
+def trialParams(space, mode, trials, seed):
+    if mode == "grid":
+        if not all(isinstance(spec, list) for spec in space.values()):
+            raise ValueError("grid mode needs a list of values for every option")
+        return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+    rng = random.Random(seed)
+    return [{name: drawValue(spec, rng) for name, spec in space.items()} for _ in range(trials)]
+
+# ----- Early termination -----
+
+# Validation RMSLE of every trial by epoch, shared by the whole pool through a Manager
+class MedianStopping:
+
+    def __init__(self, manager, pruneAfter, margin, minPeers):
+        self.scores = manager.dict()  # epoch -> {trial: rmsle}
+        self.lock = manager.Lock()
+        self.pruneAfter = pruneAfter
+        self.margin = margin
+        self.minPeers = minPeers
+
+    # Record a trial's epoch and tell whether it should keep going
+    def report(self, trial, epoch, rmsle):
+        with self.lock:
+            scores = dict(self.scores.get(epoch, {}))
+            peers = sorted(score for other, score in scores.items() if other != trial)
+            scores[trial] = rmsle
+            self.scores[epoch] = scores
+
+        if epoch < self.pruneAfter or len(peers) < self.minPeers or not math.isfinite(rmsle):
+            return math.isfinite(rmsle)
+        median = peers[len(peers) // 2] if len(peers) % 2 else (peers[len(peers) // 2 - 1] + peers[len(peers) // 2]) / 2
+        return rmsle <= median * (1 + self.margin)
+
+# ----- Trials -----
+
+def pinWorker(slots, threadsPerTrial):
+    # each worker takes a slot and keeps to its CPUs, so trials don't fight over cores
+    slot = slots.get()
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    mine = cpus[slot * threadsPerTrial:(slot + 1) * threadsPerTrial] or cpus
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, mine)
+
+    # the trials' epoch lines would just interleave, results are collected from their return values
+    sys.stdout = open(os.devnull, "w")
+
+def runTrial(trial, params, trainArgv, threads, stopping, outDir):
+    args = trainModel.parseArgs(trainArgv + ["--model-out", str(outDir / f"trial-{trial:03}.pth")])
+    for name, value in params.items():
+        setattr(args, name, value)
+    args.threads = threads
+
+    def onEpoch(epoch, validation):
+        return stopping.report(trial, epoch, validation["rmsle"])
+
+    result = trainModel.train(0, args, onEpoch=onEpoch)
+    history = result["validation_rmsle"]
+    return {
+        "trial": trial,
+        "params": params,
+        "validation_rmsle": min(history),
+        "best_epoch": history.index(min(history)) + 1,
+        "epochs_run": len(history),
+        "stopped_early": len(history) < args.epochs,
+        "history": history,
+        "testing_rmsle": result["testing"]["rmsle"],
+        "model": str(args.model_out),
+    }
+
+# Build the dataset cache once up front, so the trials all map it instead of each building it
+def warmDatasetCache(trainArgv):
+    args = trainModel.parseArgs(trainArgv)
+    songsTable = args.songs_dir / "genre_by_song.csv"
+    if not songsTable.exists():
+        songsTable = args.songs_dir / "genre_by_song"
+    if args.no_cache or not songsTable.exists():
+        return
+    pickles = [args.pickles_dir / name for name in ("song_labels.pkl", "artist_labels.pkl", "genre_labels.pkl")]
+    TrainTestVal(songsTable, *pickles, split="train", cacheDir=args.cache_dir or args.songs_dir / ".dataset_cache")
+
+def main(argv=None):
+    args = parseArgs(argv)
+    space = json.loads(args.space.read_text()) if args.space else DEFAULT_SPACE
+
+    known = vars(trainModel.parseArgs([]))
+    unknown = [name for name in space if name not in known]
+    if unknown:
+        raise SystemExit(f"Not trainModel.py options: {unknown}")
+
+    trials = trialParams(space, args.mode, args.trials, args.seed)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    parallel = max(1, min(args.parallel or cpus, len(trials)))
+    threadsPerTrial = args.threads_per_trial or max(1, cpus // parallel)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    warmDatasetCache(args.train_args)
+    print(f"--> {len(trials)} trials, {parallel} at a time with {threadsPerTrial} threads each")
+
+    results = []
+    with Manager() as manager:
+        slots = manager.Queue()
+        for slot in range(parallel):
+            slots.put(slot)
+        stopping = MedianStopping(manager, args.prune_after, args.prune_margin, args.prune_min_peers)
+
+        with ProcessPoolExecutor(max_workers=parallel, initializer=pinWorker, initargs=(slots, threadsPerTrial)) as pool:
+            futures = [pool.submit(runTrial, trial, params, args.train_args, threadsPerTrial, stopping, args.out_dir)
+                       for trial, params in enumerate(trials)]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                print(f"  trial {result['trial']:3}: validation RMSLE={result['validation_rmsle']:.4f} "
+                      f"after {result['epochs_run']} epochs{' (stopped early)' if result['stopped_early'] else ''} {result['params']}")
+
+    results.sort(key=lambda result: result["validation_rmsle"])
+    summary = {"mode": args.mode, "space": space, "train_args": args.train_args, "trials": results}
+    (args.out_dir / "results.json").write_text(json.dumps(summary, indent=2))
+
+    print("\n----- Ranked by validation RMSLE -----")
+    for rank, result in enumerate(results, start=1):
+        print(f"{rank:3}. {result['validation_rmsle']:.4f} (test {result['testing_rmsle']:.4f}) trial {result['trial']} {result['params']}")
+
+if __name__ == "__main__":
+    main()
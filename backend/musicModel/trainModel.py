@@ -1,225 +1,244 @@
 import torch
+import argparse
+import json
 import os
+import socket
+import torch.distributed as dist
+import torch.multiprocessing as mp
 from pathlib import Path
 from torch import nn, optim
-from torch.utils.data import DataLoader
-from datasets import TrainTestVal
+from torch.nn.parallel import DistributedDataParallel
+from datasets import TrainTestVal, BatchLoader
+from evaluation import PlaycountMetrics, evaluate, logMeans, toDevice
+from profiling import profileSteps, formatReport
 from model import ArtistSongRecModel
 
 
-def main(): 
-
-    currentDirectory = os.path.dirname(os.path.abspath(__file__))
-
-    projectRoot = os.path.abspath(os.path.join(currentDirectory, os.pardir))
-
+# Paths and hyperparameters, defaults are what the served model was trained with
+def parseArgs(argv=None):
     backendDir = Path(__file__).resolve().parent.parent
 
-    songsDirectory = backendDir / "proccsedData"/ "songs"
-
-    training = songsDirectory / "genre_by_song_train.csv"
-    validation = songsDirectory / "genre_by_song_val.csv"
-    testing = songsDirectory / "genre_by_song_test.csv"
-
-    songPickle = os.path.join(projectRoot, "proccsedData", "pickles", "song_labels.pkl")
-    artistPickle = os.path.join(projectRoot, "proccsedData", "pickles", "artist_labels.pkl")
-    genrePickle = os.path.join(projectRoot, "proccsedData", "pickles", "genre_labels.pkl")
+    parser = argparse.ArgumentParser(description="Train the song/artist playcount model.")
+    parser.add_argument("--songs-dir", type=Path, default=backendDir / "proccsedData" / "songs",
+                        help="directory with genre_by_song.csv (or the genre_by_song/ table) and its splits")
+    parser.add_argument("--pickles-dir", type=Path, default=backendDir / "proccsedData" / "pickles",
+                        help="directory with the song/artist/genre label encoders")
+    parser.add_argument("--cache-dir", type=Path, default=None,
+                        help="where to cache the tensors built from genre_by_song, ordered by split (default <songs-dir>/.dataset_cache)")
+    parser.add_argument("--no-cache", action="store_true", help="rebuild the dataset tensors from the csv every run")
+    parser.add_argument("--model-out", type=Path, default=Path("models") / "musicrec.pth")
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-5)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--eval-batch-size", type=int, default=4096, help="batch size for validation and testing (no gradients kept)")
+    parser.add_argument("--song-artist-embed", type=int, default=32)
+    parser.add_argument("--genre-embed", type=int, default=8)
+    parser.add_argument("--hidden", type=int, default=64)
+    parser.add_argument("--sparse-embeddings", action="store_true",
+                        help="sparse gradients for the song/artist tables, stepped by SparseAdam (the rest by Adam), "
+                             "so a step only touches the rows its batch used")
+    parser.add_argument("--bf16", action="store_true",
+                        help="run the forward/backward pass and evaluation under bfloat16 autocast (weights stay float32)")
+    parser.add_argument("--procs", type=int, default=1,
+                        help="train data parallel across this many local processes (gloo, DistributedDataParallel)")
+    parser.add_argument("--threads", type=int, default=None,
+                        help="intra-op threads per process (default: the machine's cores split between --procs)")
+    parser.add_argument("--seed", type=int, default=0, help="seeds the model init and the shuffling")
+    parser.add_argument("--profile-steps", type=int, default=None,
+                        help="instead of training, time this many steps and report throughput and a per-phase breakdown")
+    parser.add_argument("--warmup-steps", type=int, default=10, help="untimed steps before --profile-steps")
+    parser.add_argument("--profile-trace", type=Path, default=None, help="also save a torch.profiler Chrome trace of the timed steps")
+    parser.add_argument("--profile-out", type=Path, default=None, help="write the profile report as json")
+    return parser.parse_args(argv)
+
+# A free local port for the ranks to rendezvous on
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def main(argv=None):
+
+    args = parseArgs(argv)
+
+    if args.procs > 1:
+        # one command starts every rank, rank 0 prints and saves
+        port = freePort()
+        mp.spawn(train, args=(args, args.procs, port), nprocs=args.procs, join=True)
+    else:
+        train(0, args)
+
+# Optimizers for the model, all of them are stepped every batch
+def buildOptimizers(model, args):
+    if args.sparse_embeddings:
+        # SparseAdam only updates the looked up rows (and has no weight decay), Adam steps the network as usual
+        return [optim.SparseAdam(model.embeddingParameters(), lr=args.lr),
+                optim.Adam(model.denseParameters(), lr=args.lr, weight_decay=args.weight_decay)]
+    return [optim.Adam(model.parameters(), lr=args.lr, weight_decay=args.weight_decay)]
+
+# One optimization step on a batch. Returns the log means and playcounts for the metrics.
+# mark(phase) is called as each phase of the step ends (data, forward, backward, optimizer; see profiling.py)
+def trainStep(network, model, optimizers, poisson, batch, device, args, worldSize=1, mark=lambda phase: None):
+    # Use GPU or CPU
+    songs, artists, playcounts, listeners, genres = toDevice(batch, device)
+    mark("data")
+
+    # bf16 has float32's exponent range, so gradients need no loss scaling, but exp() of the log mean
+    # and the loss are kept in float32 where the playcounts are large
+    with torch.autocast(device.type, dtype=torch.bfloat16, enabled=args.bf16):
+        log_rate = network(songs, artists, genres)
+    logMean = logMeans(log_rate, listeners)
+    loss = poisson(logMean, playcounts)
+    mark("forward")
+
+    for optimizer in optimizers:
+        optimizer.zero_grad()
+    # DDP averages the ranks' gradients, scaling back up gives the gradient of the summed loss
+    # over the whole step like a single process computes
+    (loss * worldSize).backward()
+    mark("backward")
+
+    nn.utils.clip_grad_norm_(model.parameters(), 5)
+    for optimizer in optimizers:
+        optimizer.step()
+    mark("optimizer")
+    return logMean, playcounts
+
+# Train on this process's share of the data. With worldSize > 1 this is one rank of a gloo process group:
+# the model is wrapped in DistributedDataParallel (gradients are averaged across ranks every step) and
+# every metric is summed over all ranks before it is printed.
+# onEpoch(epoch, validationMetrics) returning False stops training early (single process only, see sweep.py).
+# Returns the validation RMSLE of every epoch run and the test metrics
+def train(rank, args, worldSize=1, port=None, onEpoch=None):
+
+    distributed = worldSize > 1
+    if distributed:
+        dist.init_process_group("gloo", init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=worldSize)
+    torch.set_num_threads(args.threads or max(1, (os.cpu_count() or 1) // worldSize))
+    torch.manual_seed(args.seed)
+    isMain = rank == 0
+
+    # one master table, the splits are row indexes over it (genre_by_song_splits.npz, see splits.py)
+    songsTable = args.songs_dir / "genre_by_song.csv"
+    if not songsTable.exists():
+        songsTable = args.songs_dir / "genre_by_song"
+
+    # the tensors are cached once, ordered by split, and every split is memory mapped as one slice on later runs
+    cacheDir = None if args.no_cache else (args.cache_dir or args.songs_dir / ".dataset_cache")
+
+    songPickle = args.pickles_dir / "song_labels.pkl"
+    artistPickle = args.pickles_dir / "artist_labels.pkl"
+    genrePickle = args.pickles_dir / "genre_labels.pkl"
 
     # Create data sets from the csv's def __init__(self, trainValTestCSV, processedSongsCSV, songPickle, artistPickle, genrePickle):
-    trainingDataset = TrainTestVal(training, 
+    trainingDataset = TrainTestVal(songsTable, 
                                     songPickle,
                                     artistPickle,
-                                    genrePickle
+                                    genrePickle,
+                                    split="train",
+                                    cacheDir=cacheDir
                                     )
-    validationDataset = TrainTestVal(validation, 
+    validationDataset = TrainTestVal(songsTable, 
                                     songPickle,
                                     artistPickle,
-                                    genrePickle
+                                    genrePickle,
+                                    split="val",
+                                    cacheDir=cacheDir
                                     )
-    testDataset = TrainTestVal(testing, 
+    testDataset = TrainTestVal(songsTable, 
                                     songPickle,
                                     artistPickle,
-                                    genrePickle
+                                    genrePickle,
+                                    split="test",
+                                    cacheDir=cacheDir
                                     )
 
     # Loads them up. Shuffle training for randomness, but we need validation and testing to be more concrete
-    # and deterministic
-    trainingLoader = DataLoader(trainingDataset, batch_size=512, shuffle=True, num_workers=4)
-    validationLoader = DataLoader(validationDataset, batch_size=512, shuffle=False, num_workers=4)
-    testingLoader = DataLoader(testDataset, batch_size=512, shuffle=False, num_workers=4)
+    # and deterministic. Batches are sliced from the dataset tensors a whole batch at a time, so the packed
+    # genres of a batch get unpacked in one go
+    # Every rank shuffles with the same seed and takes its own share of each permutation, and steps on
+    # batch-size / ranks rows so one step still covers batch-size rows overall
+    shuffleGenerator = torch.Generator().manual_seed(args.seed)
+    trainingLoader = BatchLoader(trainingDataset, max(1, args.batch_size // worldSize), shuffle=True, generator=shuffleGenerator,
+                                 rank=rank, worldSize=worldSize)
+    validationLoader = BatchLoader(validationDataset, args.eval_batch_size, rank=rank, worldSize=worldSize, padToWorld=False)
+    testingLoader = BatchLoader(testDataset, args.eval_batch_size, rank=rank, worldSize=worldSize, padToWorld=False)
 
     numSongsFound = len(trainingDataset.songLE.classes_)
     numArtistsFound = len(trainingDataset.artistLE.classes_)
     numGenresFound = len(trainingDataset.genreLE.classes_)
 
-    print(numSongsFound, numArtistsFound, numGenresFound)
+    if isMain:
+        print(numSongsFound, numArtistsFound, numGenresFound)
 
     # self, numSongs, numArtists, numGenres, songArtistEmbedSize, genreEmbedSize, HLSize
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu") # check if GPU is available
-    model = ArtistSongRecModel(numSongs=numSongsFound, numArtists = numArtistsFound, numGenres = numGenresFound, songArtistEmbedSize=32, genreEmbedSize=8, HLSize=64).to(device) # train on GPU, default CPU
+    model = ArtistSongRecModel(numSongs=numSongsFound, numArtists = numArtistsFound, numGenres = numGenresFound, songArtistEmbedSize=args.song_artist_embed, genreEmbedSize=args.genre_embed, HLSize=args.hidden, sparse=args.sparse_embeddings).to(device) # train on GPU, default CPU
+    # DDP broadcasts rank 0's initial weights, then keeps the replicas in step
+    network = DistributedDataParallel(model) if distributed else model
 
     # calc loss and also optimze using the learning rate, low learning rate for slower learning
-    calcLoss = nn.MSELoss()
-    optimizeNetwork = optim.Adam(model.parameters(), lr=1e-3, weight_decay=1e-5)
+    optimizers = buildOptimizers(model, args)
 
     # How many times we want to go through the network
-    numberEpochs = 10
+    numberEpochs = args.epochs
 
     poisson = nn.PoissonNLLLoss(log_input=True, full=False, reduction="sum")
 
+    if args.profile_steps is not None:
+        # time steps of the real training loop on the real data, then stop without saving anything
+        network.train()
+        step = lambda batch, mark: trainStep(network, model, optimizers, poisson, batch, device, args, worldSize, mark)
+        report = profileSteps(step, trainingLoader, device, args.warmup_steps, args.profile_steps,
+                              args.profile_trace if isMain else None)
+        if isMain:
+            print(formatReport(report))
+            if args.profile_out is not None:
+                args.profile_out.write_text(json.dumps({"config": {k: str(v) for k, v in vars(args).items()}, **report}, indent=2))
+        if distributed:
+            dist.destroy_process_group()
+        return {"profile": report}
+
+    validationHistory = []
+
     # Go through the network!
     for epoch in range(1, numberEpochs + 1):
 
-        # Train the model
-        model.train()
-        totalTrainingLoss = 0.0
-        totalTrainingLossSquared = 0.0
-        totalTrainingLossSquaredLog = 0.0
-        totalTrainingLossRMSLE = 0.0
-        # Put users, movies, and ratings through the network
-        for songs, artists, playcounts, listeners, genres in trainingLoader:
-            # Use GPU or CPU
-            songs, artists, playcounts, listeners, genres = (
-                songs.to(device),
-                artists.to(device),
-                playcounts.to(device).float(),
-                listeners.to(device).float().clamp_min(1.0),
-                genres.to(device).float(),
-            )
-
-            log_rate = model(songs, artists, genres)
-            logMean = log_rate + torch.log(listeners)
-            optimizeNetwork.zero_grad()
-            loss = poisson(logMean, playcounts)
-            loss.backward()
-            nn.utils.clip_grad_norm_(model.parameters(), 5)
-            optimizeNetwork.step()
-
-            totalTrainingLoss += loss.item()
-
-            predictions = torch.exp(logMean)
-            totalTrainingLossSquared += torch.sum((predictions - playcounts) ** 2).item()
-            totalTrainingLossSquaredLog += torch.sum(
-                (torch.log1p(predictions) - torch.log1p(playcounts)) ** 2
-            ).item()
-            
-            
-            totalTrainingLossRMSLE = (totalTrainingLossSquaredLog / len(trainingDataset)) ** 0.5
-
-                        
-
-        """
-            
-            # Zero old gradients, take networks output,
-            # then compute loss
-            optimizeNetwork.zero_grad()
-            output = model(songs, artists, genres)
-            loss = calcLoss(output, playcounts)
-
-            # Backward pass and configure weights
-            loss.backward()
-
-            nn.utils.clip_grad_norm_(model.parameters(), 5)
-            
-            optimizeNetwork.step()
-
-            # Loss for the epoch
-            totalTrainingLoss += loss.item() * songs.size(0)
-
-        averageTrainingLoss = totalTrainingLoss / len(trainingDataset)
-        trainingRMSE = averageTrainingLoss ** 0.5
-
-        """
-
-        """
-        # Evaluate the model!
-        model.eval()
-        newTotalTrainingLoss = 0.0
-        with torch.no_grad():
-              for users, movies, ratings, genres in trainingLoader:
-                 # Use GPU or CPU
-                users, movies, ratings, genres = (
-                    users.to(device),
-                    movies.to(device),
-                    ratings.to(device),
-                    genres.to(device)
-            )
-
-                output = model(users, movies, genres)
-                newTotalTrainingLoss += calcLoss(output, ratings).item() * users.size(0)
-        
-        # calc RMSE/how well our model memorizes the data set
-        averageTrainingLoss = newTotalTrainingLoss / len(trainingDataset)
-        trainingRMSE = averageTrainingLoss ** 0.5
-
-        """
-        model.eval()
-        totalValidationLoss = 0.0
-        totalValidationLossSquared = 0.0
-        totalValidationLossSquaredLog = 0.0
-        with torch.no_grad():
-            # Put users, movies, and ratings through the network
-            for songs, artists, playcounts, listeners, genres in validationLoader:
-                # Use GPU or CPU
-                songs, artists, playcounts, listeners, genres = (
-                    songs.to(device),
-                    artists.to(device),
-                    playcounts.to(device).float(),
-                    listeners.to(device).float(),
-                    genres.to(device).float(),
-                )
-
-                logRate = model(songs, artists, genres)
-                logMean = logRate + torch.log(listeners)
-                predictions = torch.exp(logMean)
-                totalValidationLoss += poisson(logMean, playcounts).item()
-                totalValidationLossSquared += torch.sum((predictions - playcounts) ** 2).item()
-                totalValidationLossSquaredLog += torch.sum(
-                    (torch.log1p(predictions) - torch.log1p(playcounts)) ** 2
-                ).item()
-                
-    
-                averageValLoss = totalValidationLoss / len(validationDataset)
-                validationRMSLE = (totalValidationLossSquaredLog / len(validationDataset)) ** 0.5
-
-        print(f"Current epoch: {epoch} training RMSLE={totalTrainingLossRMSLE:.4f}, validation RMSLE={validationRMSLE:.4f}")
+        # Train the model, the metrics stay on the device until the epoch is over
+        network.train()
+        trainingMetrics = PlaycountMetrics(device)
+        for batch in trainingLoader:
+            logMean, playcounts = trainStep(network, model, optimizers, poisson, batch, device, args, worldSize)
+            trainingMetrics.update(logMean, playcounts)
+
+        training = trainingMetrics.compute()
+        validation = evaluate(model, validationLoader, device, args.bf16)
+
+        if isMain:
+            print(f"Current epoch: {epoch} training RMSLE={training['rmsle']:.4f}, validation RMSLE={validation['rmsle']:.4f}")
+
+        validationHistory.append(validation["rmsle"])
+        if onEpoch is not None and onEpoch(epoch, validation) is False:
+            break
 
     # Now, we do testing!
-    model.eval()
-    totalTestingLoss = 0.0
-    totalTestingLossSquared = 0.0
-    totalTestingLossSquaredLog = 0.0
-    with torch.no_grad():
-        for songs, artists, playcounts, listeners, genres in testingLoader:
-            # Use GPU or CPU
-            songs, artists, playcounts, listeners, genres = (
-                songs.to(device),
-                artists.to(device),
-                playcounts.to(device).float(),
-                listeners.to(device).float(),
-                genres.to(device).float(),
-            )
-            logRate = model(songs, artists, genres)
-            logMean = logRate + torch.log(listeners)
-            predictions = torch.exp(logMean)
-            totalTestingLoss += poisson(logMean, playcounts).item()
-            totalTestingLossSquared += torch.sum((predictions - playcounts) ** 2).item()
-            totalTestingLossSquaredLog += torch.sum(
-                (torch.log1p(predictions) - torch.log1p(playcounts)) ** 2
-            ).item()
-                
-    
-            averageTestLoss = totalTestingLoss / len(testDataset)
-            testingRMSE = averageTestLoss ** 0.5
-            testingRMSLE = (totalTestingLossSquaredLog / len(testDataset)) ** 0.5
-
-    print(f"testing RMSE = {testingRMSE:.4f}, testing RMSLE = {testingRMSLE:.4f}")
+    testing = evaluate(model, testingLoader, device, args.bf16)
+
+    if isMain:
+        print(f"testing RMSE = {testing['rmse']:.4f}, testing RMSLE = {testing['rmsle']:.4f}")
 
     # Save the model to use!
-    torch.save(model.state_dict(), "models/musicrec.pth")
+    if isMain:
+        args.model_out.parent.mkdir(parents=True, exist_ok=True)
+        torch.save(model.state_dict(), args.model_out)
+        print(f"Finished!")
+
+    if distributed:
+        dist.destroy_process_group()
 
-    print(f"Finished!")
+    return {"validation_rmsle": validationHistory, "testing": testing}
 
 # Windows so yeah
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,257 @@
+### End to end pipeline: preprocess -> train -> export
+###
+### Each stage declares the files it reads, the config it runs with and the stages it depends on. Its cache
+### key is a hash of all of them (file contents, the source of the code it runs, config, and the keys of its
+### upstream stages), and its outputs live in .pipeline_cache/<stage>/<key>/. A stage whose key already has
+### complete outputs is skipped, so e.g. changing only --lr retrains from the cached preprocessing.
+### export is never cached: it copies the trained model and the data the server reads into place.
+###
+### Usage (from backend/):
+###   python pipeline.py                          # everything, reusing whatever is cached
+###   python pipeline.py --epochs 20 --lr 5e-4    # only train + export run again
+###   python pipeline.py --force preprocess       # rerun a stage even if it is cached
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+from musicModel.hashing import FileHasher
+
+BACKEND_DIR = Path(__file__).resolve().parent
+CACHE_DIR = BACKEND_DIR / ".pipeline_cache"
+FILE_HASHES = "file_hashes.json"  # content hashes of input files, by (path, size, mtime)
+DATASET_CACHE = "datasets"  # where training caches the tensors it builds from the csv's (not in the preprocess outputs)
+STAGE_FILE = "stage.json"  # written last into a stage's output directory, marks it complete
+
+# where the server (musicRecommendationService/songRecModel.py) loads things from, relative to backend/
+SERVE_SONGS_DIR = Path("proccsedData") / "songs"
+SERVE_PICKLES_DIR = Path("proccsedData") / "pickles"
+SERVE_MODEL = Path("musicModel") / "models" / "movierec.pth"
+
+PREPROCESS_SCRIPT = "preprocess.py"
+TRAIN_SCRIPT = "musicModel/trainModel.py"
+
+PICKLES = ["song_labels.pkl", "artist_labels.pkl", "genre_labels.pkl"]
+SONG_TABLES = ["genre_by_song", "song_artist_mbid_genre"]  # as <name>.csv and/or <name>/
+SPLITS = ["genre_by_song_splits.npz"]
+MODEL = "musicrec.pth"
+
+# ----- Code of a stage -----
+
+def local_code(script: str) -> list[str]:
+    """
+    script and every module of ours it imports, directly or through other modules (paths relative to
+    backend/). Modules are looked up next to the importing file first, then in backend/, like running
+    the scripts does.
+    """
+    found = set[str]()
+    todo = [BACKEND_DIR / script]
+
+    while todo:
+        path = todo.pop()
+        name = path.relative_to(BACKEND_DIR).as_posix()
+        if name in found:
+            continue
+        found.add(name)
+
+        for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                for root in (path.parent, BACKEND_DIR):
+                    candidate = root.joinpath(*module.split(".")).with_suffix(".py")
+                    if candidate.exists():
+                        todo.append(candidate)
+                        break
+
+    return sorted(found)
+
+# ----- Stages -----
+
+@dataclass
+class Stage:
+    name: str
+    run: Callable[[dict[str, Path], Path], None]  # (output dir of every upstream stage, own output dir)
+    inputs: list[Path] = field(default_factory=list)  # data files read, hashed by content
+    code: list[str] = field(default_factory=list)  # source files (relative to backend/) whose changes invalidate the cache
+    config: dict = field(default_factory=dict)
+    depends: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)  # names that must exist in the output dir
+    cached: bool = True
+
+def stage_key(stage: Stage, hasher: FileHasher, upstream_keys: dict[str, str]) -> str:
+    description = {
+        "stage": stage.name,
+        "inputs": [hasher.hash(path) for path in stage.inputs],  # by content only, moving a file keeps the cache
+        "code": {name: hasher.hash(BACKEND_DIR / name) for name in stage.code},
+        "config": stage.config,
+        "depends": {name: upstream_keys[name] for name in stage.depends},
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def is_complete(stage: Stage, directory: Path) -> bool:
+    return (directory / STAGE_FILE).exists() and all((directory / name).exists() for name in stage.outputs)
+
+def run_pipeline(stages: list[Stage], cache_dir: Path, force: set[str]) -> dict[str, Path]:
+    """
+    Run stages in order (each one's dependencies must come before it), skipping cached ones.
+    Returns every stage's output directory.
+    """
+    hasher = FileHasher(cache_dir / FILE_HASHES)
+    keys, directories = dict[str, str](), dict[str, Path]()
+
+    for stage in stages:
+        keys[stage.name] = stage_key(stage, hasher, keys)
+        directory = cache_dir / stage.name / keys[stage.name]
+        directories[stage.name] = directory
+        upstream = {name: directories[name] for name in stage.depends}
+
+        if stage.cached and stage.name not in force and is_complete(stage, directory):
+            print(f"--> {stage.name}: cached ({keys[stage.name]})")
+            continue
+
+        print(f"--> {stage.name}: running ({keys[stage.name]})...")
+        # build into a scratch directory and move it into place only once the stage succeeded
+        scratch = directory.with_name(directory.name + ".partial")
+        shutil.rmtree(scratch, ignore_errors=True)
+        scratch.mkdir(parents=True)
+        stage.run(upstream, scratch)
+
+        missing = [name for name in stage.outputs if not (scratch / name).exists()]
+        if missing:
+            raise RuntimeError(f"Stage {stage.name} did not produce {missing}")
+
+        with open(scratch / STAGE_FILE, "w", encoding="utf-8") as f:
+            json.dump({"stage": stage.name, "key": keys[stage.name], "config": stage.config}, f, indent=2)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(scratch, directory)
+
+    hasher.save()
+    return directories
+
+# ----- Stage implementations -----
+
+def python(script: str, args: list[str], cwd: Path) -> None:
+    subprocess.run([sys.executable, script] + args, cwd=cwd, check=True)
+
+def preprocess_stage(args: argparse.Namespace) -> Stage:
+    def run(upstream: dict[str, Path], out_dir: Path):
+        command = ["--artists", str(args.artists.resolve()), "--tags", str(args.tags.resolve()), "--out-dir", str(out_dir),
+                   "--format", args.format, "--workers", str(args.workers), "--quiet"]
+        command += ["--pack-genres"] if args.pack_genres else []
+        command += ["--sample", str(args.sample), "--sample-seed", str(args.sample_seed)] if args.sample is not None else []
+        python("preprocess.py", command, BACKEND_DIR)
+
+    # preprocess.py picks up genres.json (see vocabulary.py) from next to itself
+    genres = BACKEND_DIR / "genres.json"
+
+    return Stage(
+        name="preprocess",
+        run=run,
+        inputs=[args.artists, args.tags] + ([genres] if genres.exists() else []),
+        code=local_code(PREPROCESS_SCRIPT),
+        # --workers only changes how fast it runs, not what it writes
+        config={"format": args.format, "pack_genres": args.pack_genres, "sample": args.sample, "sample_seed": args.sample_seed},
+        outputs=PICKLES + SPLITS,
+    )
+
+def train_stage(args: argparse.Namespace) -> Stage:
+    hyperparameters = {"epochs": args.epochs, "lr": args.lr, "weight_decay": args.weight_decay, "batch_size": args.batch_size,
+                       "song_artist_embed": args.song_artist_embed, "genre_embed": args.genre_embed, "hidden": args.hidden}
+
+    def run(upstream: dict[str, Path], out_dir: Path):
+        data = upstream["preprocess"]
+        command = ["--songs-dir", str(data), "--pickles-dir", str(data), "--model-out", str(out_dir / MODEL),
+                   "--cache-dir", str((args.cache_dir / DATASET_CACHE).resolve())]
+        command += [f"--{name.replace('_', '-')}={value}" for name, value in hyperparameters.items()]
+        python("trainModel.py", command, BACKEND_DIR / "musicModel")
+
+    return Stage(name="train", run=run, code=local_code(TRAIN_SCRIPT), config=hyperparameters, depends=["preprocess"], outputs=[MODEL])
+
+def copy_output(source: Path, destination: Path) -> None:
+    if source.is_dir():
+        shutil.rmtree(destination, ignore_errors=True)
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+def remove_output(path: Path) -> None:
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+def export_stage(args: argparse.Namespace) -> Stage:
+    def run(upstream: dict[str, Path], out_dir: Path):
+        data, model = upstream["preprocess"], upstream["train"] / MODEL
+        songs_dir, pickles_dir, served_model = (args.serve_root / path for path in (SERVE_SONGS_DIR, SERVE_PICKLES_DIR, SERVE_MODEL))
+        for directory in (songs_dir, pickles_dir, served_model.parent):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        for name in PICKLES:
+            copy_output(data / name, pickles_dir / name)
+        for name in SONG_TABLES:
+            for source in (data / (name + ".csv"), data / name):
+                if source.exists():
+                    copy_output(source, songs_dir / source.name)
+                else:
+                    # a format an earlier export left behind would be served instead (tables win over csv's)
+                    remove_output(songs_dir / source.name)
+        for name in SPLITS:
+            copy_output(data / name, songs_dir / name)
+
+        # trainModel.py saves musicrec.pth, the server loads movierec.pth
+        copy_output(model, served_model)
+        print(f"  -> exported {model} to {served_model}")
+
+    return Stage(name="export", run=run, depends=["preprocess", "train"], cached=False)
+
+# ----- Main -----
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run preprocess -> train -> export, skipping stages whose outputs are cached.")
+    parser.add_argument("--artists", type=Path, default=BACKEND_DIR.parent / "artist_top_tracks.json")
+    parser.add_argument("--tags", type=Path, default=BACKEND_DIR.parent / "track_tags.json")
+    parser.add_argument("--format", choices=["csv", "npy", "both"], default="csv")
+    parser.add_argument("--pack-genres", action="store_true")
+    parser.add_argument("--workers", type=int, default=1, help="preprocessing processes")
+    parser.add_argument("--sample", type=float, metavar="FRACTION", help="preprocess (and train on) only this fraction of the artists")
+    parser.add_argument("--sample-seed", type=int, default=0)
+
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-5)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--song-artist-embed", type=int, default=32)
+    parser.add_argument("--genre-embed", type=int, default=8)
+    parser.add_argument("--hidden", type=int, default=64)
+
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--force", nargs="+", default=[], choices=["preprocess", "train"], help="rerun these stages even if cached")
+    parser.add_argument("--serve-root", type=Path, default=BACKEND_DIR, help="backend directory the server runs from")
+    parser.add_argument("--no-export", action="store_true", help="stop after training")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+
+    stages = [preprocess_stage(args), train_stage(args)]
+    if not args.no_export:
+        stages.append(export_stage(args))
+
+    directories = run_pipeline(stages, args.cache_dir, set(args.force))
+    print(f"Finished! Model: {directories['train'] / MODEL}")
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,28 @@ import pickle
 from sklearn.preprocessing import LabelEncoder, MultiLabelBinarizer
 from sklearn.model_selection import train_test_split
 import json
+import re
 import xml.etree.ElementTree as ET
-from tqdm import tqdm
-from time import sleep
 from dataclasses import dataclass, field
-from typing import List, Tuple, Set, MutableMapping, Union
+from typing import List, Tuple, Set, MutableMapping, Union, Iterable, Iterator, Callable
 import numpy as np
+import sys
+import os
+import itertools
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import catalog
+from canonical import canonical_genre, canonicalize_genres
+import incremental
+import instrumentation
+from instrumentation import progress, log, timed_stage
+from musicModel.columnar import write_table, read_frame, is_table
+from musicModel.splits import write_splits, hash_fraction
 
 # ----- File Location Constants -----
 FI_ARTISTS = "../artist_top_tracks.json"
 FI_TAGS = "../track_tags.json"
+FI_GENRES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "genres.json")  # vocabulary picked by vocabulary.py, replaces GENRES below when it exists
 FO_COMB_XML = "combined_data.xml"
 FO_GBA = "genre_by_artist"
 FO_GBS = "genre_by_song"
@@ -22,6 +34,8 @@ FO_ARTIST_ENC = "artist_labels.pkl"
 FO_SONG_ENC = "song_labels.pkl"
 FO_GENRE_ENC = "genre_labels.pkl"
 FO_SONG_ARTIST_MBID_GENRE = "song_artist_mbid_genre.csv"
+FO_MANIFEST = "preprocess_manifest.json"
+FO_REPORT = "preprocess_report.json"
 
 # ----- Preprocessing Behavior Constants (Change these to tune results) -----
 GENRES = ["pop", "rock", "rap", "indie", "Hip-Hop", "rnb", "alternative", "trap", "alternative rock", "k-pop",
@@ -33,12 +47,26 @@ GENRES = ["pop", "rock", "rap", "indie", "Hip-Hop", "rnb", "alternative", "trap"
 TOP_N_GENRES = len(GENRES)  # limit number of genres?
 GENRES = GENRES[:TOP_N_GENRES]  # truncate list based on TOP_N_GENRES
 GENRES = sorted(GENRES)  # sort list for later encoding
+if os.path.exists(FI_GENRES):
+    with open(FI_GENRES, "r", encoding="utf-8") as f:
+        GENRES = sorted(json.load(f)["genres"])
 GENRE_THRESHOLD = 15  # what minimum rating (from last.fm) makes a song/artist count as that genre?
 REMOVE_NO_GENRE_SONGS: bool = True
 REMOVE_NO_GENRE_ARTISTS: bool = True
 REMOVE_NA_MBID_ARTISTS: bool = True
 REMOVE_NA_MBID_SONGS: bool = True
 NORMALIZE_ARTIST_GENRE_COUNT: bool = True
+STREAM_INPUT: bool = True  # parse the input jsons artist by artist instead of loading them whole
+STREAM_CHUNK_SIZE = 1 << 20  # characters read from disk at a time while streaming
+WORKER_CHUNK_ARTISTS = 64  # artists handed to a --workers process per task
+OUTPUT_FORMAT = "csv"  # "csv", "npy" (memory-mappable columnar tables, see musicModel/columnar.py) or "both"
+SPLIT_MODE = "index"  # "index": one <table>_splits.npz of row indexes per table, "files": nine split csv's
+PACK_GENRES: bool = False  # columnar tables store genre flags as uint64 bitsets instead of an int8 matrix
+USE_CATALOG: bool = False  # keep the data in the array-backed catalog.Catalog instead of Artist/Song/Genre objects
+CANONICALIZE_GENRES: bool = False  # merge spellings of one genre ("Hip-Hop"/"hip hop", "k-pop"/"Kpop") into one column, see canonical.py
+if CANONICALIZE_GENRES:
+    GENRES = canonicalize_genres(GENRES)
+SAMPLE_POPULARITY_BUCKETS = 4  # --sample strata per genre: quantiles of artist listeners
 NA_VAL = "N/A"
 
 # ----- Dataclasses -----
@@ -75,6 +103,108 @@ def read_json(filename: str) -> dict:
     with open(filename, "r", encoding='utf-8') as f:
         return json.load(f)
 
+def json_span_pattern(depth: int) -> re.Pattern:
+    # a JSON array/object with at most depth levels nested inside it, matched by brackets alone (strings skipped whole, nothing decoded)
+    string = r'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+    inner = rf'(?:[^\[\]{{}}"]++|{string})*+'
+    for _ in range(depth):
+        inner = rf'(?:[^\[\]{{}}"]++|{string}|\[{inner}\]|\{{{inner}\}})*+'
+    return re.compile(rf'\[{inner}\]|\{{{inner}\}}')
+
+# crawl values nest 4 levels deep (tracks -> track -> image list -> image), anything deeper falls back to decoding
+JSON_SPAN = json_span_pattern(4)
+
+def iter_json_items(filename: str, chunk_size: int = STREAM_CHUNK_SIZE, raw: bool = False) -> Iterator[tuple[str, object]]:
+    """
+    Lazily yield the (key, value) pairs of a file holding a single top-level JSON object.
+    Only the entry being decoded (one artist for our inputs) is held in memory at a time.
+    With raw, values are yielded as their JSON text instead (for handing on to another process), found by
+    matching brackets rather than decoding them, which takes about 2/3 of the time.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(filename, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        start = 0  # where the last decoded value began
+        eof = False
+
+        def read_more() -> None:
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            # drop everything already consumed so the buffer stays small
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def next_char() -> str:
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos].isspace():
+                    pos += 1
+                if pos < len(buf):
+                    return buf[pos]
+                if eof:
+                    raise ValueError(f"Unexpected end of file while reading {filename}")
+                read_more()
+
+        def decode():
+            nonlocal pos, start
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    # a number that stops at the end of the buffer (or at "1." / "1e") may continue in the next chunk
+                    number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                    if eof or not number or (end < len(buf) and buf[end] not in "0123456789.eE+-"):
+                        start, pos = pos, end
+                        return value
+                except json.JSONDecodeError:
+                    # value is (probably) cut off by the end of the buffer
+                    if eof:
+                        raise
+                read_more()
+
+        def skip():
+            nonlocal pos, start
+            match = JSON_SPAN.match(buf, pos)
+            if match is None:
+                # cut off by the end of the buffer, nested deeper or not an array/object: let decode() sort it out
+                decode()
+            else:
+                start, pos = pos, match.end()
+
+        if next_char() != "{":
+            raise ValueError(f"{filename} does not hold a JSON object")
+        pos += 1
+
+        if next_char() == "}":
+            return
+
+        while True:
+            key = decode()
+            if next_char() != ":":
+                raise ValueError(f"Expected ':' after key {key!r} in {filename}")
+            pos += 1
+            next_char()
+            if raw:
+                skip()
+                yield key, buf[start:pos]
+            else:
+                yield key, decode()
+
+            sep = next_char()
+            pos += 1
+            if sep == "}":
+                return
+            if sep != ",":
+                raise ValueError(f"Expected ',' or '}}' after value of {key!r} in {filename}")
+            next_char()
+
+def read_pkl(filename: str):
+    with open(filename, "rb") as f:
+        return pickle.load(f)
+
 def write_pkl(data, filename) -> None:
     with open(filename, "wb") as f:
         pickle.dump(data, f)
@@ -85,9 +215,35 @@ def write_csv(data: pd.DataFrame, csv_filename: str, pkl_filename: str = "") ->
     if pkl_filename:
         write_pkl(data, pkl_filename)
 
+def write_output(data: pd.DataFrame, filename: str, output_format: str, pack_genres: bool = PACK_GENRES) -> None:
+    # <name>.csv and/or a <name>/ columnar table, depending on output_format
+    basename = os.path.splitext(filename)[0]
+
+    if output_format in ("csv", "both"):
+        write_csv(data, basename + ".csv")
+
+    if output_format in ("npy", "both"):
+        write_table(data, basename, genre_columns=GENRES, pack_genres=pack_genres)
+
+def output_exists(filename: str) -> bool:
+    basename = os.path.splitext(filename)[0]
+    return os.path.exists(basename + ".csv") or is_table(basename)
+
+def read_output(filename: str) -> pd.DataFrame:
+    # read back whichever format a previous run wrote
+    basename = os.path.splitext(filename)[0]
+    if os.path.exists(basename + ".csv"):
+        return incremental.read_output_csv(basename + ".csv")
+    return read_frame(basename)
+
 # ----- Data Processing -----
 
-def combine_data(artist_tracks_json: dict, track_tags_json: dict) -> dict[str, Artist]:
+def combine_data(artist_tracks_json: Union[dict, Iterable[tuple[str, list]]],
+                 track_tags_json: Union[dict, Iterable[tuple[str, dict]]]) -> dict[str, Artist]:
+    """
+    Accepts either the fully loaded jsons or (artist, value) iterables such as
+    iter_json_items(), in which case neither input is ever held in memory whole.
+    """
     artists = dict[str, Artist]()  # artists keyed by their mbid
 
     def tryGetStr(data: dict, entry: str, default: str):
@@ -95,12 +251,15 @@ def combine_data(artist_tracks_json: dict, track_tags_json: dict) -> dict[str, A
             return data[entry]
         except KeyError:
             return default
+
+    def as_items(data):
+        return data.items() if isinstance(data, dict) else data
         
     # collect a list of artists and their songs
-    print("\n--> Making a list of all artists and songs...")
-    pbar = tqdm(total=len(artist_tracks_json.items()))
+    log("\n--> Making a list of all artists and songs...")
+    pbar = progress(total=len(artist_tracks_json) if isinstance(artist_tracks_json, dict) else None, unit="artist")
 
-    for artist, tracks in artist_tracks_json.items():
+    for artist, tracks in as_items(artist_tracks_json):
         artist = Artist(tryGetStr(tracks[0]["artist"], "mbid", NA_VAL), artist)
 
         for track in tracks:
@@ -131,15 +290,19 @@ def combine_data(artist_tracks_json: dict, track_tags_json: dict) -> dict[str, A
     pbar.close()
 
     # now compile information about genres into songs
-    print("\n--> Collecting information about each song's genre...")
+    log("\n--> Collecting information about each song's genre...")
     total_songs = sum([len(artist.songs) for artist in artists.values()])
-    pbar = tqdm(total=total_songs)
+    pbar = progress(total=total_songs)
+
+    for artist, tracks in as_items(track_tags_json):
+        if artist not in artists:
+            continue
 
-    for artist, tracks in track_tags_json.items():
         for song_name, tags in tracks.items():
             if song_name in artists[artist].songs:
                 for tag in tags:
-                    genre = Genre(name=tag["name"], count=tag["count"])
+                    # tag names repeat across the whole crawl, so share one string per name
+                    genre = Genre(name=sys.intern(tag["name"]), count=tag["count"])
                     artists[artist].songs[song_name].genres[genre.name] = genre
             
             pbar.update(1)
@@ -150,185 +313,128 @@ def combine_data(artist_tracks_json: dict, track_tags_json: dict) -> dict[str, A
 
     return artists
 
-def total_artist_genres(artists: dict[str, Artist]) -> None:
-    # compile information about genres into artists
-    print("\n--> Collecting information about each artist's genres...")
-    pbar = tqdm(total=len(artists))
-
-    for artist in artists.values():
-        for song in artist.songs.values():
-            for genre in song.genres.values():
-                if genre.name in artist.genres:
-                    artist.genres[genre.name].count += genre.count
-                else:
-                    artist.genres[genre.name] = genre
-        
-        pbar.update(1)
-
-    pbar.close()
-
 # ----- Data Preprocessing -----
+# Every cleaning step is a per-artist stage, and the stages run back to back on one artist at a time,
+# in a single traversal of the catalog.
 
-def normalize_artist_genre_counts(artists: dict[str, Artist]) -> None:
-    print("\n--> Normalizing artist genre counts...")
-    pbar = tqdm(total=len(artists))
-
-    for artist in artists.values():
-        # get top genre
-        genre_counts = [genre.count for genre in artist.genres.values()]
-        top_genre_count = max(genre_counts) if len(genre_counts) > 0 else 100
-
-        # normalize genre counts to 0 <= count <= 100
-        for genre in artist.genres.values():
-            genre.count = int((genre.count / top_genre_count) * 100)
-        
-        pbar.update(1)
-    
-    pbar.close()
-
-def remove_no_genre_songs(artists: dict[str, Artist]) -> None:
-    print("\n--> Finding songs with no genres listed...")
-    pbar = tqdm(total=len(artists))
-
-    # collect tuples of (artist_mbid, song_name)
-    songs_to_remove: list[tuple[str, str]] = []
-
-    for artist_mbid, artist in artists.items():
-        for song_name, song in artist.songs.items():
-            if not song.genres:
-                songs_to_remove.append((artist_mbid, song_name))
-        pbar.update(1)
-    pbar.close()
-
-    print(f"\n--> Removing {len(songs_to_remove)} songs with no genres listed...")
-    pbar = tqdm(total=len(songs_to_remove))
-
-    for artist_mbid, song_name in songs_to_remove:
-        artist = artists.get(artist_mbid)
-        if artist is None:
-            pbar.update(1)
-            continue
-        # pop safely
-        artist.songs.pop(song_name, None)
-        pbar.update(1)
-    pbar.close()
-
-def remove_no_genre_artists(artists: dict[str, Artist]) -> None:
-    print("\n--> Finding artists with no genres listed...")
-    pbar = tqdm(total=len(artists))
+@dataclass
+class Stage:
+    name: str
+    apply: Callable[[str, Artist], int]  # (artist key, artist) -> number of items dropped
+    unit: str  # what apply() drops
+    enabled: bool = True
+    drops_artist: bool = False  # apply() returning > 0 removes the whole artist
+    dropped: int = 0
+
+def drop_na_mbid_artist(name: str, artist: Artist) -> int:
+    return int(name == NA_VAL or artist.mbid == NA_VAL)
+
+def drop_na_mbid_songs(name: str, artist: Artist) -> int:
+    to_remove = [key for key, song in artist.songs.items() if song.mbid == NA_VAL or key == NA_VAL]
+    for key in to_remove:
+        artist.songs.pop(key)
+    return len(to_remove)
+
+def merge_genre_spellings(name: str, artist: Artist) -> int:
+    # rename each tag to its canonical genre; spellings that collide keep the first one's place and the highest count
+    merged = 0
+    for song in artist.songs.values():
+        genres = dict[str, Genre]()
+        for genre in song.genres.values():
+            genre.name = canonical_genre(genre.name)
+            if genre.name in genres:
+                genres[genre.name].count = max(genres[genre.name].count, genre.count)
+                merged += 1
+            else:
+                genres[genre.name] = genre
+        song.genres = genres
+    return merged
+
+def drop_unaccepted_tags(name: str, artist: Artist, accepted: frozenset[str] = frozenset()) -> int:
+    dropped = 0
+    for song in artist.songs.values():
+        to_remove = [genre for genre in song.genres if genre not in accepted]
+        for genre in to_remove:
+            song.genres.pop(genre)
+        dropped += len(to_remove)
+    return dropped
+
+def drop_no_genre_songs(name: str, artist: Artist) -> int:
+    to_remove = [key for key, song in artist.songs.items() if not song.genres]
+    for key in to_remove:
+        artist.songs.pop(key)
+    return len(to_remove)
+
+def total_genres(name: str, artist: Artist) -> int:
+    # the first song's Genre objects become the artist's (so their counts follow the artist total from here on)
+    for song in artist.songs.values():
+        for genre in song.genres.values():
+            if genre.name in artist.genres:
+                artist.genres[genre.name].count += genre.count
+            else:
+                artist.genres[genre.name] = genre
+    return 0
+
+def drop_no_genre_artist(name: str, artist: Artist) -> int:
+    return int(len(artist.genres) == 0)
+
+def normalize_genre_counts(name: str, artist: Artist) -> int:
+    genre_counts = [genre.count for genre in artist.genres.values()]
+    top_genre_count = max(genre_counts) if len(genre_counts) > 0 else 100
+
+    # normalize genre counts to 0 <= count <= 100
+    for genre in artist.genres.values():
+        genre.count = int((genre.count / top_genre_count) * 100)
+    return 0
+
+def cleaning_stages() -> list[Stage]:
+    # the cleaning steps in order, toggled by the REMOVE_*/NORMALIZE_* flags
+    accepted = frozenset(GENRES)
+
+    return [
+        Stage("remove_na_mbid_artists", drop_na_mbid_artist, "artists", REMOVE_NA_MBID_ARTISTS, drops_artist=True),
+        Stage("remove_na_mbid_songs", drop_na_mbid_songs, "songs", REMOVE_NA_MBID_SONGS),
+        Stage("canonicalize_genres", merge_genre_spellings, "tags", CANONICALIZE_GENRES),
+        Stage("remove_unaccepted_tags", lambda name, artist: drop_unaccepted_tags(name, artist, accepted), "tags"),
+        Stage("remove_no_genre_songs", drop_no_genre_songs, "songs", REMOVE_NO_GENRE_SONGS),
+        Stage("total_artist_genres", total_genres, ""),
+        Stage("remove_no_genre_artists", drop_no_genre_artist, "artists", REMOVE_NO_GENRE_ARTISTS, drops_artist=True),
+        Stage("normalize_artist_genre_counts", normalize_genre_counts, "", NORMALIZE_ARTIST_GENRE_COUNT),
+    ]
+
+def run_stages(artists: dict[str, Artist], stages: list[Stage]) -> list[Stage]:
+    active = [stage for stage in stages if stage.enabled]
+
+    log(f"\n--> Cleaning artists ({', '.join(stage.name for stage in active)})...")
+    pbar = progress(total=len(artists))
 
     artists_to_remove = list[str]()
+    for name, artist in artists.items():
+        for stage in active:
+            dropped = stage.apply(name, artist)
+            stage.dropped += dropped
 
-    for artist in artists.values():
-        if len(artist.genres) == 0:
-            artists_to_remove.append(artist.name)
-        
-        pbar.update(1)
-    
-    pbar.close()
-
-    print("\n--> Removing artists with no genres listed...")
-    pbar = tqdm(total=len(artists_to_remove))
+            if stage.drops_artist and dropped:
+                artists_to_remove.append(name)
+                break
 
-    for artist in artists_to_remove:
-        artists.pop(artist)
         pbar.update(1)
-    
     pbar.close()
 
-def remove_na_mbid_artists(artists: dict[str, Artist]) -> None:
-    print("\n--> Finding artists with NA mbid...")
-    pbar = tqdm(total=len(artists), desc="Scanning artists", unit="artist")
+    for name in artists_to_remove:
+        artists.pop(name)
 
-    to_remove: list[str] = []
-    for mbid, artist in list(artists.items()):
-        if mbid == NA_VAL or (hasattr(artist, "mbid") and artist.mbid == NA_VAL):
-            to_remove.append(mbid)
-        pbar.update(1)
-    pbar.close()
+    return stages
 
-    if not to_remove:
-        print("  -> No NA-mbid artists found.")
-        return
-
-    print(f"\n--> Removing {len(to_remove)} artists with NA mbid...")
-    pbar = tqdm(total=len(to_remove), desc="Removing artists", unit="artist")
-    for mbid in to_remove:
-        artists.pop(mbid, None)
-        pbar.update(1)
-    pbar.close()
-
-def remove_na_mbid_songs(artists: dict[str, Artist], songs: dict[str, Song] | None = None) -> None:
-    print("\n--> Finding songs with NA mbid...")
-    # Count artists as progress target (we scan each artist)
-    pbar = tqdm(total=len(artists), desc="Scanning artists", unit="artist")
-
-    removals: dict[str, list[str]] = {}  # artist_mbid -> list of song keys to remove
-
-    for artist_mbid, artist in artists.items():
-        # collect song keys to remove for this artist
-        to_remove_keys: list[str] = []
-        for key, song in list(artist.songs.items()):
-            # check song.mbid (and also key as fallback) against NA_VAL
-            if (hasattr(song, "mbid") and song.mbid == NA_VAL) or key == NA_VAL:
-                to_remove_keys.append(key)
-        if to_remove_keys:
-            removals[artist_mbid] = to_remove_keys
-        pbar.update(1)
-    pbar.close()
-
-    total_removals = sum(len(v) for v in removals.values())
-    if total_removals == 0:
-        print("  -> No NA-mbid songs found.")
-        return
-
-    print(f"\n--> Removing {total_removals} songs with NA mbid...")
-    pbar = tqdm(total=total_removals, desc="Removing songs", unit="song")
-
-    for artist_mbid, keys in removals.items():
-        artist = artists.get(artist_mbid)
-        if artist is None:
-            # artist may have been removed earlier; skip safely
-            for _ in keys:
-                pbar.update(1)
-            continue
-
-        for key in keys:
-            # remove from artist.songs
-            artist.songs.pop(key, None)
-            # also remove from global songs dict if provided and if key or song.mbid present
-            if songs is not None:
-                # try by key first (common case if artist.songs keyed by song.mbid)
-                songs.pop(key, None)
-                # also attempt to remove by song.mbid if we have it
-                # (we need to guard attribute access in case song object was popped)
-                # We can attempt to remove by previously-stored song object if needed,
-                # but safe approach is to ignore missing entries.
-            pbar.update(1)
-
-    pbar.close()
+def report_stages(stages: list[Stage]) -> None:
+    for stage in stages:
+        if not stage.enabled:
+            log(f"  -> {stage.name}: disabled")
+        elif stage.unit:
+            log(f"  -> {stage.name}: dropped {stage.dropped} {stage.unit}")
 
 # ----- Binarization, Encoding, and Preparation for CSV'ing -----
 
-def remove_unaccepted_tags(artists: dict[str, Artist]) -> None:
-    print("\n--> Removing unaccepted tags from artists & their songs...")
-    pbar = tqdm(total=len(artists))
-
-    for artist in artists.values():
-        for song in artist.songs.values():
-            genres_to_remove = list[str]()
-
-            for genre in song.genres.values():
-                if genre.name not in GENRES:
-                    genres_to_remove.append(genre.name)
-            
-            for genre in genres_to_remove:
-                song.genres.pop(genre)
-        
-        pbar.update(1)
-    
-    pbar.close()
-
 def encode_lexicographically(input_list: list[str]) -> LabelEncoder:
     encoder = LabelEncoder()
 
@@ -336,85 +442,85 @@ def encode_lexicographically(input_list: list[str]) -> LabelEncoder:
 
     return encoder
 
-def create_genre_by_artist_df(artists: dict[str, Artist], artist_enc: LabelEncoder) -> pd.DataFrame:
-    artist_data = []  # rows of artist data
-
-    for artist in artists.values():
-        # ensure genre count exists for each genre
-        for genre in GENRES:
-            if genre not in artist.genres.keys():
-                artist.genres[genre] = Genre(genre, 0)
-
-        # make flags (0 or 1) for genres, with columns in sorted order by genre name
-        genre_flags = {genre: int(artist.genres[genre].count > GENRE_THRESHOLD) for genre in GENRES}
+def encode_ids(encoder: LabelEncoder, values) -> np.ndarray:
+    """
+    Look up the encoded id of every value in one hashed pass over encoder.classes_.
+    Values the encoder has never seen get -1.
+    """
+    return pd.Index(encoder.classes_).get_indexer(values)
 
-        # make row with known values
-        row = {
-            "artist_mbid": artist.mbid,
-            "total_playcount": artist.total_playcount,
-            "total_listeners": artist.total_listeners,
-        }
+def genre_flag_matrix(genre_dicts: list[dict[str, Genre]]) -> np.ndarray:
+    """
+    Multi-hot (rows x GENRES) matrix: 1 where a row's genre count is above GENRE_THRESHOLD.
+    Columns follow the (sorted) order of GENRES.
+    """
+    genre_cols = {genre: i for i, genre in enumerate(GENRES)}
+    rows = list[int]()
+    cols = list[int]()
+
+    for row, genres in enumerate(genre_dicts):
+        for name, genre in genres.items():
+            col = genre_cols.get(name)
+            if col is not None and genre.count > GENRE_THRESHOLD:
+                rows.append(row)
+                cols.append(col)
+
+    flags = np.zeros((len(genre_dicts), len(GENRES)), dtype=np.int64)
+    flags[rows, cols] = 1
+    return flags
+
+def make_genre_df(leading_cols: dict, genre_flags: np.ndarray, trailing_cols: dict, sort_by: str) -> pd.DataFrame:
+    # columns: [leading columns] | [one column per genre] | [trailing columns]
+    data = dict(leading_cols)
+    data.update({genre: genre_flags[:, i] for i, genre in enumerate(GENRES)})
+    data.update(trailing_cols)
+
+    df = pd.DataFrame(data)
+    df.sort_values(by=sort_by, inplace=True)
+    return df
 
-        # add many columns of genres
-        row.update(genre_flags)
+def create_genre_by_artist_df(artists: dict[str, Artist], artist_enc: LabelEncoder) -> pd.DataFrame:
+    artist_list = list(artists.values())
+    mbids = [artist.mbid for artist in artist_list]
 
-        # add artist enc id at end
-        row.update({"artist_enc_id": int(np.where(artist_enc.classes_ == artist.mbid)[0][0])})
-        artist_data.append(row)
+    # make flags (0 or 1) for genres, with columns in sorted order by genre name
+    genre_flags = genre_flag_matrix([artist.genres for artist in artist_list])
 
-    # convert to pandas dataframe, sort by mbid, and return it  
-    df_artists = pd.DataFrame(artist_data)
-    df_artists.sort_values(by="artist_mbid", inplace=True)
-    return df_artists
+    # convert to pandas dataframe, sort by mbid, and return it
+    return make_genre_df(
+        {
+            "artist_mbid": mbids,
+            "total_playcount": np.array([artist.total_playcount for artist in artist_list], dtype=np.int64),
+            "total_listeners": np.array([artist.total_listeners for artist in artist_list], dtype=np.int64),
+        },
+        genre_flags,
+        {"artist_enc_id": encode_ids(artist_enc, mbids)},
+        sort_by="artist_mbid",
+    )
 
 def create_genre_by_song_df(artists: dict[str, Artist], artist_enc: LabelEncoder, song_enc: LabelEncoder) -> pd.DataFrame:
-    song_data = []
-
-    for artist in artists.values():
-        for song in artist.songs.values():
-            # ensure each genre from global GENRES exists in song.genres
-            for genre in GENRES:
-                if genre not in song.genres:
-                    song.genres[genre] = Genre(genre, 0)
-
-            # binary flags: 1 if genre count > threshold, else 0
-            genre_flags = {genre: int(song.genres[genre].count > GENRE_THRESHOLD)
-                           for genre in GENRES}
-
-            # base row
-            row = {
-                "song_mbid": song.mbid,
-                "artist_mbid": song.artist_mbid,
-                "playcount": int(song.playcount or 0),
-                "listeners": int(song.listeners or 0),
-            }
-
-            row.update(genre_flags)
-
-            # encoded ids (find index in encoder.classes_)
-            # using np.where to match your artist function style
-            # fallback to -1 if not found (shouldn't happen if encoders built consistently)
-            try:
-                song_idx = int(np.where(song_enc.classes_ == song.mbid)[0][0])
-            except Exception:
-                song_idx = -1
-
-            try:
-                artist_idx = int(np.where(artist_enc.classes_ == song.artist_mbid)[0][0])
-            except Exception:
-                artist_idx = -1
-
-            row.update({
-                "song_enc_id": song_idx,
-                "artist_enc_id": artist_idx,
-            })
-
-            song_data.append(row)
-
-    # convert to pandas dataframe, sort by mbid, and return it
-    df_songs = pd.DataFrame(song_data)
-    df_songs.sort_values(by="song_mbid", inplace=True)
-    return df_songs
+    song_list = [song for artist in artists.values() for song in artist.songs.values()]
+    song_mbids = [song.mbid for song in song_list]
+    artist_mbids = [song.artist_mbid for song in song_list]
+
+    # binary flags: 1 if genre count > threshold, else 0
+    genre_flags = genre_flag_matrix([song.genres for song in song_list])
+
+    # encoded ids fall back to -1 if not found (shouldn't happen if encoders built consistently)
+    return make_genre_df(
+        {
+            "song_mbid": song_mbids,
+            "artist_mbid": artist_mbids,
+            "playcount": np.array([int(song.playcount or 0) for song in song_list], dtype=np.int64),
+            "listeners": np.array([int(song.listeners or 0) for song in song_list], dtype=np.int64),
+        },
+        genre_flags,
+        {
+            "song_enc_id": encode_ids(song_enc, song_mbids),
+            "artist_enc_id": encode_ids(artist_enc, artist_mbids),
+        },
+        sort_by="song_mbid",
+    )
 
 # ----- Splitting data -----
 
@@ -451,111 +557,573 @@ def split_df_without_genres(df: pd.DataFrame,
     return split_train_val_test(df_no_genres, test_size=test_size, val_size=val_size,
                                 random_state=random_state)
 
-def make_artist_song_mbid_genres(artists: dict[str, Artist], songs_df: pd.DataFrame, song_enc: LabelEncoder, artist_enc: LabelEncoder) -> pd.DataFrame:
-    song_data = []
+def name_lookups(artists: dict[str, Artist]) -> tuple[dict[str, str], dict[tuple[str, str], str]]:
+    # build mbid -> name lookups once (first match wins, same as a front-to-back scan)
+    artist_names = dict[str, str]()
+    song_names = dict[tuple[str, str], str]()  # (artist_name, song_mbid) -> song_name
 
-    for row in songs_df.values:
-        artist_name = [name for name in artists if artists[name].mbid == row[1]]
-        song_name = []
-        
-        if len(artist_name) > 0:
-            artist_name = artist_name[0]
-            song_name = [song.name for song in artists[artist_name].songs.values() if song.mbid == row[0]]
-            if len(song_name) > 0:
-                song_name = song_name[0]
-            else:
-                song_name = NA_VAL
-        else:
-            artist_name = NA_VAL
-        
-        # genres
-        genre_values = []
-        for i in range(len(row)-2-len(GENRES), len(row)-2):
-            genre_values.append(row[i])
+    for artist_name, artist in artists.items():
+        artist_names.setdefault(artist.mbid, artist_name)
+    
+    for artist_name in artist_names.values():
+        for song in artists[artist_name].songs.values():
+            song_names.setdefault((artist_name, song.mbid), song.name)
+
+    return artist_names, song_names
+
+def songs_with_names(songs_df: pd.DataFrame, artist_names: dict[str, str], song_names: dict[tuple[str, str], str]) -> pd.DataFrame:
+    song_mbids = songs_df["song_mbid"].tolist()
+    row_artist_names = [artist_names.get(mbid, NA_VAL) for mbid in songs_df["artist_mbid"].tolist()]
+    row_song_names = [song_names.get((artist_name, song_mbid), NA_VAL)
+                      for artist_name, song_mbid in zip(row_artist_names, song_mbids)]
+
+    df_songs = pd.DataFrame({
+        "song_mbid": song_mbids,
+        "artist_mbid": songs_df["artist_mbid"].tolist(),
+        "song_name": row_song_names,
+        "artist_name": row_artist_names,
+    })
+
+    # genres
+    genre_values = songs_df[GENRES].reset_index(drop=True)
+    df_songs = pd.concat([df_songs, genre_values], axis=1)
+
+    # sort by mbid and return it
+    df_songs.sort_values(by="song_mbid", inplace=True)
+    return df_songs
 
-        genre_value_keys = {GENRES[i]: genre_values[i] for i in range(0, len(genre_values))}
+def make_artist_song_mbid_genres(artists: dict[str, Artist], songs_df: pd.DataFrame, song_enc: LabelEncoder, artist_enc: LabelEncoder) -> pd.DataFrame:
+    return songs_with_names(songs_df, *name_lookups(artists))
+
+# ----- Compact catalog path -----
+
+def catalog_tag_filter() -> Callable[[str], bool]:
+    # the remove_unaccepted_tags stage drops every other tag anyway, so build_catalog() doesn't need to store them
+    accepted = frozenset(GENRES)
+    if CANONICALIZE_GENRES:
+        return lambda name: canonical_genre(name) in accepted
+    return accepted.__contains__
+
+def clean_catalog(store: catalog.Catalog) -> None:
+    # same steps and order as the Artist/Song path in main()
+    if REMOVE_NA_MBID_ARTISTS: catalog.remove_na_mbid_artists(store, NA_VAL)
+    if REMOVE_NA_MBID_SONGS: catalog.remove_na_mbid_songs(store, NA_VAL)
+    if CANONICALIZE_GENRES: catalog.canonicalize_tags(store, canonical_genre)
+    catalog.remove_unaccepted_tags(store, GENRES)
+    if REMOVE_NO_GENRE_SONGS: catalog.remove_no_genre_songs(store)
+    catalog.total_artist_genres(store)
+    if REMOVE_NO_GENRE_ARTISTS: catalog.remove_no_genre_artists(store)
+    if NORMALIZE_ARTIST_GENRE_COUNT: catalog.normalize_artist_genre_counts(store)
+
+def create_genre_by_artist_df_from_catalog(store: catalog.Catalog, artist_enc: LabelEncoder) -> pd.DataFrame:
+    artists = catalog.kept_artists(store)
+    mbids = store.artist_mbid.lookup(artists)
+
+    return make_genre_df(
+        {
+            "artist_mbid": mbids,
+            "total_playcount": store.artist_playcount[artists],
+            "total_listeners": store.artist_listeners[artists],
+        },
+        catalog.artist_genre_flags(store, artists, GENRES, GENRE_THRESHOLD),
+        {"artist_enc_id": encode_ids(artist_enc, mbids)},
+        sort_by="artist_mbid",
+    )
+
+def create_genre_by_song_df_from_catalog(store: catalog.Catalog, artist_enc: LabelEncoder, song_enc: LabelEncoder) -> pd.DataFrame:
+    songs = catalog.kept_songs(store)
+    song_mbids = store.song_mbid.lookup(songs)
+    artist_mbids = store.artist_mbid.lookup(store.song_artist[songs])
+
+    return make_genre_df(
+        {
+            "song_mbid": song_mbids,
+            "artist_mbid": artist_mbids,
+            "playcount": store.song_playcount[songs],
+            "listeners": store.song_listeners[songs],
+        },
+        catalog.song_genre_flags(store, songs, GENRES, GENRE_THRESHOLD),
+        {
+            "song_enc_id": encode_ids(song_enc, song_mbids),
+            "artist_enc_id": encode_ids(artist_enc, artist_mbids),
+        },
+        sort_by="song_mbid",
+    )
+
+# ----- Sampling -----
+
+def artist_strata(artists_filename: str, tags_filename: str) -> dict[str, tuple[str, int]]:
+    """
+    (top genre, popularity bucket) of every artist, streaming both inputs. The top genre is the accepted
+    genre with the highest tag count summed over the artist's songs ("" if none), the bucket is the
+    artist's quantile of total listeners out of SAMPLE_POPULARITY_BUCKETS.
+    """
+    accepted = frozenset(GENRES)
 
-        row_data = {
-            "song_mbid": row[0],
-            "artist_mbid": row[1],
-            "song_name": song_name,
-            "artist_name": artist_name
-        }
+    listeners = dict[str, int]()
+    for name, tracks in iter_json_items(artists_filename):
+        listeners[name] = sum(int(track.get("listeners", "0")) for track in tracks)
 
-        row_data.update(genre_value_keys)
+    top_genre = dict[str, str]()
+    for name, tracks in iter_json_items(tags_filename):
+        if name not in listeners:
+            continue
+        totals = dict[str, int]()
+        for tags in tracks.values():
+            for tag in tags:
+                genre = canonical_genre(tag["name"]) if CANONICALIZE_GENRES else tag["name"]
+                if genre in accepted:
+                    totals[genre] = totals.get(genre, 0) + tag["count"]
+        if totals:
+            top_genre[name] = min(totals, key=lambda genre: (-totals[genre], genre))
+
+    by_popularity = sorted(listeners, key=lambda name: (listeners[name], name))
+    return {name: (top_genre.get(name, ""), rank * SAMPLE_POPULARITY_BUCKETS // len(by_popularity))
+            for rank, name in enumerate(by_popularity)}
+
+def sample_artists(strata: dict[str, tuple[str, int]], fraction: float, seed: int = 0) -> set[str]:
+    """
+    Names of round(fraction * artists) of the artists in strata (see artist_strata()), allocated to each (genre, popularity) stratum in proportion
+    to its size (largest remainder), and picked within it by a seeded hash of the name. The same inputs,
+    fraction and seed always give the same sample, whatever order the artists come in.
+    """
+    members_of = dict[tuple[str, int], list[str]]()
+    for name, stratum in strata.items():
+        members_of.setdefault(stratum, []).append(name)
 
-        song_data.append(row_data)
+    quotas = {stratum: fraction * len(members) for stratum, members in members_of.items()}
+    counts = {stratum: int(quota) for stratum, quota in quotas.items()}
+    remaining = round(fraction * len(strata)) - sum(counts.values())
+    for stratum in sorted(quotas, key=lambda stratum: (counts[stratum] - quotas[stratum], stratum))[:remaining]:
+        counts[stratum] += 1
 
+    sample = set[str]()
+    for stratum, members in members_of.items():
+        members.sort(key=lambda name: (hash_fraction(f"{seed}:{name}"), name))
+        sample.update(members[:counts[stratum]])
 
-    # convert to pandas dataframe, sort by mbid, and return it
-    df_songs = pd.DataFrame(song_data)
-    df_songs.sort_values(by="song_mbid", inplace=True)
-    return df_songs
+    log(f"\n--> Sampled {len(sample)} of {len(strata)} artists across {len(members_of)} genre/popularity strata")
+    return sample
 
-# ----- Main -----
+# ----- Parallel preprocessing -----
+
+def only_artists(items: Iterable[tuple[str, object]], only: set[str] | None) -> Iterable[tuple[str, object]]:
+    return items if only is None else ((name, value) for name, value in items if name in only)
 
-def main():
-    print("----- Starting Preprocessing... -----")
+def load_artists(artists_filename: str, tags_filename: str, only: set[str] | None = None) -> dict[str, Artist]:
+    # only: restrict to these artist names (None = every artist)
+    if STREAM_INPUT:
+        # parse the jsons one artist at a time while building the artist/song records
+        return combine_data(only_artists(iter_json_items(artists_filename), only),
+                            only_artists(iter_json_items(tags_filename), only))
 
     # read jsons for artist songs and song tags
-    artist_tracks_json: dict = read_json(FI_ARTISTS)
-    track_tags_json: dict = read_json(FI_TAGS)
+    artist_tracks_json: dict = read_json(artists_filename)
+    track_tags_json: dict = read_json(tags_filename)
 
     # Combine data into two lists
-    artists = combine_data(artist_tracks_json, track_tags_json)
-
-    # Preprocess the data (semi specific order)
-    if REMOVE_NA_MBID_ARTISTS: remove_na_mbid_artists(artists)
-    if REMOVE_NA_MBID_SONGS: remove_na_mbid_songs(artists)
-    remove_unaccepted_tags(artists)
-    if REMOVE_NO_GENRE_SONGS: remove_no_genre_songs(artists)
-    total_artist_genres(artists)
-    if REMOVE_NO_GENRE_ARTISTS: remove_no_genre_artists(artists)
-    if NORMALIZE_ARTIST_GENRE_COUNT: normalize_artist_genre_counts(artists)
-
-    # label encode artists by their mbid (lexicographically by mbid (uuid) string)
-    artist_enc = encode_lexicographically([artist.mbid for artist in artists.values()])
-    song_enc = encode_lexicographically([song.mbid for artist in artists.values() for song in artist.songs.values()])
-    genre_enc = encode_lexicographically(GENRES)
+    return combine_data(only_artists(artist_tracks_json.items(), only), only_artists(track_tags_json.items(), only))
 
-    # create a genre-by-artist dataframe
-    artist_df = create_genre_by_artist_df(artists, artist_enc)
+def clean_artists(artists: dict[str, Artist]) -> list[Stage]:
+    # Preprocess the data (semi specific order), all steps in one pass per artist
+    return run_stages(artists, cleaning_stages())
+
+def silence_worker_output() -> None:
+    # per-worker progress bars would just interleave with each other, so skip them (and their overhead) entirely
+    instrumentation.set_quiet(True)
+    devnull = open(os.devnull, "w")
+    sys.stdout = devnull
+    sys.stderr = devnull
+
+def artist_entries(artists_filename: str, tags_filename: str, only: set[str] | None,
+                   repeated: set[str]) -> Iterator[tuple[int, str, str, list[str]]]:
+    """
+    Read both inputs once, side by side, and yield (position of the artist's entry in the tracks file,
+    name, tracks json text, [tags json texts]) as soon as an artist's tracks and tags have both been read.
+    The crawler writes both files in the same artist order, so hardly anything waits for its other half.
+    Artists without tags go out once the tags file is done. Names whose entries show up again after they
+    went out (repeated keys) are added to repeated: the caller has to redo those artists.
+    """
+    tracks_items = enumerate(iter_json_items(artists_filename, raw=True))
+    tags_items = iter_json_items(tags_filename, raw=True)
+    waiting_tracks = dict[str, tuple[int, str]]()  # name -> (position, tracks) still missing tags
+    waiting_tags = dict[str, list[str]]()  # name -> tags entries still missing tracks
+    sent = set[str]()
+    tracks_done = tags_done = False
+
+    while not (tracks_done and tags_done):
+        if not tracks_done:
+            item = next(tracks_items, None)
+            if item is None:
+                tracks_done = True
+                # tags of artists that never got tracks are dropped by combine_data() too
+                waiting_tags = {name: tags for name, tags in waiting_tags.items() if name in waiting_tracks}
+            else:
+                position, (name, tracks) = item
+                if only is not None and name not in only:
+                    pass
+                elif name in sent:
+                    repeated.add(name)
+                elif name in waiting_tags or tags_done:
+                    # a repeated key replaces the tracks but keeps the first position, like combine_data()
+                    position = waiting_tracks.pop(name, (position, None))[0]
+                    sent.add(name)
+                    yield position, name, tracks, waiting_tags.pop(name, [])
+                else:
+                    waiting_tracks[name] = (waiting_tracks.get(name, (position, None))[0], tracks)
+
+        if not tags_done:
+            item = next(tags_items, None)
+            if item is None:
+                tags_done = True
+                for name, (position, tracks) in waiting_tracks.items():
+                    sent.add(name)
+                    yield position, name, tracks, waiting_tags.pop(name, [])
+                waiting_tracks.clear()
+            else:
+                name, tags = item
+                if only is not None and name not in only:
+                    pass
+                elif name in sent:
+                    repeated.add(name)
+                elif name in waiting_tracks:
+                    position, tracks = waiting_tracks.pop(name)
+                    sent.add(name)
+                    yield position, name, tracks, waiting_tags.pop(name, []) + [tags]
+                elif not tracks_done:
+                    waiting_tags.setdefault(name, []).append(tags)
+
+def pack_artist(artist: Artist) -> tuple:
+    # a cleaned Artist as plain tuples, which pickle far faster than the dataclasses
+    return (artist.mbid, artist.name, artist.total_playcount, artist.total_listeners,
+            [(genre.name, genre.count) for genre in artist.genres.values()],
+            [(key, song.mbid, song.name, song.playcount, song.listeners, [(genre.name, genre.count) for genre in song.genres.values()])
+             for key, song in artist.songs.items()])
+
+def unpack_artist(packed: tuple) -> Artist:
+    mbid, name, total_playcount, total_listeners, genres, songs = packed
+    return Artist(mbid, name, total_playcount, total_listeners,
+                  genres={genre: Genre(genre, count) for genre, count in genres},
+                  songs={key: Song(song_mbid, song_name, mbid, name, playcount, listeners, {genre: Genre(genre, count) for genre, count in song_genres})
+                         for key, song_mbid, song_name, playcount, listeners, song_genres in songs})
+
+def process_artists(entries: list[tuple[int, str, str, list[str]]]) -> tuple[list[tuple[int, str, tuple]], dict[str, int]]:
+    """
+    Run the per-artist part of the pipeline (combine_data + cleaning) on a chunk of artist_entries().
+    Returns (position, name, packed artist) for every artist kept, and how many items each cleaning stage dropped.
+    """
+    positions = {name: position for position, name, _, _ in entries}
+    artists = combine_data([(name, json.loads(tracks)) for _, name, tracks, _ in entries],
+                           [(name, json.loads(tags)) for _, name, _, all_tags in entries for tags in all_tags])
+    stages = clean_artists(artists)
+
+    return ([(positions[name], name, pack_artist(artist)) for name, artist in artists.items()],
+            {stage.name: stage.dropped for stage in stages})
 
-    # create a genre-by-artist dataframe
+def combine_and_clean_parallel(artists_filename: str, tags_filename: str, workers: int,
+                               only: set[str] | None = None) -> tuple[dict[str, Artist], list[Stage]]:
+    """
+    Stream both inputs once in this process and hand each artist's raw entries to a process pool in chunks.
+    Every cleaning step only looks at one artist at a time, so putting the chunks back in input order gives
+    exactly the dict a single process would build. At most 2 chunks per worker are in flight, so memory stays
+    bounded like the streaming single-process path.
+    """
+    log(f"\n--> Combining and cleaning artists in {workers} processes...")
+
+    repeated = set[str]()
+    chunks = list[list[tuple[int, str]]]()  # (position, name) of every artist sent, per chunk
+    results = dict[int, tuple[list[tuple[int, str, tuple]], dict[str, int]]]()
+    entries = artist_entries(artists_filename, tags_filename, only, repeated)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=silence_worker_output) as pool:
+        running = dict()  # future -> chunk index
+        while chunk := list(itertools.islice(entries, WORKER_CHUNK_ARTISTS)):
+            running[pool.submit(process_artists, chunk)] = len(chunks)
+            chunks.append([(position, name) for position, name, _, _ in chunk])
+
+            if len(running) >= 2 * workers:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        for future, index in running.items():
+            results[index] = future.result()
+
+    # a chunk holding an artist whose key came up again after it was sent is redone from scratch in this process
+    redo = {index for index, names in enumerate(chunks) if not repeated.isdisjoint(name for _, name in names)}
+    artists = {name: unpack_artist(packed) for index, (kept, _) in results.items() if index not in redo for _, name, packed in kept}
+
+    # add up every chunk's stage counters
+    stages = cleaning_stages()
+    for stage in stages:
+        stage.dropped = sum(dropped[stage.name] for index, (_, dropped) in results.items() if index not in redo)
+
+    if redo:
+        redo_names = {name for index in redo for _, name in chunks[index]}
+        redone = load_artists(artists_filename, tags_filename, redo_names)
+        for stage, redo_stage in zip(stages, clean_artists(redone)):
+            stage.dropped += redo_stage.dropped
+        artists.update(redone)
+
+    # back in input order
+    order = {name: position for names in chunks for position, name in names}
+    artists = dict(sorted(artists.items(), key=lambda item: order[item[0]]))
+
+    report_stages(stages)
+    return artists, stages
+
+def build_clean_artists(artists_filename: str, tags_filename: str, workers: int,
+                        only: set[str] | None = None) -> tuple[dict[str, Artist], list[Stage]]:
+    # returns the kept artists and the cleaning stages with their counters
+    if workers > 1:
+        return combine_and_clean_parallel(artists_filename, tags_filename, workers, only)
+
+    artists = load_artists(artists_filename, tags_filename, only)
+    stages = clean_artists(artists)
+    report_stages(stages)
+    return artists, stages
+
+def record_cleaning(report: instrumentation.StageReport, artists: dict[str, Artist], stages: list[Stage]) -> None:
+    # artists in = artists kept + every artist a stage dropped
+    report.items_out = len(artists)
+    report.items_in = report.items_out + sum(stage.dropped for stage in stages if stage.drops_artist)
+    report.details["dropped"] = {stage.name: {"count": stage.dropped, "unit": stage.unit}
+                                 for stage in stages if stage.enabled and stage.unit}
+
+# ----- Incremental preprocessing -----
+
+def config_hash() -> str:
+    # any change here changes every artist's output, so the manifest is thrown away
+    return incremental.hash_value({
+        "genres": GENRES,
+        "genre_threshold": GENRE_THRESHOLD,
+        "flags": [REMOVE_NO_GENRE_SONGS, REMOVE_NO_GENRE_ARTISTS, REMOVE_NA_MBID_ARTISTS, REMOVE_NA_MBID_SONGS,
+                  NORMALIZE_ARTIST_GENRE_COUNT, CANONICALIZE_GENRES],
+        "na_val": NA_VAL,
+    })
+
+def frames_from_artists(artists: dict[str, Artist], artist_enc: LabelEncoder, song_enc: LabelEncoder
+                        ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    # genre-by-artist, genre-by-song, and song/artist names + genres
+    artist_df = create_genre_by_artist_df(artists, artist_enc)
     song_df = create_genre_by_song_df(artists, artist_enc, song_enc)
+    return artist_df, song_df, songs_with_names(song_df, *name_lookups(artists))
+
+def build_incremental(workers: int, artists_filename: str = FI_ARTISTS, tags_filename: str = FI_TAGS, out_dir: str = "."):
+    """
+    Recompute only artists whose tracks or tags changed since the manifest was written and patch
+    their rows into the previous genre_by_artist / genre_by_song / song_artist_mbid_genre csv's.
+    Falls back to a full build when there is no usable manifest or previous output.
+    Returns (artist_enc, song_enc, artist_df, song_df, artist_song_mbid_genres_df, manifest entries).
+    """
+    log("\n--> Hashing every artist's tracks and tags...")
+    tracks_hashes = incremental.hash_entries(iter_json_items(artists_filename))
+    tags_hashes = incremental.hash_entries(iter_json_items(tags_filename))
+
+    # previous outputs are read from out_dir
+    gba, gbs = os.path.join(out_dir, FO_GBA + ".csv"), os.path.join(out_dir, FO_GBS + ".csv")
+    names, artist_pkl, song_pkl = (os.path.join(out_dir, f) for f in (FO_SONG_ARTIST_MBID_GENRE, FO_ARTIST_ENC, FO_SONG_ENC))
+
+    manifest = incremental.read_manifest(os.path.join(out_dir, FO_MANIFEST))
+    have_previous = os.path.exists(artist_pkl) and os.path.exists(song_pkl) and all(output_exists(f) for f in (gba, gbs, names))
+
+    if manifest is None or manifest["config"] != config_hash() or not have_previous:
+        log("\n--> No usable manifest/previous output, rebuilding every artist...")
+        recomputed = set(tracks_hashes)
+        artists, _ = build_clean_artists(artists_filename, tags_filename, workers)
+
+        artist_enc = encode_lexicographically([artist.mbid for artist in artists.values()])
+        song_enc = encode_lexicographically([song.mbid for artist in artists.values() for song in artist.songs.values()])
+        artist_df, song_df, names_df = frames_from_artists(artists, artist_enc, song_enc)
+        previous_entries = {}
+    else:
+        previous_entries = manifest["artists"]
+        changed, removed = incremental.dirty_artists(manifest, tracks_hashes, tags_hashes)
+
+        # every row is keyed by artist mbid, so drop all rows under the mbids of changed/removed artists...
+        stale_mbids = {previous_entries[name]["mbid"] for name in changed | removed
+                       if name in previous_entries and previous_entries[name]["mbid"] is not None}
+        # ...and redo unchanged artists that share one of those mbids, since their rows go too
+        recomputed = changed | {name for name, entry in previous_entries.items()
+                                if entry["mbid"] in stale_mbids and name in tracks_hashes}
+
+        log(f"\n--> {len(changed)} new/changed and {len(removed)} removed artists, recomputing {len(recomputed)}...")
+        artists, _ = build_clean_artists(artists_filename, tags_filename, workers, only=recomputed)
+        stale_mbids |= {artist.mbid for artist in artists.values()}
+
+        # existing ids stay as they are, new mbids are appended
+        artist_enc = incremental.extend_encoder(read_pkl(artist_pkl), [artist.mbid for artist in artists.values()])
+        song_enc = incremental.extend_encoder(read_pkl(song_pkl),
+                                              [song.mbid for artist in artists.values() for song in artist.songs.values()])
+        new_artist_df, new_song_df, new_names_df = frames_from_artists(artists, artist_enc, song_enc)
+
+        artist_df = incremental.patch_frame(read_output(gba), new_artist_df,
+                                            "artist_mbid", stale_mbids, sort_by="artist_mbid")
+        song_df = incremental.patch_frame(read_output(gbs), new_song_df,
+                                          "artist_mbid", stale_mbids, sort_by="song_mbid")
+        names_df = incremental.patch_frame(read_output(names), new_names_df,
+                                           "artist_mbid", stale_mbids, sort_by="song_mbid")
+
+    entries = {name: entry for name, entry in previous_entries.items() if name in tracks_hashes and name not in recomputed}
+    for name in recomputed:
+        mbid = artists[name].mbid if name in artists else None
+        entries[name] = incremental.manifest_entry(tracks_hashes[name], tags_hashes.get(name), mbid)
+
+    return artist_enc, song_enc, artist_df, song_df, names_df, entries
+
+# ----- Main -----
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Preprocess the Last.fm crawl into the csv's and encoders used for training.")
+    parser.add_argument("--artists", default=FI_ARTISTS, help="artist top tracks json")
+    parser.add_argument("--tags", default=FI_TAGS, help="track tags json")
+    parser.add_argument("--out-dir", default=".", help="directory to write every output into")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="run the per-artist steps in this many processes, fed chunks of artists by this one (Artist/Song path only)")
+    parser.add_argument("--format", choices=["csv", "npy", "both"], default=OUTPUT_FORMAT,
+                        help="write csv's, memory-mappable columnar tables, or both")
+    parser.add_argument("--split-mode", choices=["index", "files"], default=SPLIT_MODE,
+                        help="write train/val/test as row indexes over the full tables (index) or as separate csv's (files)")
+    parser.add_argument("--pack-genres", action="store_true", default=PACK_GENRES,
+                        help="store the genre flags of columnar tables as uint64 bitsets (one bit per genre)")
+    parser.add_argument("--catalog", action="store_true", default=USE_CATALOG,
+                        help="keep the crawl in compact arrays (catalog.py) instead of Artist/Song objects, for large crawls")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"only recompute artists that changed since {FO_MANIFEST} was written and patch the previous outputs")
+    parser.add_argument("--sample", type=float, metavar="FRACTION",
+                        help="only preprocess this fraction of the artists, stratified by top genre and popularity (for quick experiments)")
+    parser.add_argument("--sample-seed", type=int, default=0, help="which --sample to draw")
+    parser.add_argument("--report", default=FO_REPORT,
+                        help="where (relative to --out-dir) to write the json report of per-stage wall/cpu time, peak RSS and item counts")
+    parser.add_argument("--quiet", action="store_true", help="no progress bars or log output (for batch runs)")
+    args = parser.parse_args(argv)
+
+    if args.sample is not None and not 0 < args.sample <= 1:
+        parser.error("--sample must be a fraction in (0, 1]")
+    if args.sample is not None and args.incremental:
+        parser.error("--sample can't be combined with --incremental")
+    if args.catalog and args.incremental:
+        parser.error("--catalog can't be combined with --incremental")
+    if args.catalog and args.workers > 1:
+        parser.error("--catalog runs in one process, it can't be combined with --workers")
+    return args
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    workers = max(1, args.workers)
+    manifest_entries = None
+    instrumentation.set_quiet(args.quiet)
+
+    # outputs all go to out_dir
+    os.makedirs(args.out_dir, exist_ok=True)
+    def out(filename: str) -> str:
+        return os.path.join(args.out_dir, filename)
+
+    log("----- Starting Preprocessing... -----")
+
+    sample = None  # every artist
+    if args.sample is not None:
+        with timed_stage("sample", "artists") as report:
+            strata = artist_strata(args.artists, args.tags)
+            sample = sample_artists(strata, args.sample, args.sample_seed)
+            report.items_in, report.items_out = len(strata), len(sample)
+
+    if args.incremental:
+        with timed_stage("incremental", "artists") as report:
+            artist_enc, song_enc, artist_df, song_df, artist_song_mbid_genres_df, manifest_entries = build_incremental(workers, args.artists, args.tags, args.out_dir)
+            report.items_in, report.items_out = len(manifest_entries), len(artist_df)
+    elif args.catalog:
+        with timed_stage("load", "artists") as report:
+            store = catalog.build_catalog(only_artists(iter_json_items(args.artists), sample),
+                                          only_artists(iter_json_items(args.tags), sample), NA_VAL, catalog_tag_filter())
+            report.items_out = len(store.artist_name)
+        with timed_stage("clean", "artists") as report:
+            clean_catalog(store)
+            report.items_in, report.items_out = len(store.artist_name), int(store.artist_keep.sum())
+
+        # label encode artists and songs by their mbid
+        with timed_stage("encode", "mbids") as report:
+            artist_mbids = store.artist_mbid.lookup(catalog.kept_artists(store))
+            song_mbids = store.song_mbid.lookup(catalog.kept_songs(store))
+            artist_enc = encode_lexicographically(artist_mbids)
+            song_enc = encode_lexicographically(song_mbids)
+            report.items_in, report.items_out = len(artist_mbids) + len(song_mbids), len(artist_enc.classes_) + len(song_enc.classes_)
+
+        with timed_stage("frames", "songs") as report:
+            artist_df = create_genre_by_artist_df_from_catalog(store, artist_enc)
+            song_df = create_genre_by_song_df_from_catalog(store, artist_enc, song_enc)
+            artist_song_mbid_genres_df = songs_with_names(song_df, *catalog.name_lookups(store))
+            report.items_in, report.items_out = len(song_enc.classes_), len(song_df)
+    else:
+        # loading and cleaning run fused per artist (and per chunk of artists with --workers), so they are timed together
+        with timed_stage("load_clean", "artists") as report:
+            artists, stages = build_clean_artists(args.artists, args.tags, workers, only=sample)
+            record_cleaning(report, artists, stages)
+
+        # label encode artists by their mbid (lexicographically by mbid (uuid) string)
+        with timed_stage("encode", "mbids") as report:
+            artist_mbids = [artist.mbid for artist in artists.values()]
+            song_mbids = [song.mbid for artist in artists.values() for song in artist.songs.values()]
+            artist_enc = encode_lexicographically(artist_mbids)
+            song_enc = encode_lexicographically(song_mbids)
+            report.items_in, report.items_out = len(artist_mbids) + len(song_mbids), len(artist_enc.classes_) + len(song_enc.classes_)
+
+        # create the genre-by-artist, genre-by-song, and song id/artist id/names/genre dataframes
+        with timed_stage("frames", "songs") as report:
+            artist_df, song_df, artist_song_mbid_genres_df = frames_from_artists(artists, artist_enc, song_enc)
+            report.items_in, report.items_out = len(song_mbids), len(song_df)
+
+    genre_enc = encode_lexicographically(GENRES)
 
     # write pkl's for encoders
-    write_pkl(artist_enc, FO_ARTIST_ENC)
-    write_pkl(song_enc, FO_SONG_ENC)
-    write_pkl(genre_enc, FO_GENRE_ENC)
-
-    # write full csv's for artist and song
-    write_csv(artist_df, FO_GBA + ".csv")
-    write_csv(song_df, FO_GBS + ".csv")
-
-    # write split data for artists
-    artist_train, artist_val, artist_test = split_df_sets(artist_df)
-    write_csv(artist_train, FO_GBA + "_train.csv")
-    write_csv(artist_val, FO_GBA + "_val.csv")
-    write_csv(artist_test, FO_GBA + "_test.csv")
-
-    # write split data for songs (WITH genres)
-    song_train, song_val, song_test = split_df_sets(song_df)
-    write_csv(song_train, FO_GBS + "_train.csv")
-    write_csv(song_val, FO_GBS + "_val.csv")
-    write_csv(song_test, FO_GBS + "_test.csv")
-
-    # write split data for songs (with OUT genres)
-    song_train_ng, song_val_ng, song_test_ng = split_df_without_genres(song_df)
-    write_csv(song_train_ng, FO_GBS + "_train_no_genres.csv")
-    write_csv(song_val_ng, FO_GBS + "_val_no_genres.csv")
-    write_csv(song_test_ng, FO_GBS + "_test_no_genres.csv")
-
-    print(song_df.columns.values)
-
-    # make and write csv with just song id, artist id, song name, and artist name, then genre
-    artist_song_mbid_genres_df = make_artist_song_mbid_genres(artists, song_df, song_enc, artist_enc)
-    write_csv(artist_song_mbid_genres_df, FO_SONG_ARTIST_MBID_GENRE)
+    with timed_stage("write_encoders"):
+        write_pkl(artist_enc, out(FO_ARTIST_ENC))
+        write_pkl(song_enc, out(FO_SONG_ENC))
+        write_pkl(genre_enc, out(FO_GENRE_ENC))
+
+    # write full tables for artist and song
+    with timed_stage("write_tables", "rows") as report:
+        report.items_in = report.items_out = len(artist_df) + len(song_df)
+        write_output(artist_df, out(FO_GBA + ".csv"), args.format, args.pack_genres)
+        write_output(song_df, out(FO_GBS + ".csv"), args.format, args.pack_genres)
+
+    with timed_stage("write_splits", "rows") as report:
+        report.items_in = report.items_out = len(artist_df) + len(song_df)
+        if args.split_mode == "files":
+            # write split data for artists
+            artist_train, artist_val, artist_test = split_df_sets(artist_df)
+            write_output(artist_train, out(FO_GBA + "_train.csv"), args.format, args.pack_genres)
+            write_output(artist_val, out(FO_GBA + "_val.csv"), args.format, args.pack_genres)
+            write_output(artist_test, out(FO_GBA + "_test.csv"), args.format, args.pack_genres)
+
+            # write split data for songs (WITH genres)
+            song_train, song_val, song_test = split_df_sets(song_df)
+            write_output(song_train, out(FO_GBS + "_train.csv"), args.format, args.pack_genres)
+            write_output(song_val, out(FO_GBS + "_val.csv"), args.format, args.pack_genres)
+            write_output(song_test, out(FO_GBS + "_test.csv"), args.format, args.pack_genres)
+
+            # write split data for songs (with OUT genres)
+            song_train_ng, song_val_ng, song_test_ng = split_df_without_genres(song_df)
+            write_output(song_train_ng, out(FO_GBS + "_train_no_genres.csv"), args.format, args.pack_genres)
+            write_output(song_val_ng, out(FO_GBS + "_val_no_genres.csv"), args.format, args.pack_genres)
+            write_output(song_test_ng, out(FO_GBS + "_test_no_genres.csv"), args.format, args.pack_genres)
+        else:
+            # splits as row indexes over the master tables, assigned by a hash of each mbid
+            write_splits(out(FO_GBA), artist_df["artist_mbid"])
+            write_splits(out(FO_GBS), song_df["song_mbid"])
+
+    log(song_df.columns.values)
+
+    # write csv with just song id, artist id, song name, and artist name, then genre
+    with timed_stage("write_names", "rows") as report:
+        report.items_in = report.items_out = len(artist_song_mbid_genres_df)
+        write_output(artist_song_mbid_genres_df, out(FO_SONG_ARTIST_MBID_GENRE), args.format, args.pack_genres)
+
+    # only record the manifest once every output it describes is on disk
+    if manifest_entries is not None:
+        incremental.write_manifest(out(FO_MANIFEST), config_hash(), manifest_entries)
+
+    instrumentation.summarize()
+    instrumentation.write_report(out(args.report), {**vars(args), "config_hash": config_hash()})
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# the backend scripts import each other by module name (and musicModel/ imports its siblings the same way)
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR / "musicModel"))
+sys.path.insert(0, str(BACKEND_DIR))
@@ -0,0 +1,182 @@
+### crawler.py against a local aiohttp.web stub of the Last.fm api: retries, rate limiting, the response
+### cache, resuming from the journal, and api errors that must not end up journaled
+
+import asyncio
+import json
+import time
+import pytest
+from aiohttp import web
+import crawler
+
+ARTISTS = ["Alpha", "Beta", "Gamma", "Delta"]
+UNKNOWN_ARTIST = "Nobody"
+TRACKS_PER_ARTIST = 3
+
+class StubLastfm:
+    """
+    Answers artist.getTopTracks and track.getTopTags like Last.fm does. replies maps a request
+    (method, artist, track) to a list of scripted replies served before the real one: an int is an
+    http status, a dict a json body. fatal makes every request fail with that api error.
+    """
+
+    def __init__(self):
+        self.requests = list[tuple[float, str, str, str]]()  # (time, method, artist, track)
+        self.replies = dict[tuple[str, str, str], list]()
+        self.fatal = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        query = request.query
+        key = (query["method"], query.get("artist", ""), query.get("track", ""))
+        self.requests.append((time.monotonic(), *key))
+
+        if self.fatal is not None:
+            return web.json_response({"error": self.fatal, "message": "Invalid API key"}, status=403)
+        scripted = self.replies.get(key)
+        if scripted:
+            reply = scripted.pop(0)
+            return web.Response(status=reply) if isinstance(reply, int) else web.json_response(reply)
+
+        method, artist, track = key
+        if artist not in ARTISTS:
+            return web.json_response({"error": 6, "message": "The artist you supplied could not be found"})
+        if method == "artist.getTopTracks":
+            tracks = [{"name": f"{artist} song {i}", "mbid": f"{artist}-{i}", "playcount": "10", "listeners": "5",
+                       "artist": {"name": artist, "mbid": f"{artist}-mbid"}} for i in range(TRACKS_PER_ARTIST)]
+            return web.json_response({"toptracks": {"track": tracks}})
+        return web.json_response({"toptags": {"tag": [{"name": "rock", "count": 100}, {"name": track, "count": 1}]}})
+
+    def fetched(self, artist: str) -> int:
+        return sum(1 for _, _, name, _ in self.requests if name == artist)
+
+async def with_stub(stub: StubLastfm, scenario):
+    # run scenario(base_url) while the stub serves on a free localhost port
+    app = web.Application()
+    app.router.add_get("/2.0/", stub.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    try:
+        return await scenario(f"http://127.0.0.1:{port}/2.0/")
+    finally:
+        await runner.cleanup()
+
+def run_crawl(stub: StubLastfm, tmp_path, artists=ARTISTS) -> int:
+    # a whole crawler.py run (exit status), everything under tmp_path
+    artists_file = tmp_path / "artists.txt"
+    artists_file.write_text("\n".join(artists) + "\n")
+
+    async def scenario(base_url):
+        return await crawler.run(crawler.parse_args([
+            "--artists", str(artists_file), "--api-key", "test", "--base-url", base_url, "--rate", "1000", "--burst", "50",
+            "--cache-dir", str(tmp_path / "cache"), "--artists-out", str(tmp_path / "artist_top_tracks.json"),
+            "--tags-out", str(tmp_path / "track_tags.json"), "--quiet"]))
+    return asyncio.run(with_stub(stub, scenario))
+
+def call_once(stub: StubLastfm, tmp_path, method: str, **params):
+    # one LastfmClient.call(), returns (response, client stats)
+    async def scenario(base_url):
+        async with crawler.aiohttp.ClientSession() as session:
+            client = crawler.LastfmClient(session, "test", base_url, crawler.TokenBucket(1000, 50),
+                                          crawler.ResponseCache(tmp_path / "cache"))
+            return await client.call(method, **params), client.stats
+    return asyncio.run(with_stub(stub, scenario))
+
+@pytest.fixture(autouse=True)
+def quick_backoff(monkeypatch):
+    monkeypatch.setattr(crawler, "RETRY_BACKOFF", 0.01)
+    crawler.set_quiet(True)
+
+def test_retries_rate_limit_and_server_errors(tmp_path):
+    stub = StubLastfm()
+    stub.replies[("artist.getTopTracks", "Alpha", "")] = [429, 503, {"error": 29, "message": "Rate limit exceeded"}]
+
+    data, stats = call_once(stub, tmp_path, "artist.getTopTracks", artist="Alpha")
+    assert len(data["toptracks"]["track"]) == TRACKS_PER_ARTIST
+    assert stats == {"fetched": 1, "cached": 0, "retried": 3}
+    assert stub.fetched("Alpha") == 4
+
+def test_gives_up_after_retries(tmp_path):
+    stub = StubLastfm()
+    stub.replies[("artist.getTopTracks", "Alpha", "")] = [500] * (crawler.MAX_RETRIES + 1)
+
+    with pytest.raises(crawler.CrawlError, match="HTTP 500"):
+        call_once(stub, tmp_path, "artist.getTopTracks", artist="Alpha")
+
+def test_token_bucket_limits_rate(tmp_path):
+    stub = StubLastfm()
+    rate, burst, requests = 40.0, 2, 12
+
+    async def scenario(base_url):
+        async with crawler.aiohttp.ClientSession() as session:
+            client = crawler.LastfmClient(session, "test", base_url, crawler.TokenBucket(rate, burst),
+                                          crawler.ResponseCache(tmp_path / "cache"))
+            await asyncio.gather(*(client.call("track.getTopTags", artist="Alpha", track=f"t{i}") for i in range(requests)))
+    asyncio.run(with_stub(stub, scenario))
+
+    times = sorted(when for when, *_ in stub.requests)
+    assert len(times) == requests
+    # after the burst every request waits for its token
+    assert times[-1] - times[0] >= (requests - burst) / rate * 0.9
+    for first, last in zip(times, times[burst + 4:]):
+        assert last - first >= 4 / rate * 0.9
+
+def test_second_run_is_served_from_cache(tmp_path):
+    stub = StubLastfm()
+    assert run_crawl(stub, tmp_path) == 0
+    assert len(stub.requests) == len(ARTISTS) * (1 + TRACKS_PER_ARTIST)
+    outputs = [(tmp_path / name).read_text() for name in ("artist_top_tracks.json", "track_tags.json")]
+
+    # the journal says every artist is done, and even without it every response is cached
+    (tmp_path / "cache" / crawler.JOURNAL_FILE).unlink()
+    stub.requests.clear()
+    assert run_crawl(stub, tmp_path) == 0
+    assert stub.requests == []
+    assert [(tmp_path / name).read_text() for name in ("artist_top_tracks.json", "track_tags.json")] == outputs
+
+    tracks = json.loads(outputs[0])
+    assert list(tracks) == ARTISTS
+    assert all(len(entries) == TRACKS_PER_ARTIST for entries in tracks.values())
+
+def test_resumes_from_cut_off_journal(tmp_path):
+    stub = StubLastfm()
+    assert run_crawl(stub, tmp_path) == 0
+    outputs = [(tmp_path / name).read_text() for name in ("artist_top_tracks.json", "track_tags.json")]
+
+    # keep the first artist's line and half of the second one, and forget every cached response
+    journal = tmp_path / "cache" / crawler.JOURNAL_FILE
+    lines = journal.read_bytes().splitlines(keepends=True)
+    journal.write_bytes(lines[0] + lines[1][:len(lines[1]) // 2])
+    done = json.loads(lines[0])["artist"]
+    for cached in (tmp_path / "cache").glob("*/*.json"):
+        cached.unlink()
+
+    stub.requests.clear()
+    assert run_crawl(stub, tmp_path) == 0
+    assert stub.fetched(done) == 0
+    assert all(stub.fetched(artist) == 1 + TRACKS_PER_ARTIST for artist in ARTISTS if artist != done)
+    assert [(tmp_path / name).read_text() for name in ("artist_top_tracks.json", "track_tags.json")] == outputs
+    assert sorted(crawler.read_journal(journal)) == sorted(ARTISTS)
+
+def test_fatal_api_error_is_not_journaled(tmp_path):
+    stub = StubLastfm()
+    stub.fatal = 10
+
+    with pytest.raises(crawler.CrawlError, match="error 10"):
+        call_once(stub, tmp_path, "artist.getTopTracks", artist="Alpha")
+    assert stub.fetched("Alpha") == 1  # not retried
+
+    assert run_crawl(stub, tmp_path) == 1
+    assert crawler.read_journal(tmp_path / "cache" / crawler.JOURNAL_FILE) == {}
+    assert not (tmp_path / "artist_top_tracks.json").exists()
+
+    # with a working key the next run crawls every artist
+    stub.fatal = None
+    assert run_crawl(stub, tmp_path) == 0
+    assert list(json.loads((tmp_path / "artist_top_tracks.json").read_text())) == ARTISTS
+
+def test_unknown_artist_is_skipped(tmp_path):
+    stub = StubLastfm()
+    assert run_crawl(stub, tmp_path, ARTISTS + [UNKNOWN_ARTIST]) == 0
+    assert UNKNOWN_ARTIST not in crawler.read_journal(tmp_path / "cache" / crawler.JOURNAL_FILE)
+    assert list(json.loads((tmp_path / "artist_top_tracks.json").read_text())) == ARTISTS
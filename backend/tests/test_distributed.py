@@ -0,0 +1,84 @@
+### trainModel.train() over 2 gloo ranks against a single process on a tiny synthetic songs table: every rank
+### steps on its half of each batch, so the all_reduced metrics and the final weights have to match
+
+import json
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+import torch
+import torch.multiprocessing as mp
+from sklearn.preprocessing import LabelEncoder
+import trainModel
+from splits import splits_filename
+
+SONGS = 400
+ARTISTS = 40
+GENRES = ["ambient", "jazz", "metal", "pop", "rock"]
+TRAIN_ROWS, VAL_ROWS = 320, 40  # an even number of training rows, so no rank pads its share
+PROCS = 2
+# (relative tolerance of the metrics, absolute tolerance of the weights). Dense runs match to ~1e-7. With sparse
+# embeddings gloo sums the ranks' gradients in another (and not even a fixed) order, and Adam turns that into
+# whole lr-sized steps wherever a gradient is close to 0: weights drift by ~1e-3 and the playcount-weighted
+# metrics by ~1e-3 relative over 2 epochs
+TOLERANCES = {"dense": (1e-5, 1e-5), "sparse": (1e-2, 4e-3)}
+
+def write_songs(directory):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({
+        "song_mbid": [f"song-{i:04d}" for i in range(SONGS)],
+        "artist_mbid": [f"artist-{i % ARTISTS:03d}" for i in range(SONGS)],
+        "listeners": rng.integers(1, 5_000, SONGS),
+    })
+    frame["playcount"] = frame.listeners * rng.integers(1, 20, SONGS)
+    for genre in GENRES:
+        frame[genre] = (rng.random(SONGS) < 0.3).astype(np.int8)
+    frame.to_csv(directory / "genre_by_song.csv", index=False)
+
+    rows = np.arange(SONGS)
+    np.savez(splits_filename(directory / "genre_by_song.csv"),
+             train=rows[:TRAIN_ROWS], val=rows[TRAIN_ROWS:TRAIN_ROWS + VAL_ROWS], test=rows[TRAIN_ROWS + VAL_ROWS:])
+
+    for name, values in (("song_labels.pkl", frame.song_mbid), ("artist_labels.pkl", frame.artist_mbid), ("genre_labels.pkl", GENRES)):
+        with open(directory / name, "wb") as f:
+            pickle.dump(LabelEncoder().fit(values), f)
+
+def train_argv(directory, model_out, sparse):
+    argv = ["--songs-dir", str(directory), "--pickles-dir", str(directory), "--cache-dir", str(directory / "cache"),
+            "--model-out", str(model_out), "--epochs", "2", "--batch-size", "32", "--eval-batch-size", "16",
+            "--song-artist-embed", "8", "--genre-embed", "4", "--hidden", "16", "--threads", "1"]
+    return argv + (["--sparse-embeddings"] if sparse else [])
+
+def train_rank(rank, argv, world_size, port, results_file):
+    # spawned per rank, rank 0 keeps what train() returned
+    result = trainModel.train(rank, trainModel.parseArgs(argv), world_size, port)
+    if rank == 0:
+        results_file.write_text(json.dumps(result))
+
+@pytest.fixture(scope="module")
+def songs_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("songs")
+    write_songs(directory)
+    return directory
+
+@pytest.mark.parametrize("mode", TOLERANCES)
+def test_two_ranks_match_one(songs_dir, tmp_path, mode):
+    sparse = mode == "sparse"
+    metric_tolerance, weight_tolerance = TOLERANCES[mode]
+    single = trainModel.train(0, trainModel.parseArgs(train_argv(songs_dir, tmp_path / "single.pth", sparse)))
+
+    results_file = tmp_path / "distributed.json"
+    argv = train_argv(songs_dir, tmp_path / "distributed.pth", sparse)
+    mp.spawn(train_rank, args=(argv, PROCS, trainModel.freePort(), results_file), nprocs=PROCS, join=True)
+    distributed = json.loads(results_file.read_text())
+
+    assert distributed["validation_rmsle"] == pytest.approx(single["validation_rmsle"], rel=metric_tolerance)
+    assert distributed["testing"]["rows"] == single["testing"]["rows"] == SONGS - TRAIN_ROWS - VAL_ROWS
+    for metric in ("poisson", "rmse", "rmsle"):
+        assert distributed["testing"][metric] == pytest.approx(single["testing"][metric], rel=metric_tolerance)
+
+    single_weights = torch.load(tmp_path / "single.pth")
+    distributed_weights = torch.load(tmp_path / "distributed.pth")
+    assert single_weights.keys() == distributed_weights.keys()
+    for name, weights in single_weights.items():
+        assert torch.allclose(distributed_weights[name], weights, rtol=0, atol=weight_tolerance), name
@@ -0,0 +1,61 @@
+### evaluation.PlaycountMetrics / evaluate() against the metrics worked out by hand with numpy, including songs
+### with 0 listeners (counted as 1, like trainModel.trainStep does, so the log mean never becomes -inf)
+
+import math
+import numpy as np
+import pytest
+import torch
+from torch import nn
+from evaluation import PlaycountMetrics, evaluate, logMeans
+
+class FixedRate(nn.Module):
+    # log rate per listener of every song, whatever the artist and genres
+    def __init__(self, logRates):
+        super().__init__()
+        self.logRates = torch.tensor(logRates, dtype=torch.float32)
+
+    def forward(self, songs, artists, genres):
+        return self.logRates[songs]
+
+LOG_RATES = [0.5, -1.0, 2.0, 0.0, 1.5]
+LISTENERS = [10.0, 0.0, 3.0, 0.0, 1.0]
+PLAYCOUNTS = [7.0, 2.0, 0.0, 1.0, 5.0]
+
+def expected_metrics():
+    log_means = np.array(LOG_RATES) + np.log(np.maximum(LISTENERS, 1.0))
+    playcounts = np.array(PLAYCOUNTS)
+    predictions = np.exp(log_means)
+    return {
+        "poisson": np.mean(predictions - playcounts * log_means),
+        "rmse": math.sqrt(np.mean((predictions - playcounts) ** 2)),
+        "rmsle": math.sqrt(np.mean((np.log1p(predictions) - np.log1p(playcounts)) ** 2)),
+        "rows": len(playcounts),
+    }
+
+def batches(batch_size):
+    rows = len(PLAYCOUNTS)
+    songs = torch.arange(rows)
+    for start in range(0, rows, batch_size):
+        part = slice(start, start + batch_size)
+        yield (songs[part], songs[part], torch.tensor(PLAYCOUNTS[part]), torch.tensor(LISTENERS[part]), torch.zeros(len(songs[part]), 1))
+
+def test_log_means_clamp_zero_listeners():
+    means = logMeans(torch.tensor(LOG_RATES), torch.tensor(LISTENERS))
+    assert torch.isfinite(means).all()
+    assert means[1].item() == pytest.approx(LOG_RATES[1])
+
+@pytest.mark.parametrize("batch_size", [1, 2, 5])
+def test_evaluate_matches_numpy(batch_size):
+    metrics = evaluate(FixedRate(LOG_RATES), list(batches(batch_size)), "cpu")
+    expected = expected_metrics()
+
+    assert metrics["rows"] == expected["rows"]
+    for name in ("poisson", "rmse", "rmsle"):
+        assert math.isfinite(metrics[name])
+        assert metrics[name] == pytest.approx(expected[name], rel=1e-6)
+
+def test_metrics_of_training_log_means():
+    # trainStep feeds PlaycountMetrics the same log means, so training and validation metrics agree
+    metrics = PlaycountMetrics("cpu")
+    metrics.update(logMeans(torch.tensor(LOG_RATES), torch.tensor(LISTENERS)), torch.tensor(PLAYCOUNTS))
+    assert metrics.compute() == pytest.approx(evaluate(FixedRate(LOG_RATES), list(batches(2)), "cpu"), rel=1e-6)
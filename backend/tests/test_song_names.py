@@ -0,0 +1,72 @@
+### make_artist_song_mbid_genres against the per-row scan it replaced, on a synthetic 100k-song crawl
+### (benchmarks/generate_lastfm.py), plus a time bound so the quadratic scan can't come back
+
+import time
+import pandas as pd
+import pytest
+import preprocess
+from preprocess import GENRES, NA_VAL, build_clean_artists, encode_lexicographically, create_genre_by_song_df, make_artist_song_mbid_genres
+from benchmarks.generate_lastfm import generate
+
+SONGS = 100_000
+SCANNED_ROWS = 2_000  # rows the old scan is run on (about 0.8s per 1,000 rows at this size)
+TIME_LIMIT = 5.0  # seconds for the whole catalog (about 0.15s here, the old scan takes over a minute)
+
+def scan_artist_song_mbid_genres(artists, songs_df):
+    # the original implementation: a front-to-back scan of every artist (and its songs) for every row
+    song_data = []
+
+    for row in songs_df.values:
+        artist_name = [name for name in artists if artists[name].mbid == row[1]]
+        song_name = []
+
+        if len(artist_name) > 0:
+            artist_name = artist_name[0]
+            song_name = [song.name for song in artists[artist_name].songs.values() if song.mbid == row[0]]
+            if len(song_name) > 0:
+                song_name = song_name[0]
+            else:
+                song_name = NA_VAL
+        else:
+            artist_name = NA_VAL
+
+        genre_values = [row[i] for i in range(len(row) - 2 - len(GENRES), len(row) - 2)]
+
+        row_data = {"song_mbid": row[0], "artist_mbid": row[1], "song_name": song_name, "artist_name": artist_name}
+        row_data.update({GENRES[i]: genre_values[i] for i in range(len(genre_values))})
+        song_data.append(row_data)
+
+    df_songs = pd.DataFrame(song_data)
+    df_songs.sort_values(by="song_mbid", inplace=True)
+    return df_songs
+
+@pytest.fixture(scope="module")
+def crawl_songs(tmp_path_factory):
+    crawl = tmp_path_factory.mktemp("crawl")
+    generate(crawl, SONGS, seed=0)
+
+    preprocess.instrumentation.set_quiet(True)
+    artists, _ = build_clean_artists(str(crawl / "artist_top_tracks.json"), str(crawl / "track_tags.json"), workers=1)
+    artist_enc = encode_lexicographically([artist.mbid for artist in artists.values()])
+    song_enc = encode_lexicographically([song.mbid for artist in artists.values() for song in artist.songs.values()])
+    return artists, create_genre_by_song_df(artists, artist_enc, song_enc), song_enc, artist_enc
+
+def test_matches_scan(crawl_songs):
+    artists, songs_df, song_enc, artist_enc = crawl_songs
+    rows = songs_df.sample(n=SCANNED_ROWS, random_state=0)
+
+    expected = scan_artist_song_mbid_genres(artists, rows)
+    actual = make_artist_song_mbid_genres(artists, rows, song_enc, artist_enc)
+    assert actual.to_csv(index=False) == expected.to_csv(index=False)
+
+def test_whole_catalog_time(crawl_songs):
+    artists, songs_df, song_enc, artist_enc = crawl_songs
+    assert len(songs_df) > SONGS // 2
+
+    start = time.perf_counter()
+    names = make_artist_song_mbid_genres(artists, songs_df, song_enc, artist_enc)
+    seconds = time.perf_counter() - start
+
+    assert len(names) == len(songs_df)
+    assert (names["artist_name"] != NA_VAL).all()
+    assert seconds < TIME_LIMIT, f"{seconds:.2f}s for {len(songs_df)} songs"
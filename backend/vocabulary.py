@@ -0,0 +1,186 @@
+### Picks the GENRES vocabulary from the crawl instead of by hand
+###
+### Streams track_tags.json one artist at a time and tallies, per tag,
+###   frequency: how many songs carry the tag (with a count above --min-count)
+###   reach:     how many artists have a song carrying it
+### Both tallies are Space-Saving summaries (Metwally et al.) of a fixed capacity, so memory stays bounded no
+### matter how many distinct free-text tags the crawl has. Any tag seen more than total / capacity times is
+### guaranteed to be tracked, and its count is over-estimated by at most its recorded error.
+### The top tags (minus obvious non-genre tags) are written to genres.json, which preprocess.py uses in
+### place of its hand-picked list when the file is there.
+###
+### Usage (from backend/): python vocabulary.py --top 60
+
+import argparse
+import heapq
+import json
+import re
+from dataclasses import dataclass
+from canonical import canonical_genre
+from instrumentation import progress, log, set_quiet
+from preprocess import iter_json_items, FI_TAGS, FI_GENRES, GENRE_THRESHOLD
+
+VOCABULARY_VERSION = 1
+TOP_N = 60
+CAPACITY = 100_000  # tags tracked per summary
+
+# Last.fm's most used tags that say nothing about genre
+NON_GENRE_TAGS = {"seen live", "female vocalists", "male vocalists", "favorites", "favorite", "favourites", "favourite",
+                  "love", "beautiful", "awesome", "chill", "mellow", "sexy", "catchy", "party", "cover", "covers",
+                  "albums i own", "under 2000 listeners", "american", "british", "usa", "uk", "canadian", "australian",
+                  "swedish", "german", "french", "japanese", "korean", "spotify", "soundtrack", "singer-songwriter"}
+DECADE_TAG = re.compile(r"^(\d{2}|\d{4})'?s$")  # 80s, 1990s, 00's
+
+# ----- Space-Saving summary -----
+
+class SpaceSaving:
+    """
+    Approximate counts of the most frequent keys in at most capacity entries. When a new key arrives and
+    the summary is full, the key with the smallest count is evicted and the new one takes over its count
+    (recorded as the new key's error).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts = dict[str, int]()
+        self.errors = dict[str, int]()
+        self.heap = list[tuple[int, str]]()  # (count when pushed, key), one entry per tracked key
+        self.total = 0
+
+    def add(self, key: str, weight: int = 1) -> None:
+        self.total += weight
+        if key in self.counts:
+            # the heap entry goes stale; it is refreshed lazily when it reaches the top
+            self.counts[key] += weight
+            return
+
+        if len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+            heapq.heappush(self.heap, (weight, key))
+            return
+
+        minimum, evicted = self.pop_min()
+        del self.counts[evicted]
+        del self.errors[evicted]
+        self.counts[key] = minimum + weight
+        self.errors[key] = minimum
+        heapq.heappush(self.heap, (minimum + weight, key))
+
+    def pop_min(self) -> tuple[int, str]:
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts[key] == count:
+                return count, key
+            heapq.heappush(self.heap, (self.counts[key], key))
+
+    def estimate(self, key: str) -> tuple[int, int]:
+        # (upper bound on the true count, how much of it may be over-estimate); (0, 0) for untracked keys
+        return self.counts.get(key, 0), self.errors.get(key, 0)
+
+    def top(self, n: int | None = None) -> list[tuple[str, int, int]]:
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))
+        return [(key, count, self.errors[key]) for key, count in ranked[:n]]
+
+# ----- Counting -----
+
+@dataclass
+class TagStats:
+    frequency: SpaceSaving
+    reach: SpaceSaving
+    artists: int = 0
+    songs: int = 0
+
+def count_tags(items, capacity: int = CAPACITY, min_count: int = GENRE_THRESHOLD, canonicalize: bool = False) -> TagStats:
+    """
+    Tally tag frequency and reach over (artist, {song: [tags]}) items, e.g. iter_json_items(FI_TAGS).
+    With canonicalize, every spelling of a genre is counted under its canonical name (see canonical.py).
+    """
+    stats = TagStats(SpaceSaving(capacity), SpaceSaving(capacity))
+
+    pbar = progress(unit="artist")
+    for artist, songs in items:
+        artist_tags = set[str]()
+
+        for tags in songs.values():
+            # a tag listed twice on one song still counts once
+            song_tags = {tag["name"] for tag in tags if tag.get("count", 0) > min_count}
+            if canonicalize:
+                song_tags = {canonical_genre(name) for name in song_tags}
+            for name in song_tags:
+                stats.frequency.add(name)
+            artist_tags |= song_tags
+            stats.songs += 1
+
+        for name in artist_tags:
+            stats.reach.add(name)
+        stats.artists += 1
+        pbar.update(1)
+    pbar.close()
+
+    return stats
+
+def is_genre_tag(name: str) -> bool:
+    return name.casefold() not in NON_GENRE_TAGS and not DECADE_TAG.match(name)
+
+def pick_vocabulary(stats: TagStats, top_n: int, rank_by: str = "reach", keep_all: bool = False) -> list[dict]:
+    """
+    The top_n tags ranked by rank_by ("reach" or "frequency", the other one breaks ties),
+    with their estimated counts and error bounds.
+    """
+    ranked, other = (stats.reach, stats.frequency) if rank_by == "reach" else (stats.frequency, stats.reach)
+
+    candidates = [(name, count) for name, count, _ in ranked.top() if keep_all or is_genre_tag(name)]
+    candidates.sort(key=lambda item: (-item[1], -other.estimate(item[0])[0], item[0]))
+
+    vocabulary = []
+    for name, _ in candidates[:top_n]:
+        reach, reach_error = stats.reach.estimate(name)
+        frequency, frequency_error = stats.frequency.estimate(name)
+        vocabulary.append({"name": name, "reach": reach, "reach_error": reach_error,
+                           "frequency": frequency, "frequency_error": frequency_error})
+    return vocabulary
+
+# ----- Main -----
+
+def write_vocabulary(filename: str, vocabulary: list[dict], stats: TagStats, config: dict) -> None:
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": VOCABULARY_VERSION,
+            "genres": sorted(tag["name"] for tag in vocabulary),  # what preprocess.py reads
+            "tags": vocabulary,  # in rank order, with their counts
+            "artists": stats.artists,
+            "songs": stats.songs,
+            "config": config,
+        }, f, indent=2)
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Pick the genre vocabulary from the most used tags of the crawl.")
+    parser.add_argument("--tags", default=FI_TAGS, help="track tags json")
+    parser.add_argument("--out", default=FI_GENRES)
+    parser.add_argument("--top", type=int, default=TOP_N, help="how many genres to keep")
+    parser.add_argument("--rank-by", choices=["reach", "frequency"], default="reach")
+    parser.add_argument("--capacity", type=int, default=CAPACITY, help="tags tracked at once (bounds memory)")
+    parser.add_argument("--min-count", type=int, default=GENRE_THRESHOLD,
+                        help="ignore tags with at most this count on a song (they never mark a song as that genre)")
+    parser.add_argument("--canonicalize", action="store_true",
+                        help="count spellings of one genre together (for preprocess.py with CANONICALIZE_GENRES)")
+    parser.add_argument("--keep-all", action="store_true", help="don't drop non-genre tags such as 'seen live' or '80s'")
+    parser.add_argument("--quiet", action="store_true")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    set_quiet(args.quiet)
+
+    log(f"\n--> Counting tags in {args.tags}...")
+    stats = count_tags(iter_json_items(args.tags), args.capacity, args.min_count, args.canonicalize)
+    vocabulary = pick_vocabulary(stats, args.top, args.rank_by, args.keep_all)
+
+    config = {"top": args.top, "rank_by": args.rank_by, "capacity": args.capacity, "min_count": args.min_count,
+              "canonicalize": args.canonicalize, "keep_all": args.keep_all}
+    write_vocabulary(args.out, vocabulary, stats, config)
+    log(f"--> {len(vocabulary)} genres from {stats.songs} songs by {stats.artists} artists written to {args.out}")
+
+if __name__ == "__main__":
+    main()